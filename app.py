@@ -1,25 +1,28 @@
 import os
-import uuid
-import zipfile
+import json
+import time
 import shutil
 import traceback
-import time # Добавим для имитации работы и очистки
-import openpyxl # <--- ДОБАВЛЕН ИМПОРТ OPENPYXL
 import dispatcher # <<< ИМПОРТИРУЕМ НОВЫЙ МОДУЛЬ ДИСПЕТЧЕРА
-import re # <<< ДОБАВЛЯЕМ ИМПОРТ RE
-from flask import Flask, request, render_template, jsonify, send_from_directory, url_for
+import pipeline # Конвейер обработки загрузки (распаковка, парсинг, итоговый файл)
+import worker_pool
+from jobs import JobQueue
+from status_store import create_status_store
+from results_store import ResultsStore, job_dir_name
+from archive_reader import check_upload
+from upload_stream import receive_multipart_upload, UploadError, UPLOAD_MAX_BYTES
+from metrics import JobMetrics, REGISTRY
+from output_writer import available_output_formats, output_format_error, OUTPUT_FORMAT_XLSX, OUTPUT_FORMAT_LABELS
+from flask import Flask, request, render_template, jsonify, send_from_directory, url_for, Response, stream_with_context
 from werkzeug.utils import secure_filename
-from openpyxl.styles import Alignment, Font # Убедитесь, что Font тоже импортирован
-from formatting import (
-    read_reference_widths,
-    auto_adjust_column_width,
-    apply_reference_widths,
-    apply_formatting
-)
 
 # --- Конфигурация Flask ---
 app = Flask(__name__)
 
+# Процесс пула (worker_pool, fork-сервер или spawn) при запуске "python app.py" импортирует этот модуль
+# как __mp_main__: маршруты ему не нужны, фоновые службы (очистка, очередь задач, пул) в нем не запускаются
+IS_POOL_WORKER = __name__ == '__mp_main__'
+
 # <<< НАЧАЛО ИЗМЕНЕНИЙ: Настройки для отключения кэша в разработке >>>
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0 # Отключает кэширование статических файлов браузером
 app.config['TEMPLATES_AUTO_RELOAD'] = True # Автоматически перезагружает шаблоны при изменении
@@ -27,30 +30,58 @@ app.config['DEBUG'] = True # Убедимся, что включен режим
 # <<< КОНЕЦ ИЗМЕНЕНИЙ >>>
 
 UPLOAD_FOLDER = 'uploads'
+UPLOAD_INCOMING_FOLDER = os.path.join(UPLOAD_FOLDER, '.incoming') # Файлы, которые еще принимаются
 RESULTS_FOLDER = 'results'
-REFERENCE_FOLDER = 'reference_files'
+REFERENCE_FOLDER = pipeline.REFERENCE_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 os.makedirs(REFERENCE_FOLDER, exist_ok=True)
 
-REFERENCE_SMETA_RU = os.path.join(REFERENCE_FOLDER, "Смета ру.xlsm") # Укажите точное имя вашего референсного файла
-REFERENCE_TURBOSMETCHIK = os.path.join(REFERENCE_FOLDER, "Турбосметчик1,2,3.xlsm") # <-- ДОБАВЛЕНО
-
 ALLOWED_EXTENSIONS = {'xlsx', 'xlsm', 'zip'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['RESULTS_FOLDER'] = RESULTS_FOLDER
-# Ограничение размера файла (например, 100 MB) - раскомментируйте, если нужно
-# app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
-
-# === Глобальный словарь для хранения статуса обработки ===
-# Ключ - session_id, Значение - словарь {"processed": N, "total": M, "status": "...", "error": None}
-processing_status = {}
+# Ограничение размера файла (UPLOAD_MAX_BYTES, по умолчанию 200 MB) и всего тела запроса (файл + поля формы)
+app.config['UPLOAD_MAX_BYTES'] = UPLOAD_MAX_BYTES
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES + 1024 * 1024
+# Число процессов для параллельной обработки файлов из ZIP архива (1 - последовательно, без пула)
+app.config['PROCESSING_WORKERS'] = int(os.environ.get('PROCESSING_WORKERS', '1'))
+# Запускать и прогревать процессы пула при старте приложения (иначе - на первой загрузке архива)
+app.config['WORKER_POOL_PREWARM'] = os.environ.get('WORKER_POOL_PREWARM', '1') == '1'
+# Число рабочих потоков очереди фоновых задач (одновременно обрабатываемых загрузок)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', '2'))
+# SSE прогресса: как часто перечитывать статус без уведомления (изменения из других процессов)
+# и через сколько секунд тишины отправлять комментарий-пинг, чтобы прокси не закрыл соединение
+app.config['PROGRESS_EVENTS_POLL_SECONDS'] = float(os.environ.get('PROGRESS_EVENTS_POLL_SECONDS', '1'))
+app.config['PROGRESS_EVENTS_PING_SECONDS'] = float(os.environ.get('PROGRESS_EVENTS_PING_SECONDS', '15'))
+# Сколько секунд ждать появления статуса неизвестной (или уже удаленной из хранилища) задачи до закрытия потока
+app.config['PROGRESS_EVENTS_MISSING_SECONDS'] = float(os.environ.get('PROGRESS_EVENTS_MISSING_SECONDS', '10'))
+
+# === Хранилище статусов обработки (status_store.py) ===
+# Ключ - session_id (он же job_id), Значение - словарь {"processed": N, "total": M, "status": "...", "error": None,
+# "download_url": ..., "download_filename": ..., "message": ...} - ссылка на результат появляется со статусом "Готово"
+# "timings": {...} - времена этапов и счетчики задачи (metrics.JobMetrics), обновляются по ходу обработки
+# Бэкенд - STATUS_STORE (memory - в памяти процесса, sqlite - общий файл для всех воркеров);
+# статусы удаляются через STATUS_TTL_SECONDS после последнего обновления и сверх STATUS_MAX_ENTRIES
+processing_status = create_status_store()
 # =========================================================
 
-def allowed_file(filename):
-    """Проверяет, имеет ли файл разрешенное расширение."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# === Итоговые файлы: results/<job_id>/<имя>, квоты по возрасту и размеру (results_store.py) ===
+# RESULTS_MAX_AGE_SECONDS / RESULTS_MAX_BYTES - квоты, RESULTS_SWEEP_INTERVAL - период фоновой очистки
+results_store = ResultsStore(RESULTS_FOLDER)
+if not IS_POOL_WORKER: results_store.start_sweeper()
+# ============================================================================================
+
+# === Очередь фоновых задач: /upload только принимает файл, обработка идет в рабочих потоках ===
+job_queue = None if IS_POOL_WORKER else JobQueue(num_workers=app.config['JOB_WORKERS'])
+# ============================================================================================
+
+# === Прогрев: референсные ширины - в кэш процесса, процессы пула (worker_pool.py) - до первой загрузки ===
+# WORKER_MAX_TASKS_PER_CHILD - после скольких задач процесс пула заменяется новым
+if not IS_POOL_WORKER:
+    pipeline.warm_up()
+    if app.config['PROCESSING_WORKERS'] > 1 and app.config['WORKER_POOL_PREWARM']:
+        worker_pool.get_shared_pool(app.config['PROCESSING_WORKERS']).start_in_background()
+# ============================================================================================
 
 # --- Маршруты ---
 
@@ -60,265 +91,147 @@ def index():
     try:
         # Получаем доступные типы смет из процессора
         smeta_types = dispatcher.get_available_processor_types()
-        return render_template('index.html', smeta_types=smeta_types)
+        return render_template('index.html', smeta_types=smeta_types, auto_type=dispatcher.AUTO_DETECT_TYPE,
+                               output_formats=available_output_formats(), output_format_labels=OUTPUT_FORMAT_LABELS)
     except Exception as e:
         print(f"Ошибка при загрузке типов смет: {e}")
         traceback.print_exc() # Добавим вывод traceback для диагностики
         # Можно вернуть страницу с ошибкой или пустой список
-        return render_template('index.html', smeta_types=[], error="Не удалось загрузить типы смет.")
+        return render_template('index.html', smeta_types=[], auto_type=None, error="Не удалось загрузить типы смет.")
 
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Обрабатывает загрузку файла, запускает процессор и сохраняет статус."""
+    """Принимает файл, ставит обработку в очередь фоновых задач и сразу возвращает job_id."""
+    # === Прием тела потоком: файл пишется на диск блоками (upload_stream), отказ - как только ясна причина ===
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({"success": False, "error": "Файл не выбран"}), 400
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        # Размер тела известен заранее - отказываем, не читая его
+        return jsonify({"success": False, "error": "Файл слишком большой."}), 413
+    save_started = time.perf_counter()
+    try:
+        upload = receive_multipart_upload(request.stream, boundary.encode('latin-1'), UPLOAD_INCOMING_FOLDER,
+                                          allowed_extensions=ALLOWED_EXTENSIONS, max_bytes=app.config['UPLOAD_MAX_BYTES'])
+    except UploadError as ue:
+        print(f"[ОШИБКА загрузки] {ue}")
+        return jsonify({"success": False, "error": str(ue)}), ue.status_code
+    save_seconds = time.perf_counter() - save_started
+    # ============================================================================================
+
     # === Получаем ID сессии от клиента ===
-    client_session_id = request.form.get('client_session_id')
-    if not client_session_id:
-        return jsonify({"success": False, "error": "Отсутствует ID сессии клиента"}), 400
+    client_session_id = upload.fields.get('client_session_id')
+    smeta_type = upload.fields.get('smeta_type')
+    # Режим вывода: координаты ячеек (по умолчанию), их значения или и то, и другое
+    output_mode = upload.fields.get('output_mode') or dispatcher.OUTPUT_COORDS
+    # Формат итогового файла: .xlsx (по умолчанию), CSV, JSON Lines или Parquet (если установлен pyarrow)
+    output_format = upload.fields.get('output_format') or OUTPUT_FORMAT_XLSX
+    error = None
+    if not client_session_id: error = "Отсутствует ID сессии клиента"
+    elif not job_dir_name(client_session_id): error = "Некорректный ID сессии клиента"
+    elif not smeta_type: error = "Тип сметы не выбран"
+    elif output_mode not in dispatcher.OUTPUT_MODES: error = f"Неизвестный режим вывода: {output_mode}"
+    else: error = output_format_error(output_format)
+    if error:
+        os.remove(upload.path)
+        return jsonify({"success": False, "error": error}), 400
     # =======================================
 
-    if 'file' not in request.files: return jsonify({"success": False, "error": "Файл не выбран"}), 400
-    file = request.files['file']
-    smeta_type = request.form.get('smeta_type')
-    if not smeta_type: return jsonify({"success": False, "error": "Тип сметы не выбран"}), 400
-    if file.filename == '': return jsonify({"success": False, "error": "Файл не выбран"}), 400
-
-    # Временная папка для конкретной сессии загрузки
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], client_session_id)
+    # Временная папка для конкретной сессии загрузки (ID от клиента - имя папки очищено, как в results_store)
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], job_dir_name(client_session_id))
     # Убедимся, что папка чистая перед началом
     if os.path.exists(upload_path): shutil.rmtree(upload_path)
     os.makedirs(upload_path, exist_ok=True)
 
-    saved_file_path = None # Определим позже
-
-    try: # Главный try для всей обработки запроса
-        if file and allowed_file(file.filename):
-            original_filename_unsafe = file.filename
-            print(f"({client_session_id}) Получен файл: {original_filename_unsafe}")
-            is_zip = original_filename_unsafe.lower().endswith('.zip')
-            is_excel = original_filename_unsafe.lower().endswith(('.xlsx', '.xlsm'))
-            safe_filename_for_saving = secure_filename(original_filename_unsafe)
-            if not safe_filename_for_saving:
-                 extension = ".zip" if is_zip else (".xlsx" if is_excel else ".file")
-                 safe_filename_for_saving = f"uploaded_file{extension}" # Упростили имя
-                 print(f"({client_session_id}) secure_filename пустое, сгенерировано: {safe_filename_for_saving}")
-
-            saved_file_path = os.path.join(upload_path, safe_filename_for_saving)
-            file.save(saved_file_path)
-            print(f"({client_session_id}) Сохранен как: {saved_file_path}")
-
-            files_to_process_info = []
-            if is_zip:
-                # --- Инициализация статуса для ZIP ---
-                processing_status[client_session_id] = {"processed": 0, "total": 0, "status": "Распаковка...", "error": None}
-                print(f"({client_session_id}) ZIP архив. Распаковка...")
-                # ------------------------------------
-                extract_path = os.path.join(upload_path, 'extracted')
-                os.makedirs(extract_path, exist_ok=True)
-                try:
-                    with zipfile.ZipFile(saved_file_path, 'r') as zip_ref:
-                        # === Получаем и СОРТИРУЕМ список файлов ===
-                        file_list_in_zip = sorted([m for m in zip_ref.infolist() if not m.is_dir() \
-                                                  and not m.filename.startswith('__MACOSX/') \
-                                                  and not m.filename.startswith('.') \
-                                                  and m.filename.lower().endswith(('.xlsx', '.xlsm'))],
-                                                  key=lambda member: member.filename)
-                        # --- Обновляем total в статусе ---
-                        processing_status[client_session_id]["total"] = len(file_list_in_zip)
-                        processing_status[client_session_id]["status"] = "Найдено файлов: {}".format(len(file_list_in_zip))
-                        print(f"({client_session_id}) Найдено и отсортировано файлов в ZIP: {[m.filename for m in file_list_in_zip]}")
-                        # ---------------------------------
-
-                        for member in file_list_in_zip:
-                            try: filename_decoded = member.filename.encode('cp437').decode('utf-8', 'ignore')
-                            except: filename_decoded = member.filename.encode('cp437').decode('cp437', 'ignore')
-                            target_path = os.path.join(extract_path, os.path.basename(filename_decoded))
-                            try:
-                                with zip_ref.open(member) as source, open(target_path, "wb") as target: shutil.copyfileobj(source, target)
-                                files_to_process_info.append({"path": target_path, "original_name": filename_decoded})
-                            except Exception as extract_err: print(f"  [WARN] ({client_session_id}) Не удалось извлечь {filename_decoded}: {extract_err}")
-
-                    if not files_to_process_info: raise ValueError("В архиве не найдено поддерживаемых Excel файлов.")
-
-                except zipfile.BadZipFile: raise ValueError("Некорректный ZIP архив.")
-                except ValueError as ve: raise ve
-                except Exception as e: raise ValueError(f"Ошибка при распаковке ZIP: {e}")
-
-            elif is_excel:
-                print(f"({client_session_id}) Одиночный Excel файл.")
-                 # --- Инициализация статуса для одного файла ---
-                processing_status[client_session_id] = {"processed": 0, "total": 1, "status": "Подготовка...", "error": None}
-                # ------------------------------------------
-                files_to_process_info.append({"path": saved_file_path, "original_name": original_filename_unsafe})
-            else:
-                raise ValueError(f"Неподдерживаемый тип файла: {original_filename_unsafe}.")
-
-            # --- Сбор данных от процессора и обновление статуса ---
-            collected_results = []
-            has_errors = False
-            common_headers = None
-
-            for i, file_info in enumerate(files_to_process_info):
-                input_fpath = file_info["path"]
-                original_fname = file_info["original_name"]
-
-                # --- Обновляем статус перед обработкой файла ---
-                current_total = processing_status.get(client_session_id, {}).get("total", len(files_to_process_info))
-                processing_status[client_session_id]["status"] = f"Обработка файла {i+1} из {current_total}: {original_fname}..."
-                print(f"\n({client_session_id}) {processing_status[client_session_id]['status']}")
-                # ---------------------------------------------
-
-                try:
-                    headers, data_rows = dispatcher.run_processor(smeta_type=smeta_type, input_path=input_fpath)
-                    if headers and data_rows is not None:
-                        print(f"  ({client_session_id}) Получено строк данных: {len(data_rows)}")
-                        collected_results.append((original_fname, headers, data_rows))
-                        if common_headers is None: common_headers = headers
-                        elif common_headers != headers: print("[WARN] Заголовки отличаются!")
-                        # --- Обновляем processed count в статусе ПОСЛЕ УСПЕХА ---
-                        processing_status[client_session_id]["processed"] += 1
-                        # ------------------------------------------------------
-                    else:
-                        print(f"  [ОШИБКА] ({client_session_id}) Обработчик не вернул данные для {original_fname}")
-                        processing_status[client_session_id]["error"] = f"Ошибка обработки {original_fname}" # Отмечаем ошибку в статусе
-                        has_errors = True
-                except Exception as e:
-                    print(f"  [КРИТИЧЕСКАЯ ОШИБКА] ({client_session_id}) при обработке данных из {original_fname}: {e}")
-                    processing_status[client_session_id]["error"] = f"Критическая ошибка при обработке {original_fname}"
-                    traceback.print_exc(); has_errors = True
-
-            # --- Анализ собранных данных ---
-            if not collected_results:
-                error_msg = "Во время обработки произошли ошибки, результаты не получены." if has_errors else "Не найдено данных для обработки."
-                # Обновляем статус перед выбросом ошибки
-                if client_session_id in processing_status:
-                    processing_status[client_session_id]["status"] = "Ошибка"
-                    processing_status[client_session_id]["error"] = error_msg
-                raise ValueError(error_msg)
-
-            # --- Обновляем статус: Подготовка итогового файла ---
-            processing_status[client_session_id]["status"] = "Подготовка итогового файла..."
-            # ---------------------------------------------------
-
-            # --- Чтение референсных ширин ---
-            reference_widths = None
-            reference_file_to_read = None # Определяем какой файл читать
-            if smeta_type == "Смета ру":
-                reference_file_to_read = REFERENCE_SMETA_RU
-            elif smeta_type.startswith("Турбосметчик-"): # <-- ИСПРАВЛЕНО: Проверяем начало строки
-                 reference_file_to_read = REFERENCE_TURBOSMETCHIK
-
-            if reference_file_to_read and os.path.exists(reference_file_to_read):
-                print(f"({client_session_id}) Чтение референсных ширин из {os.path.basename(reference_file_to_read)}...") # <-- ИЗМЕНЕНО: Используем переменную
-                try:
-                     # Используем импортированный openpyxl
-                     wb_ref = openpyxl.load_workbook(filename=reference_file_to_read, data_only=True, keep_vba=False) # <-- ИЗМЕНЕНО: Используем переменную
-                     ws_ref = wb_ref.active; reference_widths = []
-                     target_columns = ['A', 'B', 'C', 'D', 'E', 'F'] # Те же колонки A-F
-                     for col_letter in target_columns: width = ws_ref.column_dimensions[col_letter].width if col_letter in ws_ref.column_dimensions else None; reference_widths.append(width if width is not None else 8.43) # Стандартная ширина 8.43, если не задана
-                     print(f"  ({client_session_id}) Референсные ширины: {reference_widths}"); wb_ref.close()
-                except Exception as e:
-                    print(f"  [WARN] ({client_session_id}) Ошибка чтения реф. файла ({os.path.basename(reference_file_to_read)}): {e}.") # <-- ИЗМЕНЕНО: Используем переменную
-                    reference_widths = None # Сбрасываем ширины при ошибке
-            elif reference_file_to_read: # Если файл должен был быть, но его нет
-                 print(f"  [WARN] ({client_session_id}) Реф. файл не найден: {reference_file_to_read}.")
-            # --- Если reference_file_to_read is None (другой тип сметы), то reference_widths останется None ---
-
-            # --- Создание и сохранение итогового файла ---
-            final_wb = openpyxl.Workbook(); final_ws = final_wb.active # Используем openpyxl
-            original_base_name = os.path.splitext(original_filename_unsafe)[0]
-
-            # Очищаем базовое имя: разрешаем буквы (вкл. кириллицу), цифры, пробелы, _, -.
-            # Заменяем другие потенциально проблемные символы на _.
-            # Удаляем начальные/конечные пробелы и заменяем множественные пробелы одним.
-            safe_base_name = re.sub(r'[^\w\s.-]+', '_', original_base_name, flags=re.UNICODE) # Оставляем буквы, цифры, _, пробел, -, . (Дефис в конце)
-            safe_base_name = re.sub(r'\s+', ' ', safe_base_name).strip() # Убираем лишние пробелы
-            # Дополнительно заменяем символы, опасные для файловых систем
-            safe_base_name = re.sub(r'[\\\\/:*?"<>|]+', '_', safe_base_name)
-            safe_base_name = safe_base_name.replace('..', '_') # Предотвращаем выход из директории
-
-            if not safe_base_name: # Если имя стало пустым после очистки
-                 safe_base_name = f"file_{uuid.uuid4().hex[:8]}" # Генерируем запасное имя
-
-            output_filename = f"{safe_base_name}_processed.xlsx"
-            final_ws.title = safe_base_name[:31] # Используем очищенное имя для названия листа
-
-            # Используем наше очищенное имя. secure_filename больше не нужен здесь,
-            # т.к. мы сами провели очистку.
-            safe_output_filename = output_filename
-
-            # Запасной вариант, если имя все равно оказалось некорректным (маловероятно)
-            if not safe_output_filename or len(safe_output_filename) > 200: # Добавим проверку длины
-                safe_output_filename = f"result_{client_session_id}.xlsx"
-
-            output_file_path = os.path.join(app.config['RESULTS_FOLDER'], safe_output_filename)
-            print(f"({client_session_id}) Подготовка итогового файла: {safe_output_filename}")
-
-            if common_headers: final_ws.append(common_headers)
-            print(f"({client_session_id}) Запись данных в итоговый файл...")
-            for index, (original_fname, headers, data_rows) in enumerate(collected_results):
-                if len(collected_results) > 1: # Добавляем разделитель, если файлов > 1
-                    separator_row_idx = final_ws.max_row + 1; merge_range = f'A{separator_row_idx}:F{separator_row_idx}'
-                    print(f"  ({client_session_id}) Доб. разделитель '{original_fname}' в строку {separator_row_idx}")
-                    try:
-                        final_ws.merge_cells(merge_range); cell = final_ws.cell(row=separator_row_idx, column=1)
-                        cell.value = original_fname; cell.alignment = Alignment(horizontal='center', vertical='center'); cell.font = Font(bold=True)
-                    except Exception as merge_err: print(f"  [WARN] ({client_session_id}) Ошибка merge разделителя: {merge_err}"); final_ws.cell(row=separator_row_idx, column=1).value = original_fname
-                for row in data_rows: final_ws.append(row) # Добавляем данные
-                print(f"  ({client_session_id}) Добавлено {len(data_rows)} строк из {original_fname}")
-
-            # --- Обновляем статус: Форматирование ---
-            processing_status[client_session_id]["status"] = "Применение форматирования..."
-            # ---------------------------------------
-            # --- ПРИМЕНЕНИЕ ШИРИН И ФОРМАТИРОВАНИЯ ---
-            if reference_widths: # Применяем референсные ширины, если они были успешно прочитаны
-                print(f"({client_session_id}) Применение референсных ширин...")
-                apply_reference_widths(final_ws, reference_widths)
-            else: # Иначе используем автоподбор
-                print(f"({client_session_id}) Автоподбор ширины колонок...")
-                auto_adjust_column_width(final_ws)
-            # --- КОНЕЦ ИЗМЕНЕНИЙ В БЛОКЕ ПРИМЕНЕНИЯ ШИРИН ---
-            apply_formatting(final_ws)
-
-            # --- Обновляем статус: Сохранение ---
-            processing_status[client_session_id]["status"] = "Сохранение файла..."
-            # -----------------------------------
-            final_wb.save(output_file_path); final_wb.close()
-            print(f"({client_session_id}) Итоговый файл сохранен: {output_file_path}")
-
-            # --- Успешный ответ ---
-            final_message = "Обработка завершена."; download_url = url_for('download_file', filename=safe_output_filename)
-            if has_errors: final_message += " Были ошибки при обработке некоторых файлов."
-            if len(collected_results) < len(files_to_process_info): final_message += " Не все файлы из архива были успешно обработаны."
-
-            # --- Обновляем статус: Готово ---
-            processing_status[client_session_id]["status"] = "Готово"
-            # -------------------------------
-
-            return jsonify({"success": True, "message": final_message, "download_url": download_url, "download_filename": safe_output_filename })
-
-        else: # Если файл не прошел allowed_file
-             raise ValueError(f"Недопустимый тип файла: {original_filename_unsafe}.")
-
-    except ValueError as ve: # Ловим ошибки типа файла, распаковки, отсутствия данных
+    try: # Главный try для приема файла
+        original_filename_unsafe = upload.filename
+        print(f"({client_session_id}) Получен файл: {original_filename_unsafe} ({upload.size} байт)")
+        is_zip = original_filename_unsafe.lower().endswith('.zip')
+        is_excel = original_filename_unsafe.lower().endswith(('.xlsx', '.xlsm'))
+        safe_filename_for_saving = secure_filename(original_filename_unsafe)
+        if not safe_filename_for_saving:
+             extension = ".zip" if is_zip else (".xlsx" if is_excel else ".file")
+             safe_filename_for_saving = f"uploaded_file{extension}" # Упростили имя
+             print(f"({client_session_id}) secure_filename пустое, сгенерировано: {safe_filename_for_saving}")
+
+        saved_file_path = os.path.join(upload_path, safe_filename_for_saving)
+        os.replace(upload.path, saved_file_path) # Тот же диск - перенос без копирования
+        print(f"({client_session_id}) Сохранен как: {saved_file_path}")
+        # Оглавление ZIP (без распаковки): архив без Excel файлов или не книга Excel - отказ до очереди
+        check_upload(saved_file_path, is_zip)
+
+        # --- Ставим задачу в очередь и сразу отвечаем ---
+        status = processing_status.create(client_session_id, {
+            "processed": 0, "total": 0, "status": "В очереди...", "error": None,
+            "download_url": None, "download_filename": None, "message": None})
+        job_metrics = JobMetrics(status, smeta_type)
+        job_metrics.add_stage_time("upload_save", save_seconds)
+        job_queue.submit(client_session_id, run_upload_job, client_session_id, upload_path, saved_file_path,
+                         original_filename_unsafe, smeta_type, request.url_root, job_metrics, output_mode,
+                         output_format)
+        print(f"({client_session_id}) Задача поставлена в очередь (ожидают: {job_queue.pending()})")
+        return jsonify({"success": True, "job_id": client_session_id,
+                        "progress_url": url_for('get_progress', session_id=client_session_id),
+                        "events_url": url_for('progress_events', session_id=client_session_id)}), 202
+        # ------------------------------------------------
+
+    except ValueError as ve: # Ловим ошибки типа и содержимого файла
          print(f"[ОШИБКА обработки] ({client_session_id}) {ve}")
-         # --- Обновляем статус при ошибке ---
-         if client_session_id in processing_status: processing_status[client_session_id]["status"] = "Ошибка"; processing_status[client_session_id]["error"] = str(ve)
-         # ----------------------------------
+         shutil.rmtree(upload_path, ignore_errors=True)
          return jsonify({"success": False, "error": str(ve)}), 400
     except Exception as e: # Ловим все остальные ошибки
         print(f"[КРИТИЧЕСКАЯ ОШИБКА] ({client_session_id}) /upload: {e}")
-        # --- Обновляем статус при ошибке ---
-        if client_session_id in processing_status: processing_status[client_session_id]["status"] = "Критическая ошибка"; processing_status[client_session_id]["error"] = "Внутренняя ошибка сервера."
-        # ----------------------------------
         traceback.print_exc()
+        shutil.rmtree(upload_path, ignore_errors=True)
         return jsonify({"success": False, "error": "Внутренняя ошибка сервера."}), 500
+
+
+@app.errorhandler(413)
+def request_too_large(error):
+    """Тело запроса больше MAX_CONTENT_LENGTH (Werkzeug прерывает чтение потока)."""
+    return jsonify({"success": False, "error": "Файл слишком большой."}), 413
+
+
+def run_upload_job(client_session_id, upload_path, saved_file_path, original_filename_unsafe, smeta_type, base_url,
+                   job_metrics=None, output_mode=dispatcher.OUTPUT_COORDS, output_format=OUTPUT_FORMAT_XLSX):
+    """Фоновая задача: весь конвейер обработки загрузки. Результат публикуется через processing_status."""
+    # Статус задачи - один объект на задачу (его же обновляет job_metrics), каждый status.update - запись в хранилище
+    if job_metrics is not None and job_metrics.status is not None:
+        status = job_metrics.status
+    else:
+        status = processing_status.attach(client_session_id)
+        job_metrics = JobMetrics(status, smeta_type)
+    outcome = "critical"
+    try:
+        result = pipeline.process_upload(client_session_id, saved_file_path, original_filename_unsafe, smeta_type,
+                                         upload_path, status, results_folder=app.config['RESULTS_FOLDER'],
+                                         workers=app.config['PROCESSING_WORKERS'], job_metrics=job_metrics,
+                                         results_store=results_store, output_mode=output_mode,
+                                         output_format=output_format)
+        # url_for вне запроса: восстанавливаем контекст с адресом исходного запроса
+        with app.test_request_context(base_url=base_url):
+            download_url = url_for('download_file', job_id=client_session_id, filename=result["output_filename"])
+        # --- Обновляем статус: Готово (ссылка на скачивание - до смены статуса) ---
+        status.update({"download_url": download_url, "download_filename": result["output_filename"], "message": result["message"],
+                       "status": "Готово"})
+        outcome = "done"
+        # -------------------------------
+    except ValueError as ve: # Ловим ошибки типа файла, распаковки, отсутствия данных
+         print(f"[ОШИБКА обработки] ({client_session_id}) {ve}")
+         status.update({"status": "Ошибка", "error": str(ve)})
+         outcome = "error"
+    except Exception as e: # Ловим все остальные ошибки
+        print(f"[КРИТИЧЕСКАЯ ОШИБКА] ({client_session_id}) Задача обработки: {e}")
+        status.update({"status": "Критическая ошибка", "error": "Внутренняя ошибка сервера."})
+        traceback.print_exc()
     finally:
+        REGISTRY.observe_job(job_metrics, outcome) # Времена этапов и счетчики задачи - в метрики процесса
         # Очистка временной папки загрузок
         if os.path.exists(upload_path):
             try: shutil.rmtree(upload_path); print(f"({client_session_id}) Очищена временная папка: {upload_path}")
             except Exception as clean_err: print(f"[WARN] ({client_session_id}) Не удалось очистить {upload_path}: {clean_err}")
-        # Очистка статуса пока не реализована автоматически
+        # Статус остается в хранилище до истечения STATUS_TTL_SECONDS (клиент успевает забрать ссылку)
 
 
 # === Новый маршрут для получения прогресса ===
@@ -327,29 +240,79 @@ def get_progress(session_id):
     """Возвращает текущий статус обработки для данной сессии."""
     # --- ИЗМЕНЕНИЕ: Более дружелюбный начальный статус ---
     default_status = {"status": "Инициализация...", "processed": 0, "total": 0, "error": None}
-    status = processing_status.get(session_id, default_status)
+    status = processing_status.get(session_id) or default_status
     # ----------------------------------------------------
     # print(f"Запрос статуса для {session_id}: {status}") # Лог для отладки поллинга
     return jsonify(status)
+
+# Статусы, после которых задача больше не меняется
+FINAL_STATUSES = ("Готово", "Ошибка", "Критическая ошибка")
+
+@app.route('/progress/<session_id>/events')
+def progress_events(session_id):
+    """
+    Прогресс задачи потоком Server-Sent Events: событие с тем же JSON, что и /progress,
+    отправляется при каждом изменении статуса. Поток закрывается после завершения задачи,
+    а если статуса задачи нет дольше PROGRESS_EVENTS_MISSING_SECONDS (неизвестный ID или статус
+    уже удален по сроку) - после события с ошибкой. /progress остается для клиентов без EventSource.
+    """
+    poll_seconds = app.config['PROGRESS_EVENTS_POLL_SECONDS']
+    ping_seconds = app.config['PROGRESS_EVENTS_PING_SECONDS']
+    missing_seconds = app.config['PROGRESS_EVENTS_MISSING_SECONDS']
+
+    def generate():
+        yield "retry: 3000\n\n" # Переподключение браузера через 3 секунды, если соединение оборвется
+        last_payload = None
+        last_sent = time.monotonic()
+        last_seen = time.monotonic() # Когда статус задачи был в хранилище
+        while True:
+            status = processing_status.get(session_id)
+            if status is not None:
+                last_seen = time.monotonic()
+            elif time.monotonic() - last_seen >= missing_seconds:
+                status = {"status": "Ошибка", "processed": 0, "total": 0,
+                          "error": "Задача не найдена: статус обработки недоступен или уже удален."}
+            else:
+                status = {"status": "Инициализация...", "processed": 0, "total": 0, "error": None}
+            payload = json.dumps(status, ensure_ascii=False, default=str)
+            if payload != last_payload:
+                last_payload = payload
+                last_sent = time.monotonic()
+                yield f"data: {payload}\n\n"
+                if status.get("status") in FINAL_STATUSES:
+                    return
+            elif time.monotonic() - last_sent >= ping_seconds:
+                last_sent = time.monotonic()
+                yield ": ping\n\n"
+            processing_status.wait_for_update(session_id, poll_seconds)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Без буферизации в nginx
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+# ==========================================
+
+# === Метрики в текстовом формате Prometheus ===
+@app.route('/metrics')
+def get_metrics():
+    """Времена этапов конвейера, счетчики процессоров и состояние очереди (формат Prometheus)."""
+    gauges = {
+        "jobs_queued": (job_queue.pending(), "Задачи, ожидающие в очереди."),
+        "jobs_tracked": (len(processing_status), "Задачи, статус которых есть в хранилище статусов."),
+    }
+    result_files, result_bytes = results_store.stats()
+    gauges["result_files"] = (result_files, "Итоговые файлы в хранилище результатов.")
+    gauges["result_bytes"] = (result_bytes, "Общий размер итоговых файлов, байт.")
+    return Response(REGISTRY.render(gauges), mimetype='text/plain; version=0.0.4; charset=utf-8')
 # ==========================================
 
-# --- Маршрут скачивания (ИЗМЕНЕН!) ---
-@app.route('/download/<filename>')
-def download_file(filename):
-    # Мы предполагаем, что filename уже был очищен на этапе создания.
-    # Убираем повторный вызов secure_filename, но проверяем на попытки выхода из папки.
-    if '..' in filename or filename.startswith('/'):
-        print(f"[ПРЕДУПРЕЖДЕНИЕ] Попытка доступа к небезопасному пути: {filename}")
-        return "Недопустимое имя файла.", 400
-
-    # Имя файла теперь используется как есть
-    safe_filename = filename
-
-    file_path = os.path.join(app.config['RESULTS_FOLDER'], safe_filename)
-    if not os.path.exists(file_path): return "Файл не найден.", 404
-    print(f"Отправка файла для скачивания: {safe_filename}")
-    try: return send_from_directory(app.config['RESULTS_FOLDER'], safe_filename, as_attachment=True)
-    except Exception as e: print(f"Ошибка при отправке файла {safe_filename}: {e}"); return "Ошибка при отправке файла.", 500
+# --- Маршрут скачивания: результат ищется в папке своей задачи (results_store) ---
+@app.route('/download/<job_id>/<filename>')
+def download_file(job_id, filename):
+    # Имя проверяет results_store.path_for: только файл внутри папки задачи, без выхода из нее
+    file_path = results_store.path_for(job_id, filename)
+    if file_path is None: return "Файл не найден.", 404
+    print(f"Отправка файла для скачивания: {job_id}/{filename}")
+    try: return send_from_directory(os.path.dirname(os.path.abspath(file_path)), filename, as_attachment=True)
+    except Exception as e: print(f"Ошибка при отправке файла {filename}: {e}"); return "Ошибка при отправке файла.", 500
 
 # --- Запуск приложения (без изменений) ---
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# archive_reader.py
+import os
+import shutil
+import zipfile
+import tempfile
+
+# Чтение Excel файлов прямо из ZIP архива, без распаковки на диск.
+# Файл архива описывается ZipMember (архив + имя файла внутри) - такой объект можно передать
+# в процесс пула; открывается он уже там, где будет разбираться.
+
+# До этого размера файл из архива держится в памяти, больше - во временном файле (SpooledTemporaryFile)
+ZIP_SPOOL_MAX_BYTES = int(os.environ.get('ZIP_SPOOL_MAX_BYTES', str(32 * 1024 * 1024))) # 32 MB
+EXCEL_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+def decode_member_name(member):
+    """Имя файла в архиве: без флага UTF-8 zipfile отдает cp437, архиваторы Windows часто пишут UTF-8."""
+    if member.flag_bits & 0x800:
+        return member.filename
+    try: return member.filename.encode('cp437').decode('utf-8', 'ignore')
+    except Exception: return member.filename.encode('cp437').decode('cp437', 'ignore')
+
+
+class ZipMember:
+    """
+    Excel файл внутри ZIP архива.
+
+    open() возвращает бинарный файл (в памяти или временный на диске), содержимое
+    которого распаковано один раз; openpyxl и кэш результатов читают его как обычный файл.
+    """
+    __slots__ = ("archive_path", "member_name", "display_name", "file_size", "spool_dir")
+
+    def __init__(self, archive_path, member_name, display_name, file_size, spool_dir=None):
+        self.archive_path = archive_path
+        self.member_name = member_name
+        self.display_name = display_name
+        self.file_size = file_size
+        self.spool_dir = spool_dir # Куда писать временный файл, если файл больше ZIP_SPOOL_MAX_BYTES
+
+    def open(self, max_memory_bytes=None):
+        """Распаковывает файл в SpooledTemporaryFile (позиция - в начале). Закрывает вызывающий код."""
+        max_memory_bytes = ZIP_SPOOL_MAX_BYTES if max_memory_bytes is None else max_memory_bytes
+        spooled = tempfile.SpooledTemporaryFile(max_size=max_memory_bytes, dir=self.spool_dir)
+        try:
+            with zipfile.ZipFile(self.archive_path, 'r') as archive, archive.open(self.member_name) as source:
+                shutil.copyfileobj(source, spooled)
+            spooled.seek(0)
+            return spooled
+        except Exception:
+            spooled.close()
+            raise
+
+    def __repr__(self):
+        return f"ZipMember({self.archive_path!r}, {self.member_name!r})"
+
+
+def list_excel_members(archive_path, spool_dir=None):
+    """
+    Excel файлы архива (без папок, служебных __MACOSX/ и скрытых файлов), отсортированные по имени.
+
+    Raises:
+        zipfile.BadZipFile: Файл не является ZIP архивом.
+    """
+    with zipfile.ZipFile(archive_path, 'r') as archive:
+        members = sorted([m for m in archive.infolist() if _is_excel_member(m)], key=lambda member: member.filename)
+    return [ZipMember(archive_path, m.filename, decode_member_name(m), m.file_size, spool_dir)
+            for m in members]
+
+
+def check_upload(path, is_zip):
+    """
+    Быстрая проверка загруженного файла по оглавлению ZIP (central directory), без распаковки:
+    у архива должен быть хотя бы один Excel файл, у книги Excel - xl/workbook.xml.
+
+    Raises:
+        ValueError: Файл не подходит (текст - для ответа клиенту).
+    """
+    try:
+        with zipfile.ZipFile(path, 'r') as archive:
+            members = archive.infolist()
+    except zipfile.BadZipFile:
+        raise ValueError("Некорректный ZIP архив." if is_zip else "Файл не является книгой Excel.")
+    if is_zip:
+        if not any(_is_excel_member(m) for m in members):
+            raise ValueError("В архиве не найдено поддерживаемых Excel файлов.")
+    elif not any(m.filename == 'xl/workbook.xml' for m in members):
+        raise ValueError("Файл не является книгой Excel.")
+
+
+def _is_excel_member(member):
+    # Без папок, служебных __MACOSX/ и скрытых файлов
+    return not member.is_dir() and not member.filename.startswith('__MACOSX/') \
+        and not member.filename.startswith('.') and member.filename.lower().endswith(EXCEL_EXTENSIONS)
+
+
+def input_display_name(input_source):
+    """Имя входного файла для логов: путь, ZipMember или открытый файл."""
+    if isinstance(input_source, ZipMember):
+        return input_source.display_name
+    if isinstance(input_source, (str, os.PathLike)):
+        return os.path.basename(input_source)
+    name = getattr(input_source, "name", None)
+    return os.path.basename(name) if isinstance(name, str) else "<поток>"
@@ -0,0 +1,332 @@
+# batch.py
+"""
+Пакетная обработка смет без веб-приложения (ночные перезагрузки архива и т.п.).
+
+Запуск из корня проекта:
+    python batch.py /data/smety --out /data/results --workers 8
+    python batch.py a.zip b.zip --out results --layout archive --type "Турбосметчик"
+    python batch.py /data/smety --out results --layout combined --combined-name all_processed.xlsx
+    python batch.py /data/smety --out results --format jsonl
+
+Входы - папки (обходятся рекурсивно), ZIP архивы и Excel файлы. Раскладка итоговых файлов (--layout):
+    file     - свой итоговый файл на каждый Excel файл, в том числе на каждый файл внутри архива;
+    archive  - как /upload: один итоговый файл на архив (файлы через разделители), на Excel файл - свой;
+    combined - все файлы в одном итоговом файле.
+Итоговые файлы (задачи) распределяются по --workers процессам; в combined по процессам
+распределяются файлы одного итога (как PROCESSING_WORKERS в /upload).
+
+Итоговый файл пишется во временный и переименовывается, только когда он готов, поэтому
+прерванный запуск можно просто повторить: итоги, которые новее своих входов, пропускаются
+(--force - обработать заново, например с другим --type или --output-mode). Результат каждой
+задачи дописывается строкой JSON в журнал batch_log.jsonl в папке вывода.
+"""
+import os
+import io
+import sys
+import json
+import time
+import zipfile
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import FIRST_COMPLETED, wait
+import dispatcher
+import metrics
+import pipeline
+from worker_pool import WorkerPool, WORKER_MAX_TASKS_PER_CHILD
+from output_writer import available_output_formats, OUTPUT_FORMAT_XLSX, OUTPUT_FORMAT_EXTENSIONS
+from archive_reader import list_excel_members, EXCEL_EXTENSIONS
+
+LAYOUTS = ("file", "archive", "combined")
+BATCH_LOG_NAME = "batch_log.jsonl"
+DEFAULT_COMBINED_NAME = "combined_processed.xlsx"
+# Сколько задач на процесс держать в очереди пула (остальные отправляются по мере освобождения)
+_TASKS_PER_WORKER = 4
+
+
+# --- Входы и план задач ---
+
+def collect_inputs(paths):
+    """
+    Excel файлы и ZIP архивы из путей (папки обходятся рекурсивно, скрытые и временные файлы Excel "~$" - нет).
+
+    Returns:
+        list: [(путь к файлу, путь относительно своей папки входа)] в порядке путей и имен.
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+                for name in file_names:
+                    if _is_input_name(name):
+                        file_path = os.path.join(dir_path, name)
+                        found.append((file_path, os.path.relpath(file_path, path)))
+            inputs.extend(sorted(found, key=lambda item: item[1]))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+        else:
+            print(f"[WARN] Путь не найден: {path}", file=sys.stderr)
+    return inputs
+
+
+def _is_input_name(name):
+    lower_name = name.lower()
+    return not name.startswith(('.', '~$')) and lower_name.endswith(EXCEL_EXTENSIONS + ('.zip',))
+
+
+def plan_jobs(inputs, out_dir, layout="file", combined_name=DEFAULT_COMBINED_NAME, output_format=OUTPUT_FORMAT_XLSX):
+    """
+    Задачи пакета: одна задача - один итоговый файл (расширение - по формату output_format).
+
+    Returns:
+        tuple: (jobs, errors). jobs - [{"name", "output_path", "sheet_title", "output_format", "sources",
+               "input_mtime"}],
+               sources - [{"path": путь или ZipMember, "original_name": имя для разделителя}];
+               errors - [(вход, текст ошибки)] для архивов, которые не удалось прочитать.
+    """
+    jobs, errors = [], []
+    planned_outputs = set()
+
+    def add_job(name, output_dir, base_name, sources, input_mtime, output_filename=None):
+        result_filename, sheet_title = pipeline.result_names(base_name, "batch", output_format)
+        output_path = os.path.join(output_dir, output_filename or result_filename)
+        # Разные входы с одинаковым очищенным именем не должны писать в один итог
+        stem, extension = os.path.splitext(output_path)
+        suffix = 1
+        while output_path in planned_outputs:
+            suffix += 1
+            output_path = f"{stem}_{suffix}{extension}"
+        planned_outputs.add(output_path)
+        jobs.append({"name": name, "output_path": output_path, "sheet_title": sheet_title,
+                     "output_format": output_format, "sources": sources, "input_mtime": input_mtime})
+
+    combined_sources, combined_mtime = [], 0.0
+    for path, relative_path in inputs:
+        relative_dir = os.path.dirname(relative_path)
+        input_mtime = os.path.getmtime(path)
+        if not path.lower().endswith('.zip'):
+            source = {"path": path, "original_name": relative_path}
+            if layout == "combined":
+                combined_sources.append(source)
+                combined_mtime = max(combined_mtime, input_mtime)
+            else:
+                add_job(path, os.path.join(out_dir, relative_dir), os.path.basename(path), [source], input_mtime)
+            continue
+
+        try:
+            members = list_excel_members(path)
+        except (zipfile.BadZipFile, OSError) as e:
+            errors.append((path, f"Некорректный ZIP архив: {e}"))
+            continue
+        if not members:
+            errors.append((path, "В архиве не найдено поддерживаемых Excel файлов."))
+            continue
+        archive_stem = os.path.splitext(os.path.basename(path))[0]
+        if layout == "file":
+            # Файлы архива - в папке с именем архива, с подпапками архива (каждая часть пути очищена)
+            archive_dir = os.path.join(out_dir, relative_dir, pipeline.safe_name(archive_stem) or "archive")
+            for member in members:
+                member_dirs = [pipeline.safe_name(part) or "_" for part in member.display_name.split('/')[:-1]]
+                add_job(f"{path}:{member.display_name}", os.path.join(archive_dir, *member_dirs),
+                        os.path.basename(member.display_name), [{"path": member, "original_name": member.display_name}],
+                        input_mtime)
+        elif layout == "archive":
+            add_job(path, os.path.join(out_dir, relative_dir), os.path.basename(path),
+                    [{"path": member, "original_name": member.display_name} for member in members], input_mtime)
+        else:
+            combined_sources.extend({"path": member, "original_name": f"{relative_path}/{member.display_name}"}
+                                    for member in members)
+            combined_mtime = max(combined_mtime, input_mtime)
+
+    if layout == "combined" and combined_sources:
+        combined_filename = os.path.splitext(combined_name)[0] + OUTPUT_FORMAT_EXTENSIONS[output_format]
+        add_job(combined_name, out_dir, combined_name, combined_sources, combined_mtime,
+                output_filename=combined_filename)
+    return jobs, errors
+
+
+def is_done(job):
+    """Итог уже есть и не старше своих входов (файл появляется под своим именем только целиком)."""
+    try:
+        return os.path.getmtime(job["output_path"]) >= job["input_mtime"]
+    except OSError:
+        return False
+
+
+# --- Выполнение задачи (в процессе пула или в текущем) ---
+
+def run_job(job, smeta_type, output_mode=dispatcher.OUTPUT_COORDS, workers=1, verbose=False):
+    """
+    Строит итоговый файл задачи (pipeline.build_result) и публикует его под своим именем.
+
+    Returns:
+        dict: Запись журнала: вход, итог, "status" ("done" / "error"), файлы, время этапов, ошибка.
+    """
+    output_path = job["output_path"]
+    output_dir = os.path.dirname(output_path)
+    temp_path = os.path.join(output_dir, f".{os.path.basename(output_path)}.{os.getpid()}.part")
+    status = {"processed": 0, "total": len(job["sources"]), "status": "", "error": None}
+    job_metrics = metrics.JobMetrics(status, smeta_type)
+    record = {"input": job["name"], "output": output_path, "files": len(job["sources"])}
+    try:
+        os.makedirs(output_dir or '.', exist_ok=True)
+        with _quiet(verbose):
+            outcome = pipeline.build_result(os.path.basename(output_path), job["sources"], smeta_type, temp_path,
+                                            job["sheet_title"], status, job_metrics, workers=workers,
+                                            output_mode=output_mode, output_format=job["output_format"])
+        os.replace(temp_path, output_path)
+        record.update({"status": "done", "files_ok": outcome["files_ok"], "types": outcome["types"],
+                       "error": status.get("error") if outcome["has_errors"] else None})
+    except Exception as e:
+        _remove(temp_path)
+        if not isinstance(e, ValueError): # Ошибки входных данных - без трассировки
+            traceback.print_exc()
+        record.update({"status": "error", "files_ok": 0, "error": str(e)})
+    except BaseException:
+        _remove(temp_path) # Прерванный запуск не оставляет временных файлов
+        raise
+    record["timings"] = job_metrics.as_dict()
+    return record
+
+
+@contextlib.contextmanager
+def _quiet(verbose):
+    """Процессоры много печатают - без --verbose их вывод глушится (ошибки в stderr остаются)."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# --- Запуск пакета ---
+
+def run_batch(jobs, smeta_type, output_mode=dispatcher.OUTPUT_COORDS, workers=1, verbose=False, log_path=None,
+              plan_errors=(), max_tasks_per_child=WORKER_MAX_TASKS_PER_CHILD):
+    """
+    Выполняет задачи: по одной в процесс пула (workers > 1 и задач больше одной) или подряд,
+    единственной задаче отдаются все процессы. Процесс пула заменяется новым после
+    max_tasks_per_child задач (worker_pool.WorkerPool). Каждая запись журнала дописывается в log_path
+    (первыми - входы из plan_errors, для которых задачи не построены).
+
+    Yields:
+        dict: Запись журнала по мере завершения задач.
+    """
+    log_file = io.open(log_path, "a", encoding="utf-8") if log_path else None
+    try:
+        for path, error in plan_errors:
+            _write_log(log_file, {"input": path, "output": None, "files": 0, "status": "error", "files_ok": 0,
+                                  "error": error})
+        for record in _iter_records(jobs, smeta_type, output_mode, workers, verbose, max_tasks_per_child):
+            _write_log(log_file, record)
+            yield record
+    finally:
+        if log_file:
+            log_file.close()
+
+
+def _write_log(log_file, record):
+    if log_file:
+        log_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        log_file.flush()
+
+
+def _iter_records(jobs, smeta_type, output_mode, workers, verbose, max_tasks_per_child):
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield run_job(job, smeta_type, output_mode, workers=workers, verbose=verbose)
+        return
+    # Задачи отправляются окном (_TASKS_PER_WORKER на процесс): Ctrl+C не ждет всей очереди
+    pending_jobs = iter(jobs)
+    pipeline.warm_up() # Кэш для разбора заданий в этом процессе; процесс пула читает ширины при первой задаче
+    pool = WorkerPool(min(workers, len(jobs)), max_tasks_per_child=max_tasks_per_child)
+    futures = {}
+    try:
+        def submit_next():
+            job = next(pending_jobs, None)
+            if job is not None:
+                futures[pool.submit(run_job, job, smeta_type, output_mode, 1, verbose)] = job
+            return job is not None
+        for _ in range(workers * _TASKS_PER_WORKER):
+            if not submit_next():
+                break
+        while futures:
+            done, _not_done = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                try:
+                    yield future.result()
+                except Exception as e:
+                    # Сбой самого пула (например, упавший процесс) - run_job ошибки задачи перехватывает сам
+                    yield {"input": job["name"], "output": job["output_path"], "files": len(job["sources"]),
+                           "status": "error", "files_ok": 0, "error": f"Процесс пула не вернул результат: {e}"}
+                submit_next()
+    finally:
+        pool.shutdown(wait=not futures, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка смет (папки, ZIP архивы, Excel файлы).")
+    parser.add_argument("inputs", nargs="+", help="Папки, ZIP архивы и Excel файлы.")
+    parser.add_argument("--out", required=True, help="Папка для итоговых файлов (структура папок входа сохраняется).")
+    parser.add_argument("--type", dest="smeta_type", default=dispatcher.AUTO_DETECT_TYPE,
+                        help="Тип сметы (как в /upload), по умолчанию - определить по каждому файлу.")
+    parser.add_argument("--layout", choices=LAYOUTS, default="file", help="Раскладка итоговых файлов.")
+    parser.add_argument("--combined-name", default=DEFAULT_COMBINED_NAME,
+                        help="Имя итога для --layout combined (расширение заменяется по --format).")
+    parser.add_argument("--output-mode", choices=dispatcher.OUTPUT_MODES, default=dispatcher.OUTPUT_COORDS)
+    parser.add_argument("--format", dest="output_format", choices=available_output_formats(),
+                        default=OUTPUT_FORMAT_XLSX, help="Формат итоговых файлов (parquet - если установлен pyarrow).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Число процессов.")
+    parser.add_argument("--max-tasks-per-child", type=int, default=WORKER_MAX_TASKS_PER_CHILD,
+                        help="После скольких задач процесс пула заменяется новым (0 - не заменять).")
+    parser.add_argument("--force", action="store_true", help="Обработать заново и готовые итоги.")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить вывод процессоров.")
+    args = parser.parse_args(argv)
+
+    if args.smeta_type not in dispatcher.PROCESSORS and not dispatcher.get_detect_candidates(args.smeta_type):
+        parser.error(f"неизвестный тип сметы: {args.smeta_type}")
+
+    started = time.perf_counter()
+    jobs, plan_errors = plan_jobs(collect_inputs(args.inputs), args.out, args.layout, args.combined_name,
+                                  args.output_format)
+    for path, error in plan_errors:
+        print(f"[ОШИБКА] {path}: {error}", file=sys.stderr)
+    todo = jobs if args.force else [job for job in jobs if not is_done(job)]
+    print(f"Задач: {len(jobs)}, готовых (пропущено): {len(jobs) - len(todo)}, к обработке: {len(todo)}, "
+          f"процессов: {args.workers}")
+
+    os.makedirs(args.out, exist_ok=True)
+    failed = len(plan_errors)
+    try:
+        for count, record in enumerate(run_batch(todo, args.smeta_type, args.output_mode, args.workers, args.verbose,
+                                                 log_path=os.path.join(args.out, BATCH_LOG_NAME),
+                                                 plan_errors=plan_errors,
+                                                 max_tasks_per_child=args.max_tasks_per_child), start=1):
+            elapsed = record.get("timings", {}).get("elapsed", 0.0)
+            if record["status"] == "done":
+                note = f" (ошибки: {record['error']})" if record["error"] else ""
+                print(f"[{count}/{len(todo)}] {record['input']} -> {record['output']} "
+                      f"({record['files_ok']}/{record['files']} файл., {elapsed:.2f}s){note}")
+            else:
+                failed += 1
+                print(f"[{count}/{len(todo)}] [ОШИБКА] {record['input']}: {record['error']}")
+    except KeyboardInterrupt:
+        # Готовые итоги уже на месте, недописанные временные файлы удалены - повторный запуск продолжит
+        print("Прервано. Повторный запуск пропустит готовые итоги.", file=sys.stderr)
+        return 130
+    print(f"Готово за {time.perf_counter() - started:.1f}s, ошибок: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# bench/generator.py
+import random
+import openpyxl
+from openpyxl.utils import get_column_letter
+
+# Раскладка каждого формата - так, как ее ожидают процессоры в handlers/.
+# Колонки 1-based (как в openpyxl), span - (первая, последняя) колонка объединения.
+FORMAT_LAYOUTS = {
+    "Смета ру": {
+        "width": 11,                       # A-K
+        "header_span": (1, 11),            # Раздел:/Подраздел: - merge A-K
+        "section_prefix": "Раздел: ", "subsection_prefix": "Подраздел: ",
+        "footer_span": (1, 11), "footer_text_col": 1,
+        "subsection_footer": "Итого по подразделу:", "section_footer": "Итого по разделу:",
+        "price_total_col": 9,              # I - итог позиции в строке цены (A-H пустые, I и K заполнены)
+        "unit_col": 4, "quantity_col": 5,  # D - ед. изм., E - кол-во
+    },
+    "Турбосметчик-1": {
+        "width": 23,                       # A-W
+        "header_span": (1, 23),
+        "section_prefix": "Раздел ", "subsection_prefix": "Подраздел ",
+        "footer_span": (4, 11), "footer_text_col": 4, "footer_total_col": 22,
+        "subsection_footer": "Итого по подразделу", "section_footer": "Итого по разделу",
+        "price_span": (4, 18), "price_text_col": 4, "price_total_col": 22,
+        "inline_span": (22, 23),           # Цена в строке позиции: merge V-W
+        "unit_col": 12, "quantity_col": 13, # L - ед. изм., M - кол-во
+        "text_cols": (14,),                # N - текст: по позициям T1 отличается от T2 (кол-во в N)
+    },
+    "Турбосметчик-3": {
+        "width": 28,                       # A-AB
+        "header_span": (1, 28),
+        "section_prefix": "Раздел ", "subsection_prefix": "Подраздел ",
+        "footer_span": (5, 9), "footer_text_col": 5, "footer_total_col": 26,
+        "subsection_footer": "Итого по подразделу", "section_footer": "Итого по разделу",
+        "price_span": (5, 19), "price_text_col": 5, "price_total_col": 26,
+        "price_total_span": (26, 28),      # Z-AB
+        "inline_span": (26, 28),
+        "unit_col": 10, "quantity_col": 13, # J - ед. изм., M - кол-во
+    },
+    "ГрандСМЕТА": {
+        "width": 22,                       # A-V
+        "header_span": (1, 11),
+        "section_prefix": "Раздел ", "subsection_prefix": "",
+        "subsection_footer_span": (4, 11), "subsection_footer_text_col": 4, "subsection_footer_total_col": 22,
+        "section_footer_span": (3, 8), "section_footer_text_col": 3, "section_footer_total_col": 11,
+        "subsection_footer": "Итого по подразделу", "section_footer": "Итого по разделу",
+        "price_text_col": 3, "price_total_col": 11,
+        "inline_col": 11,                  # Цена в строке позиции: K без merge
+        "unit_col": 4, "quantity_col": 5,  # D - ед. изм., E - кол-во
+    },
+}
+# Турбосметчик-2 отличается от версии 1 только колонкой кол-ва (N вместо M), раскладка та же
+FORMAT_LAYOUTS["Турбосметчик-2"] = dict(FORMAT_LAYOUTS["Турбосметчик-1"], quantity_col=14, text_cols=(13,))
+
+FORMAT_NAMES = ["Смета ру", "Турбосметчик-1", "Турбосметчик-2", "Турбосметчик-3", "ГрандСМЕТА"]
+
+
+class _SheetBuilder:
+    """Накопитель строк для write_only листа: строки пишутся сразу, объединения - списком."""
+
+    def __init__(self, worksheet, width):
+        self.worksheet = worksheet
+        self.width = width
+        self.row_num = 0
+
+    def add(self, values, merges=()):
+        row = [None] * self.width
+        for col, value in values.items():
+            row[col - 1] = value
+        self.worksheet.append(row)
+        self.row_num += 1
+        for first_col, last_col in merges:
+            self.worksheet.merged_cells.add(
+                f"{get_column_letter(first_col)}{self.row_num}:{get_column_letter(last_col)}{self.row_num}")
+        return self.row_num
+
+
+def generate_workbook(output_path, smeta_type, rows=1000, sections=5, section_depth=2,
+                      merge_density=0.5, items_per_price_row=1, seed=0):
+    """
+    Генерирует синтетическую смету для бенчмарков.
+
+    Args:
+        output_path (str): Куда сохранить .xlsx.
+        smeta_type (str): Формат из FORMAT_LAYOUTS (ключи совпадают с dispatcher.PROCESSORS, плюс "ГрандСМЕТА").
+        rows (int): Примерное число строк данных (позиции, строки цены, заголовки и итоги).
+        sections (int): Число разделов.
+        section_depth (int): 1 - только разделы, 2 - разделы с подразделами (по 3 на раздел).
+        merge_density (float): Доля позиций с ценой прямо в строке позиции (для Турбосметчика - merge V-W / Z-AB),
+                               остальные получают строку "Всего по позиции".
+        items_per_price_row (int): Сколько позиций (ресурсов) идет перед одной строкой итоговой цены.
+        seed (int): Зерно генератора случайных чисел.
+
+    Returns:
+        int: Число записанных строк листа.
+    """
+    layout = FORMAT_LAYOUTS[smeta_type]
+    rnd = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Смета")
+    sheet = _SheetBuilder(worksheet, layout["width"])
+    sheet.add({1: "№ п/п", 2: "Шифр", 3: "Наименование"})
+
+    subsections = 3 if section_depth >= 2 else 0
+    groups = max(1, sections * max(1, subsections))
+    # Строк на одну позицию в среднем: items_per_price_row строк позиций + строка цены (если цена не в строке)
+    rows_per_group = max(items_per_price_row + 1, rows // groups)
+    is_smeta_ru = smeta_type == "Смета ру"
+    is_grandsmeta = smeta_type == "ГрандСМЕТА"
+
+    def footer(kind, text):
+        if is_grandsmeta:
+            text_col = layout[f"{kind}_footer_text_col"]
+            sheet.add({text_col: f"{text} {rnd.randint(1, 99)}", layout[f"{kind}_footer_total_col"]: round(rnd.uniform(1e3, 1e6), 2)},
+                      merges=[layout[f"{kind}_footer_span"]])
+        elif is_smeta_ru:
+            sheet.add({1: f"{text} {rnd.randint(1, 99)}", layout["price_total_col"]: round(rnd.uniform(1e3, 1e6), 2)},
+                      merges=[layout["footer_span"]])
+        else:
+            sheet.add({layout["footer_text_col"]: f"{text} {rnd.randint(1, 99)}", layout["footer_total_col"]: round(rnd.uniform(1e3, 1e6), 2)},
+                      merges=[layout["footer_span"]])
+
+    def item_group(item_num):
+        """Позиция: items_per_price_row строк (первая - целый номер, далее ресурсы N.M) + цена."""
+        inline = not is_smeta_ru and items_per_price_row == 1 and rnd.random() < merge_density
+        for resource in range(items_per_price_row):
+            number = item_num if resource == 0 else f"{item_num}.{resource}"
+            values = {1: number, 2: f"ФЕР{rnd.randint(1, 47):02d}-{rnd.randint(1, 99):02d}-{rnd.randint(1, 999):03d}"}
+            for col in range(3, min(layout["width"], 15) + 1):
+                values[col] = rnd.choice(("Разработка грунта", "м3", "100 м2", round(rnd.uniform(0.1, 500), 3)))
+            # Ед. изм. и кол-во - в колонках формата (по ним различаются форматы с одной раскладкой)
+            values[layout["unit_col"]] = rnd.choice(("м3", "100 м2", "шт", "т"))
+            values[layout["quantity_col"]] = round(rnd.uniform(0.1, 500), 3)
+            for col in layout.get("text_cols", ()):
+                values[col] = rnd.choice(("Разработка грунта", "Норма", "ТЕР"))
+            merges = []
+            if is_smeta_ru:
+                values[10] = 0 if rnd.random() < 0.05 else round(rnd.uniform(1, 1e4), 2) # J - цена ресурса
+            elif inline:
+                if is_grandsmeta:
+                    values[layout["inline_col"]] = round(rnd.uniform(1, 1e5), 2)
+                else:
+                    values[layout["inline_span"][0]] = round(rnd.uniform(1, 1e5), 2)
+                    merges.append(layout["inline_span"])
+            sheet.add(values, merges=merges)
+        if inline:
+            return
+        if is_smeta_ru:
+            sheet.add({layout["price_total_col"]: round(rnd.uniform(1, 1e5), 2), 11: round(rnd.uniform(1, 1e3), 2)})
+        elif is_grandsmeta:
+            sheet.add({layout["price_text_col"]: "Всего по позиции", layout["price_total_col"]: round(rnd.uniform(1, 1e5), 2)})
+        else:
+            merges = [layout["price_span"]]
+            if "price_total_span" in layout:
+                merges.append(layout["price_total_span"])
+            sheet.add({layout["price_text_col"]: "Всего по позиции", layout["price_total_col"]: round(rnd.uniform(1, 1e5), 2)},
+                      merges=merges)
+
+    item_num = 0
+    for section in range(1, sections + 1):
+        sheet.add({1: f"{layout['section_prefix']}{section}. Общестроительные работы"}, merges=[layout["header_span"]])
+        for subsection in range(1, max(1, subsections) + 1):
+            if subsections:
+                sheet.add({1: f"{layout['subsection_prefix']}{section}.{subsection}. Подраздел"}, merges=[layout["header_span"]])
+            start_row = sheet.row_num
+            while sheet.row_num - start_row < rows_per_group:
+                item_num += 1
+                item_group(item_num)
+                if rnd.random() < 0.05:
+                    sheet.add({}) # Пустая строка, как в реальных выгрузках
+            if subsections:
+                footer("subsection", layout["subsection_footer"])
+        footer("section", layout["section_footer"])
+
+    workbook.save(output_path)
+    return sheet.row_num
@@ -0,0 +1,244 @@
+# bench/run_benchmarks.py
+"""
+Бенчмарк процессоров и полного конвейера /upload на синтетических сметах.
+
+Запуск из корня проекта:
+    python -m bench.run_benchmarks --rows 20000 --formats "Смета ру" "Турбосметчик-1"
+    python -m bench.run_benchmarks --rows 5000 --zip-files 4 --json bench_result.json
+
+Каждый замер выполняется в отдельном (spawn) процессе, чтобы пиковая память (ru_maxrss)
+относилась только к нему. Кэш результатов (result_cache) на время замеров выключен.
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+import resource
+import contextlib
+import multiprocessing
+
+# Кэш результатов исказил бы повторные замеры - выключаем до импорта dispatcher (и в дочерних процессах)
+os.environ['RESULT_CACHE_ENABLED'] = '0'
+
+from bench.generator import generate_workbook, FORMAT_NAMES
+
+GRANDSMETA = "ГрандСМЕТА"
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    # На Linux ru_maxrss в килобайтах, на macOS - в байтах
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _get_processor(smeta_type):
+    if smeta_type == GRANDSMETA:
+        # ГрандСМЕТА пока не подключена в dispatcher.PROCESSORS
+        from handlers.grandsmeta.processor import process_grandsmeta
+        return process_grandsmeta
+    import dispatcher
+    return dispatcher.PROCESSORS[smeta_type]
+
+
+@contextlib.contextmanager
+def _quiet(verbose):
+    """Процессоры много печатают - в замерах вывод глушится (сами print все равно выполняются)."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# --- Замеры (выполняются в дочерних процессах) ---
+
+def _measure_read(path):
+    """Загрузка (open_first_sheet, включая проход по mergeCell) и чистое чтение всех строк."""
+    from sheet_reader import open_first_sheet
+    start = time.perf_counter()
+    sheet = open_first_sheet(path)
+    load_time = time.perf_counter() - start
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for _row_num, _cells in sheet.iter_rows(min_row=2):
+            rows += 1
+    finally:
+        sheet.close()
+    read_time = time.perf_counter() - start
+    return {"load": load_time, "read": read_time, "rows_read": rows, "merges": len(sheet.merge_index),
+            "peak_rss_mb": _peak_rss_mb()}
+
+
+def _measure_processor(smeta_type, path, verbose):
+    processor = _get_processor(smeta_type)
+    start = time.perf_counter()
+    with _quiet(verbose):
+        headers, data_rows = processor(path)
+    total = time.perf_counter() - start
+    return {"total": total, "rows_out": len(data_rows) if data_rows else 0, "ok": bool(headers),
+            "peak_rss_mb": _peak_rss_mb()}
+
+
+def _measure_pipeline(smeta_type, input_path, original_name, workers, verbose):
+    import pipeline
+    from metrics import JobMetrics
+    work_dir = tempfile.mkdtemp(prefix="bench_upload_")
+    results_dir = os.path.join(work_dir, "results")
+    os.makedirs(results_dir)
+    status = {"processed": 0, "total": 0, "status": "В очереди...", "error": None}
+    job_metrics = JobMetrics(status, smeta_type)
+    start = time.perf_counter()
+    try:
+        with _quiet(verbose):
+            result = pipeline.process_upload("bench", input_path, original_name, smeta_type,
+                                             work_dir, status, results_dir, workers=workers, job_metrics=job_metrics)
+        total = time.perf_counter() - start
+        output_size = os.path.getsize(result["output_path"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    # При workers > 1 файлы разбирают дочерние процессы - их пик учитывается отдельно (максимум по детям)
+    timings = job_metrics.as_dict()
+    return {"total": total, "stages": timings["stages"], "counters": timings["counters"], "output_bytes": output_size,
+            "peak_rss_mb": _peak_rss_mb(), "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN)}
+
+
+def _isolated_entry(conn, func, args):
+    try:
+        conn.send((True, func(*args)))
+    except Exception as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _run_isolated(func, *args):
+    """
+    Запускает замер в свежем процессе (spawn): пиковая память не смешивается с другими замерами.
+    Обычный Process, а не Pool - рабочие процессы Pool демонические и не могут запустить
+    пул процессов конвейера (PROCESSING_WORKERS > 1).
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_isolated_entry, args=(child_conn, func, args))
+    process.start()
+    child_conn.close()
+    try:
+        ok, payload = parent_conn.recv()
+    except EOFError:
+        ok, payload = False, f"процесс замера завершился с кодом {process.exitcode}"
+    process.join()
+    if not ok:
+        raise RuntimeError(f"Замер {func.__name__} не удался: {payload}")
+    return payload
+
+
+def _best_of(repeat, func, *args):
+    """Лучший (минимальный по total/read) из repeat запусков."""
+    runs = [_run_isolated(func, *args) for _ in range(max(1, repeat))]
+    return min(runs, key=lambda run: run.get("total", run.get("read", 0)))
+
+
+# --- Сценарии ---
+
+def bench_processor(smeta_type, path, sheet_rows, repeat, verbose):
+    read = _best_of(repeat, _measure_read, path)
+    proc = _best_of(repeat, _measure_processor, smeta_type, path, verbose)
+    parse_time = max(proc["total"] - read["load"] - read["read"], 0.0)
+    return {
+        "kind": "processor", "format": smeta_type, "sheet_rows": sheet_rows, "merges": read["merges"],
+        "rows_out": proc["rows_out"], "ok": proc["ok"],
+        "seconds": proc["total"], "rows_per_sec": sheet_rows / proc["total"] if proc["total"] else 0.0,
+        "stages": {"load": read["load"], "read": read["read"], "parse": parse_time},
+        "peak_rss_mb": proc["peak_rss_mb"],
+    }
+
+
+def bench_pipeline(smeta_type, paths, sheet_rows, work_dir, workers, repeat, verbose):
+    if len(paths) == 1:
+        input_path, original_name = paths[0], os.path.basename(paths[0])
+    else:
+        input_path = os.path.join(work_dir, f"upload_{FORMAT_NAMES.index(smeta_type)}.zip")
+        with zipfile.ZipFile(input_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for i, path in enumerate(paths):
+                archive.write(path, arcname=f"{i + 1:02d}_{os.path.basename(path)}")
+        original_name = os.path.basename(input_path)
+    run = _best_of(repeat, _measure_pipeline, smeta_type, input_path, original_name, workers, verbose)
+    return {
+        "kind": "pipeline", "format": smeta_type, "files": len(paths), "workers": workers,
+        "sheet_rows": sheet_rows, "seconds": run["total"],
+        "rows_per_sec": sheet_rows / run["total"] if run["total"] else 0.0,
+        "stages": run["stages"], "counters": run["counters"], "output_bytes": run["output_bytes"],
+        "peak_rss_mb": run["peak_rss_mb"], "peak_rss_children_mb": run["peak_rss_children_mb"],
+    }
+
+
+def _print_result(result):
+    stages = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in result["stages"].items())
+    title = result["format"] if result["kind"] == "processor" else \
+        f"{result['format']} /upload ({result['files']} файл., процессов: {result['workers']})"
+    peak = f"пик {result['peak_rss_mb']:>6.1f} MB"
+    if result.get("peak_rss_children_mb"):
+        peak += f" (дочерние {result['peak_rss_children_mb']:.1f} MB)"
+    print(f"{title:<48} {result['sheet_rows']:>8} строк  {result['seconds']:>7.3f}s  "
+          f"{result['rows_per_sec']:>9.0f} строк/с  {peak}  [{stages}]")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк процессоров смет на синтетических данных.")
+    parser.add_argument("--formats", nargs="+", default=FORMAT_NAMES, choices=FORMAT_NAMES)
+    parser.add_argument("--rows", type=int, default=10000, help="Примерное число строк в одном файле.")
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--section-depth", type=int, default=2, choices=(1, 2))
+    parser.add_argument("--merge-density", type=float, default=0.5,
+                        help="Доля позиций с ценой в строке позиции (объединение V-W / Z-AB).")
+    parser.add_argument("--items-per-price-row", type=int, default=1)
+    parser.add_argument("--zip-files", type=int, default=1,
+                        help="Сколько файлов загружать в /upload (больше 1 - ZIP архивом).")
+    parser.add_argument("--workers", type=int, default=1, help="PROCESSING_WORKERS для ZIP в конвейере.")
+    parser.add_argument("--repeat", type=int, default=1, help="Повторов каждого замера (берется лучший).")
+    parser.add_argument("--no-pipeline", action="store_true", help="Только процессоры, без /upload.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Куда сохранить результаты в JSON.")
+    parser.add_argument("--verbose", action="store_true", help="Не глушить вывод процессоров.")
+    args = parser.parse_args(argv)
+
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for smeta_type in args.formats:
+            paths = []
+            sheet_rows = 0
+            for file_idx in range(max(1, args.zip_files)):
+                path = os.path.join(work_dir, f"smeta_{FORMAT_NAMES.index(smeta_type)}_{file_idx + 1}.xlsx")
+                sheet_rows += generate_workbook(
+                    path, smeta_type, rows=args.rows, sections=args.sections, section_depth=args.section_depth,
+                    merge_density=args.merge_density, items_per_price_row=args.items_per_price_row,
+                    seed=args.seed + file_idx)
+                paths.append(path)
+
+            result = bench_processor(smeta_type, paths[0], sheet_rows // len(paths), args.repeat, args.verbose)
+            _print_result(result)
+            results.append(result)
+
+            if args.no_pipeline or smeta_type == GRANDSMETA: # ГрандСМЕТА недоступна в /upload
+                continue
+            result = bench_pipeline(smeta_type, paths, sheet_rows, work_dir, args.workers, args.repeat, args.verbose)
+            _print_result(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with io.open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.json}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
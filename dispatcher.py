@@ -1,11 +1,22 @@
 import os
+import sys
+import hashlib
+import itertools
 import traceback
+import contextlib
+from concurrent.futures import FIRST_COMPLETED, wait
+import result_cache
+import metrics
+import worker_pool
+from archive_reader import ZipMember, input_display_name
+from row_engine import row_evidence, OUTPUT_COORDS, OUTPUT_MODES
+from sheet_reader import open_first_sheet
 
 # ИМПОРТЫ ИЗМЕНЕНЫ: Импортируем функции из директории handlers
-from handlers.smeta_ru.processor import process_smeta_ru
-from handlers.turbosmetchik.processor_1 import process_turbosmetchik_1
-from handlers.turbosmetchik.processor_2 import process_turbosmetchik_2
-from handlers.turbosmetchik.processor_3 import process_turbosmetchik_3
+from handlers.smeta_ru.processor import process_smeta_ru, stream_smeta_ru, SMETA_RU_RULES
+from handlers.turbosmetchik.processor_1 import process_turbosmetchik_1, stream_turbosmetchik_1, TURBOSMETCHIK_1_RULES
+from handlers.turbosmetchik.processor_2 import process_turbosmetchik_2, stream_turbosmetchik_2, TURBOSMETCHIK_2_RULES
+from handlers.turbosmetchik.processor_3 import process_turbosmetchik_3, stream_turbosmetchik_3, TURBOSMETCHIK_3_RULES
 
 # --- Словарь для выбора функции обработки ---
 PROCESSORS = {
@@ -15,6 +26,51 @@ PROCESSORS = {
     "Турбосметчик-3": process_turbosmetchik_3,
 }
 
+# --- Потоковые варианты процессоров: тот же разбор, строки отдаются пачками по мере готовности ---
+# Возвращают (headers, batches); типы без потокового варианта отдают весь результат одной пачкой
+STREAM_PROCESSORS = {
+    "Смета ру": stream_smeta_ru,
+    "Турбосметчик-1": stream_turbosmetchik_1,
+    "Турбосметчик-2": stream_turbosmetchik_2,
+    "Турбосметчик-3": stream_turbosmetchik_3,
+}
+
+# --- Автоопределение формата ---
+# Правила форматов (те же таблицы, по которым работают процессоры) - по ним оценивается начало листа
+FORMAT_RULES = {
+    "Смета ру": SMETA_RU_RULES,
+    "Турбосметчик-1": TURBOSMETCHIK_1_RULES,
+    "Турбосметчик-2": TURBOSMETCHIK_2_RULES,
+    "Турбосметчик-3": TURBOSMETCHIK_3_RULES,
+}
+# Тип "определить по файлу": формат выбирается для каждого файла отдельно (архив может быть смешанным)
+AUTO_DETECT_TYPE = "Автоопределение"
+# Сколько первых строк листа просматривается при определении формата
+DETECT_MAX_ROWS = int(os.environ.get('DETECT_MAX_ROWS', '300'))
+# Параллельный разбор: насколько (в числах процессов) файл в пуле может опережать первый незавершенный
+REORDER_WINDOW_FACTOR = 2
+
+# Модули, от которых кроме самого процессора зависит результат (входят в версию для кэша результатов)
+PROCESSOR_SHARED_MODULES = ("utils", "sheet_reader", "row_engine")
+_processor_versions = {}
+
+def get_processor_version(smeta_type):
+    """
+    Версия процессора для ключа кэша результатов: хэш исходников модуля процессора
+    и общих модулей. Любая правка кода автоматически инвалидирует старые записи кэша.
+    """
+    version = _processor_versions.get(smeta_type)
+    if version is None:
+        processor_func = PROCESSORS[smeta_type]
+        digest = hashlib.sha256()
+        for module_name in (processor_func.__module__,) + PROCESSOR_SHARED_MODULES:
+            module = sys.modules.get(module_name) or __import__(module_name)
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        version = digest.hexdigest()[:16]
+        _processor_versions[smeta_type] = version
+    return version
+
 def get_available_processor_types():
     """Возвращает список ОБЩИХ типов смет для основного dropdown."""
     # Возвращаем только уникальные "основные" типы
@@ -25,36 +81,349 @@ def get_available_processor_types():
             main_types.add("Турбосметчик")
         else:
             main_types.add(key)
-    # Сортируем для предсказуемого порядка (опционально)
-    return sorted(list(main_types))
+    # Сортируем для предсказуемого порядка (опционально), автоопределение - первым
+    return [AUTO_DETECT_TYPE] + sorted(list(main_types))
+
+def get_detect_candidates(smeta_type):
+    """
+    Типы, среди которых нужно определить формат файла, или None, если тип задан точно.
+
+    AUTO_DETECT_TYPE - все зарегистрированные форматы; общий тип без версии
+    ("Турбосметчик") - все его версии ("Турбосметчик-1", ...).
+    """
+    if smeta_type in PROCESSORS:
+        return None
+    if smeta_type == AUTO_DETECT_TYPE:
+        return [key for key in PROCESSORS if key in FORMAT_RULES]
+    candidates = [key for key in PROCESSORS if key.startswith(f"{smeta_type}-") and key in FORMAT_RULES]
+    return candidates or None
+
+class AmbiguousFormatError(ValueError):
+    """Файл одинаково подходит под несколько форматов (например, Турбосметчик-1 и -2) - версию выбирает пользователь."""
+
+    def __init__(self, input_name, candidates):
+        self.candidates = list(candidates)
+        super().__init__(f"Формат файла {input_name} не определен однозначно ({' или '.join(self.candidates)}): "
+                         "выберите версию сметы вручную.")
+
+
+def detect_smeta_type(input_path, candidates=None, max_rows=None, input_name=None):
+    """
+    Определяет формат сметы по первым строкам листа и раскладке объединенных ячеек
+    (ширина объединения заголовков A-K / A-W / A-AB, колонка итогов V / Z, положение "Всего по позиции").
+
+    Каждая строка оценивается правилами всех кандидатов (row_engine.row_evidence): побеждает формат
+    с наибольшим совпадением раскладки, при равенстве - с большим числом позиций, у которых
+    ед. изм. и кол-во стоят в колонках формата (Турбосметчик-1 и -2 различаются только этим).
+    Если и по позициям лучшие форматы равны, формат не угадывается - выбрасывается AmbiguousFormatError.
+
+    Args:
+        input_path (str | file-like): Путь к Excel файлу или открытый бинарный файл.
+        candidates (list): Типы из FORMAT_RULES (по умолчанию - все).
+        max_rows (int): Сколько строк просматривать (по умолчанию DETECT_MAX_ROWS).
+        input_name (str): Имя файла для лога (для открытого файла из архива).
+
+    Returns:
+        str: Тип сметы или None, если ни один формат не подошел.
+
+    Raises:
+        AmbiguousFormatError: Несколько форматов подходят одинаково.
+    """
+    candidates = [key for key in (candidates or FORMAT_RULES) if key in FORMAT_RULES]
+    max_rows = max_rows or DETECT_MAX_ROWS
+    scores = {key: [0, 0] for key in candidates}
+    # Объединения нужны только для просматриваемых строк - XML листа целиком не разбирается
+    sheet = open_first_sheet(input_path, merge_rows=max_rows + 1)
+    if sheet is None:
+        return None
+    try:
+        merge_index = sheet.merge_index
+        width = sheet.max_column
+        read_width = max((FORMAT_RULES[key].read_width for key in candidates), default=1)
+        for row_num, row_cells in sheet.iter_rows(min_row=2, max_col=read_width):
+            if row_num > max_rows + 1:
+                break
+            for key in candidates:
+                layout_points, item_points = row_evidence(FORMAT_RULES[key], merge_index, row_num, row_cells, width)
+                scores[key][0] += layout_points
+                scores[key][1] += item_points
+    finally:
+        sheet.close()
+
+    input_name = input_name or input_display_name(input_path)
+    print(f"Автоопределение формата {input_name}: "
+          + ", ".join(f"{key}={scores[key][0]}/{scores[key][1]}" for key in candidates))
+    best = max(candidates, key=lambda key: scores[key], default=None)
+    if best is None or scores[best][0] == 0:
+        return None
+    tied = [key for key in candidates if scores[key] == scores[best]]
+    if len(tied) > 1:
+        raise AmbiguousFormatError(input_name, tied)
+    return best
 
 # --- Функция-диспетчер ---
-def run_processor(smeta_type, input_path):
+def run_processor(smeta_type, input_path, output_mode=OUTPUT_COORDS):
     """
     Выбирает и запускает нужную функцию обработки на основе типа сметы.
 
     Args:
-        smeta_type (str): Тип сметы (ключ из словаря PROCESSORS).
-        input_path (str): Путь к входному файлу.
+        smeta_type (str): Тип сметы (ключ из словаря PROCESSORS), AUTO_DETECT_TYPE
+                          или общий тип без версии - тогда формат определяется по файлу.
+        input_path (str | file-like | ZipMember): Путь к входному файлу, открытый бинарный файл
+                          или файл внутри ZIP архива (распаковывается в память/временный файл здесь же).
+        output_mode (str): Режим вывода (OUTPUT_MODES): координаты ячеек, их значения или и то, и другое.
 
     Returns:
         tuple: (headers, data_rows) или (None, None) если произошла ошибка.
     """
-    print(f"Вызов run_processor: тип={smeta_type}, файл={os.path.basename(input_path)}") # Улучшил лог
+    input_name = input_display_name(input_path)
+    print(f"Вызов run_processor: тип={smeta_type}, файл={input_name}") # Улучшил лог
+    stats = metrics.current_processor_stats()
+    if not isinstance(input_path, ZipMember):
+        return _run_processor(smeta_type, input_path, input_name, stats, output_mode)
+
+    # Файл из архива: распаковываем один раз, дальше все читают открытый файл
+    try:
+        source = input_path.open()
+    except Exception as e:
+        print(f"[ОШИБКА] Не удалось прочитать {input_name} из архива: {e}")
+        return None, None
+    finally:
+        stats.lap("unzip")
+    with source:
+        return _run_processor(smeta_type, source, input_name, stats, output_mode)
+
+def _run_processor(smeta_type, input_path, input_name, stats, output_mode=OUTPUT_COORDS):
+    smeta_type = _resolve_smeta_type(smeta_type, input_path, input_name, stats)
+    if smeta_type is None:
+        return None, None
     processor_func = PROCESSORS.get(smeta_type)
     if processor_func:
         print(f"Выбран процессор: {processor_func.__name__}")
         try:
-            result = processor_func(input_path)
+            # --- Кэш результатов: повторно загруженный файл не парсим ---
+            cache, cache_key, cached_result = _cache_lookup(smeta_type, input_path, input_name, stats, output_mode)
+            if cached_result is not None:
+                return cached_result
+            # ------------------------------------------------------------
+            result = processor_func(input_path, output_mode)
             if isinstance(result, tuple) and len(result) == 2:
+                if cache_key and result[0] and result[1] is not None:
+                    cache.put(cache_key, result)
                 return result
             else:
                 print(f"[ОШИБКА] Обработчик '{smeta_type}' ({processor_func.__name__}) вернул некорректный результат: {result}")
                 return None, None
         except Exception as e:
-            print(f"[КРИТИЧЕСКАЯ ОШИБКА] Исключение при вызове '{smeta_type}' ({processor_func.__name__}) для {input_path}: {e}")
+            print(f"[КРИТИЧЕСКАЯ ОШИБКА] Исключение при вызове '{smeta_type}' ({processor_func.__name__}) для {input_name}: {e}")
             traceback.print_exc()
             return None, None
     else:
         print(f"[ОШИБКА] Обработчик для типа '{smeta_type}' не найден в словаре PROCESSORS.")
-        return None, None 
\ No newline at end of file
+        return None, None
+
+def _resolve_smeta_type(smeta_type, input_path, input_name, stats):
+    """Тип, которым разбирается файл (при автоопределении - найденный), или None. Записывается в stats.smeta_type."""
+    candidates = get_detect_candidates(smeta_type)
+    if candidates:
+        try:
+            detected_type = detect_smeta_type(input_path, candidates, input_name=input_name)
+        except AmbiguousFormatError as e:
+            print(f"[ОШИБКА] {e}")
+            stats.error = str(e) # Текст для статуса задачи: пользователь выбирает версию сам
+            return None
+        except Exception as e:
+            print(f"[ОШИБКА] Не удалось определить формат {input_name}: {e}")
+            return None
+        finally:
+            stats.lap("detect")
+        if detected_type is None:
+            print(f"[ОШИБКА] Формат файла {input_name} не распознан (проверены: {', '.join(candidates)}).")
+            return None
+        print(f"Определен формат: {detected_type}")
+        smeta_type = detected_type
+    stats.smeta_type = smeta_type
+    return smeta_type
+
+def _cache_lookup(smeta_type, input_path, input_name, stats, output_mode=OUTPUT_COORDS):
+    """
+    Поиск результата в кэше. Режим вывода входит в версию ключа (ключи координат - прежние).
+
+    Returns:
+        tuple: (cache, cache_key, cached_result); cache_key None - кэш выключен или недоступен,
+               cached_result None - результата в кэше нет.
+    """
+    cache = result_cache.get_default_cache()
+    if not cache:
+        return None, None, None
+    try:
+        processor_version = get_processor_version(smeta_type)
+        if output_mode != OUTPUT_COORDS:
+            processor_version = f"{processor_version}-{output_mode}"
+        cache_key = cache.make_key(input_path, smeta_type, processor_version)
+        cached_result = cache.get(cache_key)
+    except OSError as cache_err:
+        print(f"  [WARN] Кэш результатов недоступен: {cache_err}")
+        return cache, None, None
+    if cached_result is not None:
+        print(f"Результат взят из кэша: {input_name}")
+        stats.cache_hit = True
+    return cache, cache_key, cached_result
+
+# --- Потоковый запуск: результат пишется по мере разбора, без накопления всего файла ---
+@contextlib.contextmanager
+def open_processor_stream(smeta_type, input_path, output_mode=OUTPUT_COORDS):
+    """
+    Потоковый вариант run_processor.
+
+    Внутри with файл уже открыт (ZipMember - распакован), формат определен и разбор дошел
+    до первой готовой пачки: если файл не читается, (None, None) возвращается до того, как
+    вызывающий код что-то записал. Ошибки дальше по листу выбрасываются из batches.
+    Фактический тип сметы - в metrics.current_processor_stats().smeta_type.
+
+    С включенным кэшем строки файла копятся и попадают в кэш после полного разбора
+    (в памяти - один файл, а не весь архив); результат из кэша отдается одной пачкой.
+
+    Args:
+        smeta_type (str): Тип сметы (как в run_processor).
+        input_path (str | file-like | ZipMember): Входной файл (как в run_processor).
+        output_mode (str): Режим вывода (как в run_processor).
+
+    Yields:
+        tuple: (headers, batches) - заголовки и итератор списков строк вывода,
+               или (None, None), если разобрать файл не удалось.
+    """
+    input_name = input_display_name(input_path)
+    print(f"Вызов open_processor_stream: тип={smeta_type}, файл={input_name}")
+    stats = metrics.current_processor_stats()
+    source = input_path
+    headers, batches = None, None
+    try:
+        if isinstance(input_path, ZipMember):
+            try:
+                source = input_path.open()
+            except Exception as e:
+                print(f"[ОШИБКА] Не удалось прочитать {input_name} из архива: {e}")
+                source = None
+            finally:
+                stats.lap("unzip")
+        if source is not None:
+            headers, batches = _start_stream(smeta_type, source, input_name, stats, output_mode)
+        yield headers, batches
+    finally:
+        if batches is not None:
+            batches.close() # Разбор прерван потребителем - закрываем книгу
+        if source is not None and source is not input_path:
+            source.close()
+
+def _start_stream(smeta_type, input_path, input_name, stats, output_mode=OUTPUT_COORDS):
+    smeta_type = _resolve_smeta_type(smeta_type, input_path, input_name, stats)
+    if smeta_type is None:
+        return None, None
+    stream_func = STREAM_PROCESSORS.get(smeta_type)
+    if stream_func is None:
+        # Процессор без потокового варианта: весь результат одной пачкой
+        headers, data_rows = _run_processor(smeta_type, input_path, input_name, stats, output_mode)
+        return (headers, _single_batch(data_rows)) if headers and data_rows is not None else (None, None)
+
+    try:
+        cache, cache_key, cached_result = _cache_lookup(smeta_type, input_path, input_name, stats, output_mode)
+        if cached_result is not None:
+            return cached_result[0], _single_batch(cached_result[1])
+        print(f"Выбран процессор: {stream_func.__name__}")
+        headers, batches = stream_func(input_path, output_mode)
+        first_batch = next(batches, None) # Открытие книги и разбор до первой готовой пачки
+    except Exception as e:
+        print(f"[КРИТИЧЕСКАЯ ОШИБКА] Исключение при разборе '{smeta_type}' для {input_name}: {e}")
+        traceback.print_exc()
+        return None, None
+    return headers, _stream_batches(headers, first_batch, batches, cache, cache_key)
+
+def _single_batch(data_rows):
+    yield data_rows
+
+def _stream_batches(headers, first_batch, batches, cache=None, cache_key=None):
+    """Пачки потокового процессора (первая уже прочитана); после полного разбора результат идет в кэш."""
+    collected = [] if cache_key else None
+    try:
+        for batch in itertools.chain((first_batch,) if first_batch is not None else (), batches):
+            if collected is not None:
+                collected.extend(batch)
+            yield batch
+    finally:
+        batches.close()
+    if collected is not None:
+        cache.put(cache_key, (headers, collected))
+
+def run_processor_with_stats(smeta_type, input_path, output_mode=OUTPUT_COORDS):
+    """
+    То же, что run_processor, но вместе со статистикой запуска (времена этапов и счетчики процессора).
+    Статистика возвращается словарем, чтобы ее можно было передать из процесса пула.
+
+    Returns:
+        tuple: ((headers, data_rows), stats) - stats из metrics.ProcessorStats.as_dict().
+    """
+    with metrics.collect_processor_stats() as stats:
+        result = run_processor(smeta_type, input_path, output_mode)
+    return result, stats.as_dict()
+
+# --- Пакетный запуск (например, файлы из ZIP архива) ---
+def run_processors(smeta_type, input_paths, max_workers=1, output_mode=OUTPUT_COORDS):
+    """
+    Запускает run_processor для списка файлов.
+    При max_workers > 1 файлы обрабатываются параллельно в общем прогретом пуле процессов
+    (worker_pool.get_shared_pool; парсинг - чистый CPU, потоки здесь не помогут из-за GIL).
+
+    Args:
+        smeta_type (str): Тип сметы (как в run_processor; при автоопределении формат выбирается для каждого файла).
+        input_paths (list): Входные файлы (пути или archive_reader.ZipMember - их можно передать в процесс пула).
+        max_workers (int): Число процессов; 1 - последовательная обработка в текущем процессе.
+        output_mode (str): Режим вывода (как в run_processor).
+
+    Yields:
+        tuple: (index, (headers, data_rows), stats) по мере готовности файлов.
+               index - позиция файла в input_paths, чтобы вызывающий код мог восстановить исходный порядок;
+               stats - статистика процессора (metrics.ProcessorStats.as_dict(), в "smeta_type" - фактический
+               тип файла) или None при сбое пула.
+    """
+    if max_workers <= 1 or len(input_paths) <= 1:
+        for index, input_path in enumerate(input_paths):
+            result, stats = run_processor_with_stats(smeta_type, input_path, output_mode)
+            yield index, result, stats
+        return
+
+    workers = min(max_workers, len(input_paths))
+    print(f"Параллельная обработка {len(input_paths)} файлов, процессов: {workers}")
+    # Пул общий и уже прогрет (worker_pool): в полете не больше workers файлов этого вызова,
+    # остальные уходят в пул по мере готовности - параллельные загрузки делят процессы между собой.
+    # Вызывающий код пишет результаты в исходном порядке и держит у себя файлы, готовые раньше предыдущих,
+    # поэтому файл отдается в пул, только если он не дальше REORDER_WINDOW_FACTOR * workers позиций
+    # от первого незавершенного: медленный файл не копит в памяти результаты всех остальных
+    pool = worker_pool.get_shared_pool(max_workers)
+    window = REORDER_WINDOW_FACTOR * workers
+    next_index = 0
+    futures = {} # future -> позиция файла; все отданные в пул, но еще не возвращенные вызывающему коду
+    def submit_ready():
+        nonlocal next_index
+        while (next_index < len(input_paths) and len(futures) < workers
+               and next_index < min(futures.values(), default=next_index) + window):
+            futures[pool.submit(run_processor_with_stats, smeta_type, input_paths[next_index], output_mode)] = next_index
+            next_index += 1
+    try:
+        submit_ready()
+        while futures:
+            done, _not_done = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                try:
+                    result, stats = future.result()
+                except Exception as e:
+                    # Сюда попадают только сбои самого пула (например, упавший процесс) -
+                    # ошибки парсинга run_processor перехватывает сам
+                    print(f"[КРИТИЧЕСКАЯ ОШИБКА] Процесс пула не вернул результат для {input_display_name(input_paths[index])}: {e}")
+                    result, stats = (None, None), None
+                submit_ready()
+                yield index, result, stats
+    finally:
+        for future in futures: # Разбор прерван вызывающим кодом - неначатые файлы не обрабатываем
+            future.cancel()
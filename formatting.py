@@ -1,78 +1,86 @@
 # formatting.py
 import openpyxl
 import os
-from openpyxl.styles import Alignment
+import threading
+from openpyxl.styles import Alignment, Font, NamedStyle
+from openpyxl.utils import get_column_letter
 
 # Зависимости из utils.py больше не нужны здесь
 
-def auto_adjust_column_width(worksheet):
-    """Автоматически подбирает ширину для первых 6 колонок (A-F)."""
-    print(f"  Применяем автоподбор ширины для листа '{worksheet.title}'...")
-    for col in worksheet.columns:
-        max_length = 0
-        column_letter = col[0].column_letter
-        # Ограничим автоподбор первыми 6 колонками для скорости
-        if column_letter not in ['A', 'B', 'C', 'D', 'E', 'F']:
-            # Устанавливаем минимальную ширину для остальных колонок, если она не задана референсом
-            if worksheet.column_dimensions[column_letter].width is None:
-                worksheet.column_dimensions[column_letter].width = 10
-            continue # Пропускаем остальные колонки
-
-        for cell in col:
-            try:
-                cell_value_str = str(cell.value) if cell.value is not None else ""
-                # Добавим учет длины для заголовков (первая строка)
-                if cell.row == 1:
-                    max_length = max(max_length, len(cell_value_str) * 1.1) # Небольшой запас для заголовка
-                else:
-                    max_length = max(max_length, len(cell_value_str))
-            except Exception:
-                pass # Игнорируем ошибки при доступе к ячейкам
-
-        # Рассчитываем ширину с небольшим запасом, но ограничиваем минимальным и максимальным значением
-        adjusted_width = min(max(max_length * 1.2 + 1, 8.43), 60) # Мин 8.43 (стандарт Excel), Макс 60
-        # print(f"    Колонка {column_letter}: max_length={max_length:.2f}, adjusted_width={adjusted_width:.2f}")
-        worksheet.column_dimensions[column_letter].width = adjusted_width
-    print(f"  Автоподбор ширины завершен для листа '{worksheet.title}'.")
-
-
-def apply_reference_widths(worksheet, widths):
-    """Применяет заданные ширины к первым 6 колонкам (A-F)."""
-    if widths and len(widths) >= 6:
-        print(f"  Применяем референсные ширины для листа '{worksheet.title}': {widths[:6]}")
-        target_columns = ['A', 'B', 'C', 'D', 'E', 'F']
-        for i, col_letter in enumerate(target_columns):
-            if widths[i] is not None: # Проверяем, что ширина не None
-                try:
-                    worksheet.column_dimensions[col_letter].width = widths[i]
-                except Exception as e:
-                    print(f"    [WARN] Не удалось установить ширину {widths[i]} для колонки {col_letter}: {e}")
-        print(f"  Применены референсные ширины для листа '{worksheet.title}'.")
-        return True # Возвращаем True, если ширины были применены
-    # print(f"  Референсные ширины не найдены или некорректны для листа '{worksheet.title}'.")
-    return False # Возвращаем False, если ширины не применены
-
-
-def apply_formatting(worksheet):
-    """Применяет форматирование (центр, перенос текста) к первым 6 колонкам."""
-    print(f"  Применяем форматирование (центр, перенос) для листа '{worksheet.title}'...")
-    center_wrap_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-    try:
-        # Применяем только к первым 6 колонкам (A-F) для производительности
-        for row in worksheet.iter_rows(max_col=6):
-            for cell in row:
-                # Проверяем, что ячейка не пустая, чтобы не форматировать лишнее
-                # (хотя форматирование пустых ячеек обычно безопасно)
-                # if cell.value is not None:
-                cell.alignment = center_wrap_alignment
-        print(f"  Форматирование применено для листа '{worksheet.title}'.")
-    except Exception as e:
-        print(f"  [WARN] Не удалось применить форматирование к листу '{worksheet.title}': {e}")
+# Форматирование задается стилем, а не ячейками: именованный стиль (центр, перенос) регистрируется
+# в книге один раз и назначается колонкам A-F по умолчанию; ячейки ссылаются на него по индексу.
+FORMATTED_COLUMNS = 6 # A-F
+CENTER_WRAP_STYLE_NAME = "Смета: центр, перенос"
+SEPARATOR_STYLE_NAME = "Смета: разделитель"
+# Ширина колонки: Мин 8.43 (стандарт Excel), Макс 60
+MIN_COLUMN_WIDTH = 8.43
+MAX_COLUMN_WIDTH = 60
+
+
+def center_wrap_style():
+    """Именованный стиль ячеек A-F: по центру, с переносом текста."""
+    return NamedStyle(name=CENTER_WRAP_STYLE_NAME,
+                      alignment=Alignment(horizontal='center', vertical='center', wrap_text=True))
+
+
+def separator_style():
+    """Именованный стиль строки-разделителя с именем файла: как center_wrap_style, жирный шрифт."""
+    return NamedStyle(name=SEPARATOR_STYLE_NAME, font=Font(bold=True),
+                      alignment=Alignment(horizontal='center', vertical='center', wrap_text=True))
+
 
+def register_style(workbook, style):
+    """Регистрирует именованный стиль в книге (если его там еще нет). Возвращает имя стиля."""
+    if style.name not in workbook.named_styles:
+        workbook.add_named_style(style)
+    return style.name
+
+
+def apply_column_style(worksheet, style, num_columns=FORMATTED_COLUMNS):
+    """Стиль колонок по умолчанию (первые num_columns): так отображаются ячейки колонки без своего стиля."""
+    for col_idx in range(1, num_columns + 1):
+        dimension = worksheet.column_dimensions[get_column_letter(col_idx)]
+        dimension.alignment = style.alignment
+        dimension.font = style.font
+
+
+def column_width(max_length):
+    """Ширина колонки по длине самого длинного значения (с запасом и в пределах MIN/MAX_COLUMN_WIDTH)."""
+    return min(max(max_length * 1.2 + 1, MIN_COLUMN_WIDTH), MAX_COLUMN_WIDTH)
+
+
+class ColumnWidthTracker:
+    """
+    Подбор ширины колонок по мере записи строк: хранит только максимальную длину значения
+    в каждой из первых num_columns колонок, без повторного прохода по листу.
+    """
+
+    def __init__(self, num_columns=FORMATTED_COLUMNS):
+        self.max_lengths = [0] * num_columns
+
+    def add_row(self, row, is_header=False):
+        max_lengths = self.max_lengths
+        for i in range(min(len(max_lengths), len(row))):
+            value = row[i]
+            length = len(str(value)) if value is not None else 0
+            if is_header:
+                length *= 1.1 # Небольшой запас для заголовка
+            if length > max_lengths[i]:
+                max_lengths[i] = length
+
+    def widths(self):
+        return [column_width(max_length) for max_length in self.max_lengths]
+
+
+# === Кэш референсных ширин на процесс ===
+# Ключ - абсолютный путь, значение - (mtime файла, ширины). Загрузка .xlsm занимает сотни мс,
+# поэтому файл читается один раз и перечитывается только при изменении mtime.
+_reference_widths_cache = {}
+_reference_widths_lock = threading.Lock()
 
 def read_reference_widths(reference_file_path):
     """
-    Читает ширины первых 6 столбцов (A-F) из референсного файла.
+    Возвращает ширины первых 6 столбцов (A-F) референсного файла, кэшируя их на процесс.
 
     Args:
         reference_file_path (str): Путь к референсному Excel файлу.
@@ -80,10 +88,36 @@ def read_reference_widths(reference_file_path):
     Returns:
         list or None: Список ширин [A, B, C, D, E, F] или None в случае ошибки или отсутствия файла.
     """
-    if not os.path.exists(reference_file_path):
+    cache_key = os.path.abspath(reference_file_path)
+    try:
+        mtime = os.path.getmtime(cache_key)
+    except OSError:
         print(f"  [INFO] Референсный файл не найден: {reference_file_path}. Будет использован автоподбор.")
+        with _reference_widths_lock:
+            _reference_widths_cache.pop(cache_key, None)
         return None
 
+    with _reference_widths_lock:
+        cached = _reference_widths_cache.get(cache_key)
+        if cached and cached[0] == mtime:
+            return list(cached[1]) if cached[1] is not None else None
+        # Загружаем под блокировкой, чтобы параллельные задачи не читали файл одновременно
+        widths = _load_reference_widths(reference_file_path)
+        # Ошибку чтения тоже кэшируем до изменения файла, чтобы не повторять ее на каждом запросе
+        _reference_widths_cache[cache_key] = (mtime, widths)
+        return list(widths) if widths is not None else None
+
+
+def _load_reference_widths(reference_file_path):
+    """
+    Читает ширины первых 6 столбцов (A-F) из референсного файла (без кэша).
+
+    Args:
+        reference_file_path (str): Путь к референсному Excel файлу.
+
+    Returns:
+        list or None: Список ширин [A, B, C, D, E, F] или None в случае ошибки или отсутствия файла.
+    """
     print(f"  Чтение референсных ширин из: {os.path.basename(reference_file_path)}...")
     wb_ref = None # Инициализируем переменную заранее
     try:
@@ -0,0 +1,43 @@
+# jobs.py
+import queue
+import threading
+import traceback
+
+class JobQueue:
+    """
+    Простая очередь фоновых задач внутри процесса (локальная замена брокера).
+
+    submit() кладет задачу в очередь и сразу возвращает управление,
+    задачи выполняют рабочие потоки. Тяжелый парсинг внутри задачи
+    при необходимости уходит в пул процессов (dispatcher.run_processors),
+    поэтому потоков здесь достаточно.
+    """
+
+    def __init__(self, num_workers=2, name="job-worker"):
+        self._queue = queue.Queue()
+        self._workers = []
+        for i in range(max(1, num_workers)):
+            worker = threading.Thread(target=self._worker_loop, name=f"{name}-{i + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job_id, func, *args, **kwargs):
+        """Ставит задачу в очередь. Возвращает job_id."""
+        self._queue.put((job_id, func, args, kwargs))
+        return job_id
+
+    def pending(self):
+        """Примерное число задач, ожидающих в очереди."""
+        return self._queue.qsize()
+
+    def _worker_loop(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                # Задача сама обновляет свой статус; здесь только защищаем рабочий поток
+                print(f"[КРИТИЧЕСКАЯ ОШИБКА] Фоновая задача {job_id} завершилась исключением: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
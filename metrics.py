@@ -0,0 +1,237 @@
+# metrics.py
+import time
+import threading
+import contextlib
+
+# Инструментация конвейера: времена этапов и счетчики процессоров.
+#   ProcessorStats - один запуск процессора (может выполняться в дочернем процессе, отдается как dict);
+#   JobMetrics     - одна задача /upload, пишет свои времена в статус задачи (поле "timings" в /progress);
+#   MetricsRegistry - накопленные значения процесса, отдаются в текстовом формате Prometheus (/metrics).
+
+# Этапы задачи в порядке выполнения конвейера
+JOB_STAGES = ("upload_save", "unzip", "detect", "load", "classify", "assemble",
+              "reference_widths", "output_build", "formatting", "output_save")
+# Этапы внутри процессора (подмножество JOB_STAGES)
+PROCESSOR_STAGES = ("detect", "load", "classify", "assemble")
+PROCESSOR_COUNTERS = ("rows_scanned", "items", "headers", "merge_lookups", "zero_price_skips")
+PROCESSOR_COUNTER_HELP = {
+    "rows_scanned": "Прочитанные строки исходных листов.",
+    "items": "Позиции, попавшие в результат.",
+    "headers": "Заголовки разделов и подразделов, попавшие в результат.",
+    "merge_lookups": "Поиски в индексе объединенных ячеек (check_merge).",
+    "zero_price_skips": "Позиции и разделы, пропущенные из-за нулевой цены.",
+}
+
+METRICS_PREFIX = "smeta"
+
+
+class ProcessorStats:
+    """
+    Времена этапов и счетчики одного запуска процессора.
+
+    Процессор вызывает lap(stage) в конце каждого этапа (время считается от предыдущей отметки)
+    и add(counter, n) для счетчиков; skip() - сдвинуть отметку, не засчитывая время (например,
+    пока потребитель генератора пишет пачку строк). Текущий объект берется через current_processor_stats().
+    smeta_type - тип сметы, которым фактически разобран файл (при автоопределении - найденный);
+    error - текст ошибки для пользователя, если файл не разобран по понятной ему причине
+    (например, формат не определен однозначно).
+    """
+    __slots__ = ("stages", "counters", "cache_hit", "smeta_type", "error", "_mark")
+
+    def __init__(self):
+        self.stages = dict.fromkeys(PROCESSOR_STAGES, 0.0)
+        self.counters = dict.fromkeys(PROCESSOR_COUNTERS, 0)
+        self.cache_hit = False
+        self.smeta_type = None
+        self.error = None
+        self._mark = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._mark)
+        self._mark = now
+
+    def skip(self):
+        """Переносит отметку на текущий момент, не засчитывая прошедшее время ни одному этапу."""
+        self._mark = time.perf_counter()
+
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def as_dict(self):
+        return {"stages": dict(self.stages), "counters": dict(self.counters), "cache_hit": self.cache_hit,
+                "smeta_type": self.smeta_type, "error": self.error}
+
+
+_local = threading.local()
+
+def current_processor_stats():
+    """Статистика текущего запуска процессора (или одноразовый объект, если процессор вызван напрямую)."""
+    stats = getattr(_local, "processor_stats", None)
+    return stats if stats is not None else ProcessorStats()
+
+@contextlib.contextmanager
+def collect_processor_stats():
+    """Делает новый ProcessorStats текущим для потока на время блока."""
+    previous = getattr(_local, "processor_stats", None)
+    stats = ProcessorStats()
+    _local.processor_stats = stats
+    try:
+        yield stats
+    finally:
+        _local.processor_stats = previous
+
+
+class JobMetrics:
+    """
+    Времена этапов и суммарные счетчики одной задачи обработки.
+
+    Счетчики файлов и процессоров копятся и по фактическому типу файла (by_type, ключ - ProcessorStats.smeta_type):
+    при автоопределении smeta_type задачи - запрошенный тип, а не формат файлов.
+
+    Если передан status (словарь статуса задачи), после каждого этапа в нем
+    обновляется status["timings"] - так время видно в ответе /progress. Статус при этом
+    не записывается в хранилище: времена уходят туда со следующим обновлением статуса задачи.
+    """
+
+    def __init__(self, status=None, smeta_type=None):
+        self.status = status
+        self.smeta_type = smeta_type
+        self.stages = {}
+        self.counters = dict.fromkeys(PROCESSOR_COUNTERS, 0)
+        self.files = 0
+        self.cache_hits = 0
+        self.by_type = {} # фактический тип -> {"counters": {...}, "files": int, "cache_hits": int}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - start)
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self._publish()
+
+    def add_processor_stats(self, stats):
+        """Добавляет статистику процессора (dict из ProcessorStats.as_dict()) по одному файлу."""
+        if not stats:
+            return
+        with self._lock:
+            type_totals = self.by_type.get(stats.get("smeta_type"))
+            if type_totals is None:
+                type_totals = self.by_type[stats.get("smeta_type")] = {
+                    "counters": dict.fromkeys(PROCESSOR_COUNTERS, 0), "files": 0, "cache_hits": 0}
+            self.files += 1
+            type_totals["files"] += 1
+            if stats.get("cache_hit"):
+                self.cache_hits += 1
+                type_totals["cache_hits"] += 1
+            for name, seconds in stats.get("stages", {}).items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+            for name, value in stats.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+                type_totals["counters"][name] = type_totals["counters"].get(name, 0) + value
+        self._publish()
+
+    def as_dict(self):
+        with self._lock:
+            stages = {name: round(self.stages[name], 4) for name in JOB_STAGES if name in self.stages}
+            return {"stages": stages, "counters": dict(self.counters), "files": self.files,
+                    "cache_hits": self.cache_hits, "elapsed": round(time.perf_counter() - self._started, 4)}
+
+    def _publish(self):
+        if self.status is not None:
+            self.status["timings"] = self.as_dict()
+
+
+class MetricsRegistry:
+    """Накопленные метрики процесса (потокобезопасно), отдаются в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stage_seconds = {} # stage -> (sum, count)
+        self._processor_counters = {} # (smeta_type, counter) -> value
+        self._jobs = {} # outcome -> count
+        self._files = {} # (smeta_type, cache) -> count
+
+    def observe_job(self, job_metrics, outcome):
+        """
+        Учитывает завершенную задачу (outcome: done / error / critical).
+        Счетчики файлов и процессоров - с меткой фактического типа файлов (неразобранные - "unknown").
+        """
+        with job_metrics._lock:
+            stages = dict(job_metrics.stages)
+            by_type = {smeta_type or "unknown": (dict(totals["counters"]), totals["files"], totals["cache_hits"])
+                       for smeta_type, totals in job_metrics.by_type.items()}
+        with self._lock:
+            self._jobs[outcome] = self._jobs.get(outcome, 0) + 1
+            for name, seconds in stages.items():
+                total, count = self._stage_seconds.get(name, (0.0, 0))
+                self._stage_seconds[name] = (total + seconds, count + 1)
+            for smeta_type, (counters, files, cache_hits) in by_type.items():
+                for name, value in counters.items():
+                    key = (smeta_type, name)
+                    self._processor_counters[key] = self._processor_counters.get(key, 0) + value
+                for cache, count in (("hit", cache_hits), ("miss", files - cache_hits)):
+                    if count:
+                        key = (smeta_type, cache)
+                        self._files[key] = self._files.get(key, 0) + count
+
+    def render(self, gauges=None):
+        """
+        Текст для /metrics.
+
+        Args:
+            gauges (dict): Дополнительные мгновенные значения {имя: (значение, описание)}.
+        """
+        lines = []
+        with self._lock:
+            name = f"{METRICS_PREFIX}_jobs_total"
+            lines += [f"# HELP {name} Завершенные задачи обработки по результату.", f"# TYPE {name} counter"]
+            for outcome, count in sorted(self._jobs.items()):
+                lines.append(f'{name}{{outcome="{_escape(outcome)}"}} {count}')
+
+            name = f"{METRICS_PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} Время этапов конвейера (сумма по задачам).", f"# TYPE {name} summary"]
+            for stage in sorted(self._stage_seconds, key=_stage_order):
+                total, count = self._stage_seconds[stage]
+                lines.append(f'{name}_sum{{stage="{_escape(stage)}"}} {total:.6f}')
+                lines.append(f'{name}_count{{stage="{_escape(stage)}"}} {count}')
+
+            name = f"{METRICS_PREFIX}_files_processed_total"
+            lines += [f"# HELP {name} Обработанные файлы по типу сметы и попаданию в кэш результатов.",
+                      f"# TYPE {name} counter"]
+            for (smeta_type, cache), count in sorted(self._files.items()):
+                lines.append(f'{name}{{smeta_type="{_escape(smeta_type)}",cache="{cache}"}} {count}')
+
+            for counter in PROCESSOR_COUNTERS:
+                name = f"{METRICS_PREFIX}_processor_{counter}_total"
+                values = sorted((smeta_type, value) for (smeta_type, key), value in self._processor_counters.items()
+                                if key == counter)
+                if not values:
+                    continue
+                lines += [f"# HELP {name} {PROCESSOR_COUNTER_HELP.get(counter, counter)}", f"# TYPE {name} counter"]
+                for smeta_type, value in values:
+                    lines.append(f'{name}{{smeta_type="{_escape(smeta_type)}"}} {value}')
+
+        for gauge_name, (value, help_text) in sorted((gauges or {}).items()):
+            name = f"{METRICS_PREFIX}_{gauge_name}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _stage_order(stage):
+    return JOB_STAGES.index(stage) if stage in JOB_STAGES else len(JOB_STAGES)
+
+def _escape(label_value):
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Реестр процесса (один на процесс веб-приложения)
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,381 @@
+# output_writer.py
+import os
+import csv
+import json
+import time
+import datetime
+import openpyxl
+from openpyxl.cell import Cell
+from openpyxl.utils import get_column_letter
+from formatting import ColumnWidthTracker, center_wrap_style, separator_style, register_style, apply_column_style
+from row_engine import SectionRow, ITEM
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # Parquet - необязательный формат, только если установлен pyarrow
+    pyarrow = None
+
+# Форматы итогового файла. Все писатели принимают один и тот же поток: write_headers, write_separator
+# (начало файла из архива), write_rows пачками, close - и пишут его по мере поступления строк.
+OUTPUT_FORMAT_XLSX = "xlsx"
+OUTPUT_FORMAT_CSV = "csv"
+OUTPUT_FORMAT_JSONL = "jsonl"
+OUTPUT_FORMAT_PARQUET = "parquet"
+OUTPUT_FORMATS = (OUTPUT_FORMAT_XLSX, OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_JSONL, OUTPUT_FORMAT_PARQUET)
+OUTPUT_FORMAT_EXTENSIONS = {OUTPUT_FORMAT_XLSX: ".xlsx", OUTPUT_FORMAT_CSV: ".csv",
+                            OUTPUT_FORMAT_JSONL: ".jsonl", OUTPUT_FORMAT_PARQUET: ".parquet"}
+OUTPUT_FORMAT_LABELS = {OUTPUT_FORMAT_XLSX: "Excel (.xlsx)", OUTPUT_FORMAT_CSV: "CSV",
+                        OUTPUT_FORMAT_JSONL: "JSON Lines", OUTPUT_FORMAT_PARQUET: "Parquet"}
+
+# Сколько строк максимум держим в памяти, пока подбираем ширины колонок (если нет референсных)
+AUTO_WIDTH_SAMPLE_ROWS = 2000
+# Строк в группе Parquet (row group): столько строк буферизуется перед записью на диск
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get('PARQUET_ROW_GROUP_SIZE', '50000'))
+# Служебные колонки Parquet: файл из архива и тип строки (вместо строк-разделителей)
+PARQUET_FILE_COLUMN = "Файл"
+PARQUET_KIND_COLUMN = "Тип строки"
+
+
+def available_output_formats():
+    """Форматы, доступные в этой установке (Parquet - только с pyarrow)."""
+    return tuple(output_format for output_format in OUTPUT_FORMATS
+                 if output_format != OUTPUT_FORMAT_PARQUET or pyarrow is not None)
+
+
+def output_format_error(output_format):
+    """Текст ошибки для клиента, если формат неизвестен или недоступен; None - формат подходит."""
+    if output_format not in OUTPUT_FORMATS:
+        return f"Неизвестный формат вывода: {output_format}"
+    if output_format not in available_output_formats():
+        return f"Формат {OUTPUT_FORMAT_LABELS[output_format]} недоступен: не установлен pyarrow"
+    return None
+
+
+def create_writer(output_format, output_path, sheet_title, column_widths=None):
+    """
+    Писатель итогового файла в формате output_format.
+
+    Args:
+        output_format (str): Формат (OUTPUT_FORMATS).
+        output_path (str): Путь итогового файла.
+        sheet_title (str): Название листа (.xlsx).
+        column_widths (list): Ширины колонок A-F (.xlsx; None - автоподбор).
+
+    Raises:
+        ValueError: Формат неизвестен или недоступен.
+    """
+    error = output_format_error(output_format)
+    if error:
+        raise ValueError(error)
+    if output_format == OUTPUT_FORMAT_XLSX:
+        return StreamingResultWriter(output_path, sheet_title, column_widths=column_widths)
+    if output_format == OUTPUT_FORMAT_CSV:
+        return CsvResultWriter(output_path)
+    if output_format == OUTPUT_FORMAT_JSONL:
+        return JsonLinesResultWriter(output_path)
+    return ParquetResultWriter(output_path)
+
+
+class StreamingResultWriter:
+    """
+    Потоковая запись итогового файла в режиме write_only.
+
+    Строки уходят на диск сразу при записи, поэтому память ограничена одной строкой.
+    Все, что обычный Workbook делал пост-проходами, задается заранее:
+      - выравнивание (центр, перенос) - именованным стилем, который регистрируется в книге один раз
+        и задается колонкам по умолчанию; ячейки первых num_columns колонок получают готовый
+        индекс стиля, без своего Alignment (стоимость форматирования - по колонкам, не по ячейкам);
+      - ширины колонок - до первой строки (в write_only они пишутся в начало листа);
+      - разделители файлов - объединенная строка A:F, диапазоны пишутся в конец листа.
+
+    Если референсных ширин нет, первые AUTO_WIDTH_SAMPLE_ROWS строк буферизуются, а ширины
+    подбираются по мере записи (formatting.ColumnWidthTracker).
+
+    format_seconds - время, потраченное на подбор и установку ширин (этап "formatting" в метриках).
+    """
+
+    def __init__(self, output_path, sheet_title, column_widths=None, num_columns=6):
+        self.output_path = output_path
+        self.num_columns = num_columns
+        self.rows_written = 0
+        self.format_seconds = 0.0
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._worksheet = self._workbook.create_sheet(title=sheet_title)
+        started = time.perf_counter()
+        # Стили регистрируются один раз; ячейки строятся сразу с их индексами (as_tuple)
+        self._cell_style = center_wrap_style()
+        self._separator_style = separator_style()
+        register_style(self._workbook, self._cell_style)
+        register_style(self._workbook, self._separator_style)
+        self._column_widths = list(column_widths) if column_widths else None
+        # Буфер строк (и их типов) до фиксации ширин колонок
+        self._pending = [] if self._column_widths is None else None
+        self._width_tracker = ColumnWidthTracker(num_columns)
+        if self._column_widths is not None:
+            self._apply_columns()
+        self.format_seconds += time.perf_counter() - started
+
+    # --- Публичный API ---
+
+    def write_headers(self, headers):
+        self._write(list(headers), is_header=True)
+
+    def write_separator(self, title):
+        """Строка-разделитель с именем файла: объединение A:F, жирный шрифт."""
+        self._write([title] + [None] * (self.num_columns - 1), is_separator=True)
+
+    def write_rows(self, rows):
+        count = 0
+        for row in rows:
+            self._write(row)
+            count += 1
+        return count
+
+    def close(self):
+        """Дописывает буфер (если ширины так и не зафиксированы) и сохраняет файл."""
+        if self._pending is not None:
+            self._flush_pending()
+        self._workbook.save(self.output_path)
+        self._workbook.close()
+
+    def discard(self):
+        """
+        Бросает недописанный файл. Книга write_only сохраняется как есть и сразу удаляется:
+        только save закрывает поток строк листа и удаляет временный файл openpyxl через публичный API.
+        """
+        self._pending = None
+        try:
+            self._workbook.save(self.output_path)
+        finally:
+            _remove(self.output_path)
+
+    # --- Внутреннее ---
+
+    def _write(self, row, is_header=False, is_separator=False):
+        if self._pending is not None:
+            started = time.perf_counter()
+            self._width_tracker.add_row(row, is_header)
+            self.format_seconds += time.perf_counter() - started
+            self._pending.append((row, is_separator))
+            if len(self._pending) >= AUTO_WIDTH_SAMPLE_ROWS:
+                self._flush_pending()
+            return
+        self._append(row, is_separator)
+
+    def _flush_pending(self):
+        started = time.perf_counter()
+        self._column_widths = self._width_tracker.widths()
+        self._apply_columns()
+        self.format_seconds += time.perf_counter() - started
+        pending, self._pending = self._pending, None
+        for row, is_separator in pending:
+            self._append(row, is_separator)
+
+    def _apply_columns(self):
+        # Ширины и стиль колонок по умолчанию - один раз, до первой строки
+        for i, width in enumerate(self._column_widths[:self.num_columns]):
+            if width is not None:
+                self._worksheet.column_dimensions[get_column_letter(i + 1)].width = width
+        apply_column_style(self._worksheet, self._cell_style, self.num_columns)
+
+    def _append(self, row, is_separator):
+        self.rows_written += 1
+        worksheet = self._worksheet
+        style_array = self._cell_style.as_tuple()
+        cells = []
+        for i in range(max(len(row), self.num_columns)):
+            value = row[i] if i < len(row) else None
+            if i >= self.num_columns:
+                cells.append(value)
+                continue
+            cell_style = self._separator_style.as_tuple() if is_separator and i == 0 else style_array
+            cells.append(Cell(worksheet, row=1, column=1, value=value, style_array=cell_style))
+        worksheet.append(cells)
+        if is_separator:
+            row_idx = self.rows_written
+            self._worksheet.merged_cells.add(f"A{row_idx}:{get_column_letter(self.num_columns)}{row_idx}")
+
+
+class CsvResultWriter:
+    """
+    Потоковая запись CSV (UTF-8, разделитель - запятая): строки уходят в файл сразу, без оформления.
+
+    Разделитель файлов - строка с именем файла в первой колонке (как в .xlsx, но без объединения).
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.rows_written = 0
+        self.format_seconds = 0.0
+        self._num_columns = 0
+        self._file = open(output_path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+
+    def write_headers(self, headers):
+        self._num_columns = len(headers)
+        self._writer.writerow(headers)
+        self.rows_written += 1
+
+    def write_separator(self, title):
+        self._writer.writerow([title] + [None] * (self._num_columns - 1))
+        self.rows_written += 1
+
+    def write_rows(self, rows):
+        writerow = self._writer.writerow
+        count = 0
+        for row in rows:
+            writerow(row)
+            count += 1
+        self.rows_written += count
+        return count
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        _remove(self.output_path)
+
+
+class JsonLinesResultWriter:
+    """
+    Потоковая запись JSON Lines (UTF-8): один JSON объект на строку.
+
+      {"type": "columns", "columns": [...]}            - заголовки колонок (первая строка);
+      {"type": "file", "name": "..."}                   - начало файла из архива (вместо строки-разделителя);
+      {"type": "section" | "subsection", "values": [...]} - заголовок раздела/подраздела;
+      {"type": "item", "values": [...]}                 - позиция.
+    values - значения в порядке колонок; даты и время - строками ISO 8601.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.rows_written = 0
+        self.format_seconds = 0.0
+        self._file = open(output_path, 'w', encoding='utf-8')
+        self._encoder = json.JSONEncoder(ensure_ascii=False, default=_text_value)
+
+    def write_headers(self, headers):
+        self._write_record({"type": "columns", "columns": list(headers)})
+
+    def write_separator(self, title):
+        self._write_record({"type": "file", "name": title})
+
+    def write_rows(self, rows):
+        encode = self._encoder.encode
+        lines = []
+        for row in rows:
+            kind = row.kind if isinstance(row, SectionRow) else ITEM
+            lines.append(encode({"type": kind, "values": row}))
+        if lines:
+            self._file.write("\n".join(lines) + "\n")
+        self.rows_written += len(lines)
+        return len(lines)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        _remove(self.output_path)
+
+    def _write_record(self, record):
+        self._file.write(self._encoder.encode(record) + "\n")
+        self.rows_written += 1
+
+
+class ParquetResultWriter:
+    """
+    Запись Parquet (нужен pyarrow): строки копятся в буфере и уходят на диск группами
+    по PARQUET_ROW_GROUP_SIZE строк, так что память ограничена одной группой.
+
+    Вместо строк-разделителей - служебные колонки PARQUET_FILE_COLUMN (файл из архива)
+    и PARQUET_KIND_COLUMN (item, section, subsection). Колонки данных - строки
+    (в режиме значений у одной колонки бывают и числа, и текст); None - null.
+    """
+
+    def __init__(self, output_path):
+        if pyarrow is None:
+            raise ValueError(output_format_error(OUTPUT_FORMAT_PARQUET))
+        self.output_path = output_path
+        self.rows_written = 0
+        self.format_seconds = 0.0
+        self._headers = []
+        self._schema = None
+        self._width = None # Число колонок данных (по заголовкам и первой строке)
+        self._writer = None
+        self._current_file = None
+        self._files = []
+        self._kinds = []
+        self._rows = [] # Буфер группы
+
+    def write_headers(self, headers):
+        self._headers = list(headers)
+
+    def write_separator(self, title):
+        self._current_file = title
+
+    def write_rows(self, rows):
+        count = 0
+        for row in rows:
+            if self._width is None:
+                self._start(len(row))
+            self._rows.append(row)
+            self._files.append(self._current_file)
+            self._kinds.append(row.kind if isinstance(row, SectionRow) else ITEM)
+            count += 1
+            if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+                self._flush()
+        self.rows_written += count
+        return count
+
+    def close(self):
+        if self._width is None:
+            self._start(0) # Нет ни одной строки - файл только со схемой
+        self._flush(force=True)
+        self._writer.close()
+
+    def discard(self):
+        self._files, self._kinds, self._rows = [], [], []
+        if self._writer is not None:
+            self._writer.close()
+        _remove(self.output_path)
+
+    def _start(self, row_width):
+        names = list(self._headers)
+        names += [f"Колонка {i + 1}" for i in range(len(names), row_width)]
+        self._width = len(names)
+        self._schema = pyarrow.schema([(name, pyarrow.string())
+                                       for name in [PARQUET_FILE_COLUMN, PARQUET_KIND_COLUMN] + names])
+
+    def _flush(self, force=False):
+        if not self._rows and not force:
+            return
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.output_path, self._schema)
+        if self._rows:
+            # Строки -> колонки (короткие строки дополняются None, лишние ячейки отбрасываются)
+            width = self._width
+            rows = [row if len(row) == width else (list(row) + [None] * width)[:width] for row in self._rows]
+            columns = [self._files, self._kinds]
+            columns += [[value if value is None or type(value) is str else _text_value(value) for value in column]
+                        for column in zip(*rows)] if width else []
+            table = pyarrow.Table.from_arrays([pyarrow.array(values, type=pyarrow.string()) for values in columns],
+                                              schema=self._schema)
+            self._writer.write_table(table)
+        self._files, self._kinds, self._rows = [], [], []
+
+
+def _text_value(value):
+    # Значение ячейки строкой (Parquet; в JSON - для типов, которых там нет): даты/время - ISO 8601
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
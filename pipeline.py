@@ -0,0 +1,438 @@
+# pipeline.py
+import os
+import uuid
+import zipfile
+import traceback
+import re
+import time
+import pickle
+import tempfile
+import dispatcher
+import metrics
+from archive_reader import list_excel_members
+from output_writer import create_writer, output_format_error, OUTPUT_FORMAT_XLSX, OUTPUT_FORMAT_EXTENSIONS
+from formatting import read_reference_widths
+from results_store import ResultsStore
+
+# Конвейер обработки загрузки без привязки к Flask: распаковка, парсинг, сборка итогового файла.
+# Используется фоновыми задачами (jobs.py), запускаемыми из app.upload_file, и пакетной обработкой (batch.py).
+
+REFERENCE_FOLDER = 'reference_files'
+REFERENCE_SMETA_RU = os.path.join(REFERENCE_FOLDER, "Смета ру.xlsm") # Укажите точное имя вашего референсного файла
+REFERENCE_TURBOSMETCHIK = os.path.join(REFERENCE_FOLDER, "Турбосметчик1,2,3.xlsm")
+
+# Строки файла, пока он разбирается: до этого размера - в памяти, больше - во временном файле (_FileSpool)
+FILE_SPOOL_MAX_BYTES = int(os.environ.get('FILE_SPOOL_MAX_BYTES', str(16 * 1024 * 1024))) # 16 MB
+
+
+def process_upload(session_id, saved_file_path, original_filename_unsafe, smeta_type, upload_path, status, results_folder, workers=1,
+                   job_metrics=None, results_store=None, output_mode=dispatcher.OUTPUT_COORDS,
+                   output_format=OUTPUT_FORMAT_XLSX):
+    """
+    Обрабатывает сохраненную загрузку (Excel или ZIP) и сохраняет итоговый файл (.xlsx, CSV, JSON Lines или Parquet).
+
+    Args:
+        session_id (str): ID сессии/задачи (для логов и запасного имени файла).
+        saved_file_path (str): Путь к сохраненному загруженному файлу.
+        original_filename_unsafe (str): Исходное имя файла от клиента.
+        smeta_type (str): Тип сметы (ключ из dispatcher.PROCESSORS), dispatcher.AUTO_DETECT_TYPE или общий тип
+                          без версии - тогда формат определяется для каждого файла отдельно.
+        upload_path (str): Временная папка сессии (временные файлы для больших файлов архива).
+        status (dict): Словарь статуса сессии, обновляется по ходу обработки.
+        results_folder (str): Папка для итоговых файлов (результат - в подпапке задачи).
+        workers (int): Число процессов для параллельной обработки файлов архива.
+        job_metrics (metrics.JobMetrics): Времена этапов и счетчики задачи (если None - создается свой).
+        results_store (results_store.ResultsStore): Хранилище результатов с квотами (если None - папка
+                          results_folder без квот).
+        output_mode (str): Режим вывода (dispatcher.OUTPUT_MODES): координаты ячеек, их значения или и то, и другое.
+        output_format (str): Формат итогового файла (output_writer.OUTPUT_FORMATS).
+
+    Returns:
+        dict: {"message": str, "output_filename": str, "output_path": str}
+
+    Raises:
+        ValueError: Ошибки входных данных (тип файла, распаковка, нет данных).
+    """
+    is_zip = original_filename_unsafe.lower().endswith('.zip')
+    is_excel = original_filename_unsafe.lower().endswith(('.xlsx', '.xlsm'))
+    if job_metrics is None:
+        job_metrics = metrics.JobMetrics(status, smeta_type)
+    if results_store is None:
+        results_store = ResultsStore(results_folder, max_age_seconds=0, max_bytes=0)
+
+    files_to_process_info = []
+    if is_zip:
+        # --- Статус для ZIP ---
+        status.update({"processed": 0, "total": 0, "status": "Чтение архива..."})
+        print(f"({session_id}) ZIP архив. Чтение списка файлов...")
+        # ------------------------------------
+        # Файлы не распаковываются на диск: каждый читается из архива прямо перед разбором
+        # (в память, а больше archive_reader.ZIP_SPOOL_MAX_BYTES - во временный файл в папке сессии)
+        unzip_started = time.perf_counter()
+        try:
+            # === Получаем и СОРТИРУЕМ список файлов ===
+            zip_members = list_excel_members(saved_file_path, spool_dir=upload_path)
+            # --- Обновляем total в статусе ---
+            status.update({"total": len(zip_members), "status": "Найдено файлов: {}".format(len(zip_members))})
+            print(f"({session_id}) Найдено и отсортировано файлов в ZIP: {[m.member_name for m in zip_members]}")
+            # ---------------------------------
+            for member in zip_members:
+                files_to_process_info.append({"path": member, "original_name": member.display_name})
+
+            if not files_to_process_info: raise ValueError("В архиве не найдено поддерживаемых Excel файлов.")
+
+        except zipfile.BadZipFile: raise ValueError("Некорректный ZIP архив.")
+        except ValueError as ve: raise ve
+        except Exception as e: raise ValueError(f"Ошибка при чтении ZIP: {e}")
+        finally: job_metrics.add_stage_time("unzip", time.perf_counter() - unzip_started)
+
+    elif is_excel:
+        print(f"({session_id}) Одиночный Excel файл.")
+         # --- Статус для одного файла ---
+        status.update({"processed": 0, "total": 1, "status": "Подготовка..."})
+        # ------------------------------------------
+        files_to_process_info.append({"path": saved_file_path, "original_name": original_filename_unsafe})
+    else:
+        raise ValueError(f"Неподдерживаемый тип файла: {original_filename_unsafe}.")
+
+    # --- Имя итогового файла (нужно до разбора: строки пишутся в него по мере готовности) ---
+    safe_output_filename, sheet_title = result_names(original_filename_unsafe, session_id, output_format)
+
+    # Файл пишется во временный и публикуется в папке задачи целиком, когда он готов (results_store)
+    output_temp_path = results_store.new_path(session_id, safe_output_filename)
+    # Для архива файлы можно обрабатывать параллельно в пуле процессов (PROCESSING_WORKERS > 1)
+    workers = workers if is_zip else 1
+    try:
+        outcome = build_result(session_id, files_to_process_info, smeta_type, output_temp_path, sheet_title, status,
+                               job_metrics, workers=workers, output_mode=output_mode, output_format=output_format)
+        output_file_path = results_store.commit(session_id, safe_output_filename, output_temp_path)
+    except BaseException:
+        results_store.discard(output_temp_path) # Недописанный итоговый файл не оставляем
+        raise
+    print(f"({session_id}) Итоговый файл сохранен: {output_file_path}")
+    collected_types = outcome["types"]
+    if len(collected_types) > 1:
+        print(f"  ({session_id}) Файлы разных форматов: {', '.join(collected_types)}. Ширины по формату {collected_types[0]}")
+    return {"message": outcome["message"], "output_filename": safe_output_filename, "output_path": output_file_path}
+
+
+def result_names(original_filename_unsafe, session_id, output_format=OUTPUT_FORMAT_XLSX):
+    """
+    Имя итогового файла (с расширением формата output_format) и название листа по имени входного файла.
+
+    Returns:
+        tuple: (output_filename, sheet_title)
+    """
+    original_base_name = os.path.splitext(original_filename_unsafe)[0]
+    safe_base_name = safe_name(original_base_name)
+
+    if not safe_base_name: # Если имя стало пустым после очистки
+         safe_base_name = f"file_{uuid.uuid4().hex[:8]}" # Генерируем запасное имя
+
+    extension = OUTPUT_FORMAT_EXTENSIONS[output_format]
+    output_filename = f"{safe_base_name}_processed{extension}"
+    sheet_title = safe_base_name[:31] # Используем очищенное имя для названия листа
+
+    # Используем наше очищенное имя. secure_filename больше не нужен здесь,
+    # т.к. мы сами провели очистку.
+    safe_output_filename = output_filename
+
+    # Запасной вариант, если имя все равно оказалось некорректным (маловероятно)
+    if not safe_output_filename or len(safe_output_filename) > 200: # Добавим проверку длины
+        safe_output_filename = f"result_{session_id}{extension}"
+    return safe_output_filename, sheet_title
+
+
+def safe_name(name):
+    """Очищенное имя (без расширения) для файла на диске; может стать пустым."""
+    # Очищаем базовое имя: разрешаем буквы (вкл. кириллицу), цифры, пробелы, _, -.
+    # Заменяем другие потенциально проблемные символы на _.
+    # Удаляем начальные/конечные пробелы и заменяем множественные пробелы одним.
+    safe_base_name = re.sub(r'[^\w\s.-]+', '_', name, flags=re.UNICODE) # Оставляем буквы, цифры, _, пробел, -, . (Дефис в конце)
+    safe_base_name = re.sub(r'\s+', ' ', safe_base_name).strip() # Убираем лишние пробелы
+    # Дополнительно заменяем символы, опасные для файловых систем
+    safe_base_name = re.sub(r'[\\\\/:*?"<>|]+', '_', safe_base_name)
+    safe_base_name = safe_base_name.replace('..', '_') # Предотвращаем выход из директории
+    return safe_base_name
+
+
+def build_result(session_id, files_to_process_info, smeta_type, output_path, sheet_title, status, job_metrics,
+                 workers=1, output_mode=dispatcher.OUTPUT_COORDS, output_format=OUTPUT_FORMAT_XLSX):
+    """
+    Разбирает файлы и пишет итоговый файл в output_path (строки - по мере готовности).
+    Общая часть /upload (process_upload) и пакетной обработки (batch.py).
+
+    Args:
+        session_id (str): ID задачи (для логов).
+        files_to_process_info (list): [{"path": путь или ZipMember, "original_name": имя для разделителя}, ...].
+        smeta_type (str): Тип сметы (как в process_upload).
+        output_path (str): Куда писать итоговый файл (при ошибке файл может остаться недописанным).
+        sheet_title (str): Название листа.
+        status (dict): Словарь статуса, обновляется по ходу обработки.
+        job_metrics (metrics.JobMetrics): Времена этапов и счетчики задачи.
+        workers (int): Число процессов для параллельной обработки файлов.
+        output_mode (str): Режим вывода (dispatcher.OUTPUT_MODES).
+        output_format (str): Формат итогового файла (output_writer.OUTPUT_FORMATS).
+
+    Returns:
+        dict: {"message": str, "types": [фактические типы файлов], "files_ok": int, "has_errors": bool}
+
+    Raises:
+        ValueError: Ни один файл не дал данных; формат вывода неизвестен или недоступен.
+    """
+    format_error = output_format_error(output_format)
+    if format_error: raise ValueError(format_error) # До разбора: иначе ошибка была бы у каждого файла
+
+    # --- Разбор файлов с записью результата по мере готовности ---
+    # Итоговый файл открывается на первом разобранном файле; файл попадает в него только разобранным
+    # целиком (пачки строк одного файла копятся в _FileSpool - в памяти или во временном файле), так что
+    # ошибка посреди файла не оставляет в итоге его обрезанный раздел.
+    output = _ResultFile(session_id, output_path, sheet_title, job_metrics, output_format,
+                         with_separators=len(files_to_process_info) > 1) # Разделители, если файлов > 1
+    has_errors = False
+    files_ok = 0 # Файлы, полностью записанные в итоговый
+    processor_errors = [] # Понятные пользователю причины, по которым файлы не разобраны (ProcessorStats.error)
+
+    current_total = status.get("total", len(files_to_process_info))
+    status.update({"status": f"Обработка файлов (всего {current_total})..."})
+    print(f"\n({session_id}) {status['status']} Процессов: {workers}")
+
+    def finish_file(original_fname, file_type, rows_count, error=None):
+        """Обновляет статус после файла. rows_count None - файл не разобран (error - текст ошибки для статуса)."""
+        # Все изменения статуса по файлу - одной записью в хранилище статусов
+        changes = {}
+        if rows_count is not None:
+            print(f"  ({session_id}) Разобрано {rows_count} строк из {original_fname} ({file_type})")
+            # --- Обновляем processed count в статусе ПОСЛЕ УСПЕХА ---
+            changes["processed"] = status["processed"] + 1
+            # ------------------------------------------------------
+        else:
+            if error is None: print(f"  [ОШИБКА] ({session_id}) Обработчик не вернул данные для {original_fname}")
+            changes["error"] = error or f"Ошибка обработки {original_fname}" # Отмечаем ошибку в статусе
+        # --- Обновляем статус после каждого завершенного файла ---
+        processed_count = changes.get("processed", status["processed"])
+        changes["status"] = f"Обработано файлов {processed_count} из {current_total}: {original_fname}"
+        status.update(changes)
+        # ---------------------------------------------------------
+        return rows_count is not None
+
+    try:
+        if workers > 1 and len(files_to_process_info) > 1:
+            # Пул процессов: результаты приходят по мере готовности. Статус обновляется сразу по готовности
+            # файла, а в итоговый файл они пишутся в исходном порядке - пришедшие раньше предыдущих файлов
+            # ждут своей очереди (None - файл не разобран)
+            input_paths = [file_info["path"] for file_info in files_to_process_info]
+            waiting = {}
+            next_index = 0
+            for i, (headers, data_rows), processor_stats in dispatcher.run_processors(
+                    smeta_type, input_paths, max_workers=workers, output_mode=output_mode):
+                job_metrics.add_processor_stats(processor_stats) # Загрузка, разбор строк, сборка координат + счетчики
+                file_type = processor_stats.get("smeta_type") if processor_stats else None
+                parsed = bool(headers) and data_rows is not None
+                processor_error = processor_stats.get("error") if processor_stats else None
+                if processor_error: processor_errors.append(processor_error)
+                finish_file(files_to_process_info[i]["original_name"], file_type, len(data_rows) if parsed else None,
+                            processor_error)
+                waiting[i] = (headers, data_rows, file_type) if parsed else None
+                while next_index in waiting:
+                    parsed_file = waiting.pop(next_index)
+                    original_fname = files_to_process_info[next_index]["original_name"]
+                    next_index += 1
+                    if parsed_file is None:
+                        has_errors = True
+                        continue
+                    headers, data_rows, file_type = parsed_file
+                    try:
+                        output.begin_file(original_fname, file_type, headers)
+                        output.write_rows(data_rows)
+                        files_ok += 1
+                    except Exception as e:
+                        print(f"  [КРИТИЧЕСКАЯ ОШИБКА] ({session_id}) при записи данных из {original_fname}: {e}")
+                        traceback.print_exc(); has_errors = True
+                        status.update({"error": f"Критическая ошибка при обработке {original_fname}"})
+        else:
+            for file_info in files_to_process_info:
+                original_fname = file_info["original_name"]
+                rows_count, error = None, None
+                spool = None
+                with metrics.collect_processor_stats() as stats:
+                    try:
+                        with dispatcher.open_processor_stream(smeta_type, file_info["path"], output_mode) as (headers, batches):
+                            if headers is not None:
+                                spool = _FileSpool()
+                                for batch in batches:
+                                    spool.add(batch)
+                        if spool is not None:
+                            # Файл разобран целиком - переносим его пачки в итоговый файл
+                            output.begin_file(original_fname, stats.smeta_type, headers)
+                            rows_count = sum(output.write_rows(batch) for batch in spool.batches())
+                    except Exception as e:
+                        # В итог из файла ничего не записано - отмечаем ошибку, остальные файлы продолжаем
+                        print(f"  [КРИТИЧЕСКАЯ ОШИБКА] ({session_id}) при обработке данных из {original_fname}: {e}")
+                        traceback.print_exc(); rows_count, error = None, f"Критическая ошибка при обработке {original_fname}"
+                    finally:
+                        if spool is not None: spool.close()
+                job_metrics.add_processor_stats(stats.as_dict()) # Загрузка, разбор строк, сборка координат + счетчики
+                if stats.error: processor_errors.append(stats.error)
+                if finish_file(original_fname, stats.smeta_type, rows_count, error or stats.error): files_ok += 1
+                else: has_errors = True
+
+        # --- Анализ результата ---
+        if not files_ok:
+            error_msg = "Во время обработки произошли ошибки, результаты не получены." if has_errors else "Не найдено данных для обработки."
+            if processor_errors: error_msg += " " + processor_errors[0] # Например, формат не определен однозначно
+            # Обновляем статус перед выбросом ошибки
+            status.update({"status": "Ошибка", "error": error_msg})
+            raise ValueError(error_msg)
+
+        # --- Обновляем статус: Сохранение ---
+        status.update({"status": "Сохранение файла..."})
+        # -----------------------------------
+        output.close()
+    except BaseException:
+        output.discard() # Итог не публикуется - недописанный файл и временные файлы писателя не оставляем
+        raise
+    collected_types = output.types
+
+    # --- Итоговое сообщение ---
+    final_message = "Обработка завершена."
+    if smeta_type not in dispatcher.PROCESSORS and collected_types:
+        final_message += f" Определенный формат: {', '.join(collected_types)}."
+    if has_errors: final_message += " Были ошибки при обработке некоторых файлов."
+    if files_ok < len(files_to_process_info): final_message += " Не все файлы из архива были успешно обработаны."
+    return {"message": final_message, "types": collected_types, "files_ok": files_ok, "has_errors": has_errors}
+
+
+def warm_up():
+    """Прогрев кэшей процесса до первой задачи: референсные ширины колонок всех форматов."""
+    for reference_file in (REFERENCE_SMETA_RU, REFERENCE_TURBOSMETCHIK):
+        read_reference_widths(reference_file)
+
+
+def _reference_widths_file(smeta_type):
+    """Референсный файл ширин колонок для типа сметы (None - автоподбор)."""
+    if smeta_type == "Смета ру":
+        return REFERENCE_SMETA_RU
+    if smeta_type and smeta_type.startswith("Турбосметчик-"): # <-- ИСПРАВЛЕНО: Проверяем начало строки
+        return REFERENCE_TURBOSMETCHIK
+    return None
+
+
+class _FileSpool:
+    """
+    Пачки строк одного файла, пока он разбирается (ошибка посреди файла - спул просто закрывается).
+
+    Пачки пишутся pickle подряд в SpooledTemporaryFile: до FILE_SPOOL_MAX_BYTES - в памяти,
+    дальше - во временном файле, так что большой файл не держит все свои строки в памяти.
+    Спул читает только создавший его процесс.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._file = tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_MAX_BYTES if max_bytes is None else max_bytes)
+
+    def add(self, batch):
+        pickle.dump(batch, self._file, pickle.HIGHEST_PROTOCOL)
+
+    def batches(self):
+        """Пачки в порядке добавления."""
+        self._file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._file)
+            except EOFError:
+                return
+
+    def close(self):
+        self._file.close()
+
+
+class _ResultFile:
+    """
+    Итоговый файл, который заполняется по мере разбора файлов (писатель - output_writer.create_writer).
+
+    Открывается на первом разобранном файле: ширины колонок .xlsx берутся по его формату
+    (при автоопределении у файлов архива он может быть разным), заголовки - от его процессора.
+    Разделители файлов в .xlsx и CSV - строки с именем файла, в JSON Lines и Parquet - разметка.
+    Время записи строк идет в этапы output_build/formatting, сохранения - в output_save.
+    """
+
+    def __init__(self, session_id, output_path, sheet_title, job_metrics, output_format=OUTPUT_FORMAT_XLSX,
+                 with_separators=False):
+        self.session_id = session_id
+        self.output_path = output_path
+        self.sheet_title = sheet_title
+        self.job_metrics = job_metrics
+        self.output_format = output_format
+        self.with_separators = with_separators
+        self.types = [] # Фактические типы записанных файлов, в порядке появления
+        self._writer = None
+        self._headers = None
+        self._write_seconds = 0.0
+
+    def begin_file(self, original_fname, smeta_type, headers):
+        """Начинает очередной файл: при первом - создает итоговый файл, дальше - разделитель с именем."""
+        if self._writer is None:
+            self._open(smeta_type, headers)
+        elif self._headers != headers:
+            print("[WARN] Заголовки отличаются!")
+        if smeta_type and smeta_type not in self.types:
+            self.types.append(smeta_type)
+        if self.with_separators:
+            print(f"  ({self.session_id}) Доб. разделитель '{original_fname}' в строку {self._writer.rows_written + 1}")
+            started = time.perf_counter()
+            self._writer.write_separator(original_fname)
+            self._write_seconds += time.perf_counter() - started
+
+    def write_rows(self, rows):
+        started = time.perf_counter()
+        written_count = self._writer.write_rows(rows)
+        self._write_seconds += time.perf_counter() - started
+        return written_count
+
+    def discard(self):
+        """Бросает итоговый файл (ошибка задачи): писатель закрывается, его файлы удаляются."""
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        try:
+            writer.discard()
+        except Exception as e:
+            print(f"[WARN] ({self.session_id}) Не удалось удалить недописанный итоговый файл: {e}")
+
+    def close(self):
+        save_started = time.perf_counter()
+        self._writer.close()
+        self.job_metrics.add_stage_time("output_save", time.perf_counter() - save_started)
+        # Оформление (подбор и установка ширин колонок) идет внутри записи строк - выделяем его отдельным этапом
+        self.job_metrics.add_stage_time("output_build", max(self._write_seconds - self._writer.format_seconds, 0.0))
+        self.job_metrics.add_stage_time("formatting", self._writer.format_seconds)
+
+    def _open(self, smeta_type, headers):
+        session_id = self.session_id
+        # --- Чтение референсных ширин ---
+        reference_widths = None
+        # Ширины колонок есть только у .xlsx
+        reference_file_to_read = _reference_widths_file(smeta_type) if self.output_format == OUTPUT_FORMAT_XLSX else None
+        if reference_file_to_read:
+            # Ширины кэшируются на процесс (formatting.read_reference_widths), файл перечитывается только при изменении
+            with self.job_metrics.stage("reference_widths"):
+                reference_widths = read_reference_widths(reference_file_to_read)
+            print(f"  ({session_id}) Референсные ширины: {reference_widths}")
+        # --- Если reference_file_to_read is None (другой тип сметы), то reference_widths останется None ---
+
+        print(f"({session_id}) Подготовка итогового файла: {self.output_path}")
+        # --- Потоковая запись (.xlsx - write_only): ширины и выравнивание задаются заранее, без пост-проходов ---
+        if self.output_format != OUTPUT_FORMAT_XLSX:
+            print(f"({session_id}) Формат вывода: {self.output_format}")
+        elif reference_widths and len(reference_widths) >= 6: # Референсные ширины, если они были успешно прочитаны
+            print(f"({session_id}) Применение референсных ширин: {reference_widths[:6]}")
+        else: # Иначе автоподбор по первым строкам
+            print(f"({session_id}) Автоподбор ширины колонок...")
+            reference_widths = None
+        started = time.perf_counter()
+        self._writer = create_writer(self.output_format, self.output_path, self.sheet_title,
+                                     column_widths=reference_widths)
+        self._headers = headers
+        if headers: self._writer.write_headers(headers)
+        self._write_seconds += time.perf_counter() - started
+        print(f"({session_id}) Запись данных в итоговый файл...")
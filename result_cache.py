@@ -0,0 +1,195 @@
+# result_cache.py
+import os
+import json
+import zlib
+import hashlib
+import datetime
+import threading
+from row_engine import SectionRow
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+DEFAULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join('cache', 'results'))
+DEFAULT_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(512 * 1024 * 1024))) # 512 MB
+CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Записи кэша - JSON, сжатый zlib
+_ENTRY_SUFFIX = '.json.z'
+
+def file_sha256(input_path):
+    """SHA-256 содержимого файла (читается блоками). Открытый бинарный файл читается с начала и перематывается назад."""
+    digest = hashlib.sha256()
+    if hasattr(input_path, 'read'):
+        input_path.seek(0)
+        for chunk in iter(lambda: input_path.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        input_path.seek(0)
+        return digest.hexdigest()
+    with open(input_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Типы значений ячеек, которых нет в JSON (режим значений): тег -> (тип, разбор из ISO 8601)
+_TAGGED_TYPES = (
+    ("$datetime", datetime.datetime, datetime.datetime.fromisoformat),
+    ("$date", datetime.date, datetime.date.fromisoformat),
+    ("$time", datetime.time, datetime.time.fromisoformat),
+)
+
+
+def encode_result(result):
+    """
+    (headers, data_rows) -> байты записи кэша: JSON, сжатый zlib.
+
+    Строки - списки значений (str, int, float, bool, None); заголовок раздела (row_engine.SectionRow) -
+    объект {"kind": ..., "values": [...]}; даты и время - объекты {"$date": "ISO 8601"} и т.п.,
+    timedelta - {"$timedelta": секунды}.
+    """
+    headers, data_rows = result
+    rows = [{"kind": row.kind, "values": list(row)} if isinstance(row, SectionRow) else row for row in data_rows]
+    return zlib.compress(json.dumps({"headers": headers, "rows": rows}, ensure_ascii=False,
+                                    separators=(',', ':'), default=_encode_value).encode('utf-8'))
+
+
+def decode_result(payload):
+    """Байты записи кэша -> (headers, data_rows)."""
+    data = json.loads(zlib.decompress(payload).decode('utf-8'), object_hook=_decode_object)
+    return data["headers"], data["rows"]
+
+
+def _encode_value(value):
+    for tag, value_type, _parse in _TAGGED_TYPES:
+        if isinstance(value, value_type): # datetime проверяется раньше date (это его подкласс)
+            return {tag: value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"$timedelta": value.total_seconds()}
+    raise TypeError(f"Значение {type(value).__name__} не сохраняется в кэш результатов")
+
+
+def _decode_object(obj):
+    if len(obj) == 1:
+        (tag, value), = obj.items()
+        for value_tag, _value_type, parse in _TAGGED_TYPES:
+            if tag == value_tag:
+                return parse(value)
+        if tag == "$timedelta":
+            return datetime.timedelta(seconds=value)
+    if "kind" in obj and "values" in obj:
+        return SectionRow(obj["values"], obj["kind"])
+    return obj
+
+
+class ResultCache:
+    """
+    Дисковый кэш результатов процессоров, адресуемый по содержимому.
+
+    Ключ - хэш содержимого файла + тип сметы + версия процессора,
+    значение - кортеж (headers, data_rows) в JSON, сжатом zlib (encode_result): из общей папки
+    читаются только данные, а не объекты pickle. Общий размер ограничен max_bytes, при превышении
+    удаляются давно не использованные записи (LRU по mtime файла, mtime обновляется при чтении).
+    Размер считается по самой папке при каждой записи, а не по памяти процесса: кэш общий для всех
+    процессов (воркеры gunicorn, процессы пула), и каждый видит записи и удаления остальных.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def make_key(self, input_path, smeta_type, processor_version):
+        key_source = f"{file_sha256(input_path)}|{smeta_type}|{processor_version}"
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Возвращает (headers, data_rows) или None, если записи нет или она повреждена."""
+        path = self._path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            result = decode_result(payload)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"  [WARN] Поврежденная запись кэша {key[:12]}: {e}. Удаляем.")
+            self._remove(path)
+            return None
+        try:
+            os.utime(path) # Отмечаем использование для LRU
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """Сохраняет результат атомарно (через временный файл) и при необходимости вытесняет старые записи."""
+        path = self._path_for(key)
+        try:
+            payload = encode_result(result)
+            if len(payload) > self.max_bytes:
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"  [WARN] Не удалось записать результат в кэш: {e}")
+            return
+        with self._lock:
+            self._evict()
+
+    # --- Внутреннее ---
+
+    def _path_for(self, key):
+        # Подпапки по первым символам ключа, чтобы не держать все файлы в одной директории
+        return os.path.join(self.cache_dir, key[:2], f"{key}{_ENTRY_SUFFIX}")
+
+    def _scan(self):
+        """Записи кэша на диске: [(mtime, size, path)]."""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(_ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue # Удалена другим процессом
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = self._scan()
+        total_bytes = sum(size for _mtime, size, _path in entries)
+        if total_bytes <= self.max_bytes:
+            return
+        # Самые давно использованные - первыми
+        for _mtime, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """Кэш процесса с настройками из окружения или None, если кэш выключен (RESULT_CACHE_ENABLED=0)."""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
@@ -0,0 +1,193 @@
+# results_store.py
+import os
+import time
+import threading
+from werkzeug.utils import secure_filename
+
+# Хранилище итоговых файлов: results/<job_id>/<имя файла>.
+# Файл задачи пишется во временный файл в results/.incoming и появляется под своим именем
+# только целиком (os.replace, тот же диск): /download не отдает недописанный файл, а одинаковые
+# имена загрузок разных пользователей не перезаписывают друг друга.
+# Индекс в памяти ({(job_id, имя): (mtime, размер)}) избавляет от обхода папки при поиске
+# и при проверке квот; фоновый поток удаляет результаты старше max_age_seconds и самые
+# старые сверх max_bytes. Файлы других процессов попадают в индекс при пересканировании.
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+RESULTS_MAX_AGE_SECONDS = int(os.environ.get('RESULTS_MAX_AGE_SECONDS', str(24 * 3600))) # 24 часа
+RESULTS_MAX_BYTES = int(os.environ.get('RESULTS_MAX_BYTES', str(5 * 1024 * 1024 * 1024))) # 5 GB
+RESULTS_SWEEP_INTERVAL = int(os.environ.get('RESULTS_SWEEP_INTERVAL', '300')) # 5 минут
+# Как часто индекс сверяется с папкой (результаты, записанные другими процессами)
+RESULTS_RESCAN_INTERVAL = int(os.environ.get('RESULTS_RESCAN_INTERVAL', '3600'))
+
+_INCOMING_DIR = '.incoming'
+
+
+class ResultsStore:
+    """
+    Итоговые файлы задач с квотами по возрасту и общему размеру.
+
+    new_path() дает временный путь для записи, commit() атомарно публикует файл,
+    path_for() находит опубликованный файл для скачивания. 0 в max_age_seconds или
+    max_bytes - квота не проверяется.
+    """
+
+    def __init__(self, root, max_age_seconds=RESULTS_MAX_AGE_SECONDS, max_bytes=RESULTS_MAX_BYTES):
+        self.root = root
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None # {(job_dir, filename): (mtime, size)}, строится лениво одним проходом по папке
+        self._total_bytes = 0
+        self._scanned_at = 0.0
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    # --- Запись и поиск ---
+
+    def new_path(self, job_id, filename):
+        """Временный путь для записи результата задачи (на том же диске, что и итоговый)."""
+        incoming_dir = os.path.join(self.root, _INCOMING_DIR)
+        os.makedirs(incoming_dir, exist_ok=True)
+        return os.path.join(incoming_dir, f"{job_dir_name(job_id)}.{os.getpid()}.{threading.get_ident()}.{filename}")
+
+    def commit(self, job_id, filename, temp_path):
+        """Публикует записанный файл под его именем (атомарно) и добавляет в индекс. Возвращает итоговый путь."""
+        job_dir = job_dir_name(job_id)
+        path = os.path.join(self.root, job_dir, filename)
+        with self._lock: # Очистка не удалит папку задачи между созданием и переносом файла
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            st = os.stat(path)
+            self._ensure_index_locked()
+            old = self._index.get((job_dir, filename))
+            if old:
+                self._total_bytes -= old[1]
+            self._index[(job_dir, filename)] = (st.st_mtime, st.st_size)
+            self._total_bytes += st.st_size
+            # Размер проверяем сразу, возраст - в sweep()
+            if self.max_bytes and self._total_bytes > self.max_bytes:
+                self._enforce_quotas_locked(time.time())
+        return path
+
+    def discard(self, temp_path):
+        """Удаляет недописанный временный файл."""
+        _remove(temp_path)
+
+    def path_for(self, job_id, filename):
+        """Путь к опубликованному результату или None (нет такого, удален по квоте, некорректное имя)."""
+        job_dir = job_dir_name(job_id)
+        if not job_dir or not filename or filename != os.path.basename(filename) or filename.startswith('.'):
+            return None
+        path = os.path.join(self.root, job_dir, filename)
+        with self._lock:
+            if self._index is not None and (job_dir, filename) in self._index:
+                return path
+        # Не в индексе этого процесса - возможно, результат записал другой процесс
+        return path if os.path.isfile(path) else None
+
+    # --- Квоты ---
+
+    def sweep(self):
+        """Удаляет результаты старше max_age_seconds и самые старые сверх max_bytes. Возвращает число удаленных."""
+        now = time.time()
+        with self._lock:
+            if self._index is not None and now - self._scanned_at >= RESULTS_RESCAN_INTERVAL:
+                self._index = None # Пересобираем: в папке могут быть результаты других процессов
+            self._ensure_index_locked()
+            removed = self._enforce_quotas_locked(now)
+        self._remove_stale_temp_files(now)
+        return removed
+
+    def start_sweeper(self, interval=RESULTS_SWEEP_INTERVAL):
+        """Запускает фоновый поток, который вызывает sweep() каждые interval секунд."""
+        if self._sweeper is not None or interval <= 0:
+            return
+        self._sweeper = threading.Thread(target=self._sweeper_loop, args=(interval,), name="results-sweeper",
+                                         daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop.set()
+
+    def stats(self):
+        """(число результатов, общий размер в байтах) по индексу."""
+        with self._lock:
+            self._ensure_index_locked()
+            return len(self._index), self._total_bytes
+
+    # --- Внутреннее ---
+
+    def _sweeper_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                removed = self.sweep()
+                if removed:
+                    print(f"Очистка результатов: удалено {removed}")
+            except Exception as e:
+                print(f"[WARN] Очистка результатов не удалась: {e}")
+
+    def _ensure_index_locked(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total_bytes = 0
+        self._scanned_at = time.time()
+        if not os.path.isdir(self.root):
+            return
+        for job_entry in os.scandir(self.root):
+            if not job_entry.is_dir() or job_entry.name.startswith('.'):
+                continue
+            for entry in os.scandir(job_entry.path):
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                self._index[(job_entry.name, entry.name)] = (st.st_mtime, st.st_size)
+                self._total_bytes += st.st_size
+
+    def _enforce_quotas_locked(self, now):
+        removed = 0
+        # Самые старые - первыми
+        for key, (mtime, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            over_quota = self.max_bytes and self._total_bytes > self.max_bytes
+            if not expired and not over_quota:
+                break
+            job_dir, filename = key
+            _remove(os.path.join(self.root, job_dir, filename))
+            _remove_dir_if_empty(os.path.join(self.root, job_dir))
+            del self._index[key]
+            self._total_bytes -= size
+            removed += 1
+        return removed
+
+    def _remove_stale_temp_files(self, now):
+        # Временные файлы задач, прерванных вместе с процессом (живые задачи пишут их меньше max_age_seconds)
+        incoming_dir = os.path.join(self.root, _INCOMING_DIR)
+        if not self.max_age_seconds or not os.path.isdir(incoming_dir):
+            return
+        for entry in os.scandir(incoming_dir):
+            try:
+                if now - entry.stat().st_mtime > self.max_age_seconds:
+                    _remove(entry.path)
+            except OSError:
+                pass
+
+
+def job_dir_name(job_id):
+    """Имя папки задачи: ID приходит от клиента - в имя папки только безопасные символы (пустое - ID негоден)."""
+    return secure_filename(str(job_id))
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _remove_dir_if_empty(path):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
@@ -0,0 +1,632 @@
+# row_engine.py
+import traceback
+from collections import deque
+from sheet_reader import open_first_sheet
+from archive_reader import input_display_name
+from metrics import current_processor_stats
+from openpyxl.utils.cell import coordinate_to_tuple
+from utils import is_likely_empty, check_merge, cell_coordinate, get_start_coord, is_zero, is_integer_like
+
+# Общий движок разбора смет: один автомат состояний (буфер позиций, незакрытые раздел/подраздел,
+# итоги, строки цены) для всех форматов. Формат описывается ТАБЛИЦЕЙ ПРАВИЛ (словарь), которая
+# один раз компилируется в FormatRules с готовыми индексами колонок.
+#
+# Таблица правил (все индексы колонок 0-based, span - (первая, последняя) колонка объединения):
+#   "name":      название формата (для логов)
+#   "header":    {"merge": span, "text_col": int, "section_prefix": str, "subsection_prefix": str}
+#                Заголовок раздела/подраздела - объединение span и текст, начинающийся с префикса.
+#                Пустой subsection_prefix - подраздел любой непустой текст (если это не раздел).
+#   "footers":   [{"level": "subsection" | "section", "merge": span, "text_col": int, "prefix": str,
+#                  "total_col": int | None, "value_col": int (необязательно)}, ...]
+#                Итоги проверяются по порядку. total_col=None - координата итога берется из самого объединения.
+#                value_col - колонка со значением итога (для фильтра нулевых итогов).
+#   "price_row": {"merge": span (необяз.), "text_col": int, "text": str (необяз.),
+#                 "non_empty": (cols) (необяз.), "empty": (cols) (необяз.),
+#                 "total_col": int, "total_merge": span (необяз.), "value_col": int (необяз.)}
+#                Строка итоговой цены для позиций из буфера ("Всего по позиции").
+#                total_merge - если есть такое объединение, координатой цены становится его начало.
+#   "item":      {"id_col": int, "columns": (5 колонок входа для выходных колонок 1-5),
+#                 "inline_price": {"col": int, "merge": span или None} (необяз.),
+#                 "zero_skip_col": int (необяз.)}
+#                Позиция - число (не формула) в id_col. Цена в строке позиции ищется только у целых номеров.
+#                zero_skip_col - позиции с нулем в этой колонке пропускаются.
+#   "skip_zero_totals": bool - не выводить строки с нулевым итогом (value_col футера/строки цены).
+# Строка цены обязана иметь "text" или "non_empty": пустые строки не должны подходить ни под одно правило.
+
+OUTPUT_HEADERS = ["№№ п/п", "Шифр расценки и коды ресурсов", "Наименование работ и затрат", "Единица измерения", "Кол-во единиц", "ВСЕГО затрат, руб."]
+
+# Режимы вывода:
+#   OUTPUT_COORDS - координаты ячеек исходного листа ("B57"), значения по ним читает потребитель;
+#   OUTPUT_VALUES - значения этих же ячеек (шифр, наименование, ед. изм., кол-во, итог), прочитанные
+#                   в том же проходе по листу - второе чтение исходного файла не нужно;
+#   OUTPUT_BOTH   - 6 колонок значений, за ними 6 колонок координат.
+# Текст заголовка раздела (колонка 3) - значение в любом режиме.
+OUTPUT_COORDS = "coords"
+OUTPUT_VALUES = "values"
+OUTPUT_BOTH = "both"
+OUTPUT_MODES = (OUTPUT_COORDS, OUTPUT_VALUES, OUTPUT_BOTH)
+
+
+def output_headers(output_mode=OUTPUT_COORDS):
+    """Заголовки вывода для режима output_mode."""
+    if output_mode in (OUTPUT_COORDS, OUTPUT_VALUES):
+        return list(OUTPUT_HEADERS)
+    if output_mode == OUTPUT_BOTH:
+        return list(OUTPUT_HEADERS) + [f"{header} (ячейка)" for header in OUTPUT_HEADERS]
+    raise ValueError(f"Неизвестный режим вывода: {output_mode} (ожидается {', '.join(OUTPUT_MODES)}).")
+
+# Типы строк
+SECTION_HEADER = "section_header"
+SUBSECTION_HEADER = "subsection_header"
+SECTION_FOOTER = "section_footer"
+SUBSECTION_FOOTER = "subsection_footer"
+PRICE_ROW = "item_price_row"
+ITEM = "item"
+
+_HEADER_AND_FOOTER_TYPES = (SECTION_HEADER, SUBSECTION_HEADER, SECTION_FOOTER, SUBSECTION_FOOTER)
+_FOOTER_TYPES = {"section": SECTION_FOOTER, "subsection": SUBSECTION_FOOTER}
+
+
+class FormatRules:
+    """Скомпилированная таблица правил формата (разбор словаря делается один раз при импорте процессора)."""
+
+    def __init__(self, table):
+        self.name = table["name"]
+
+        header = table["header"]
+        self.header_merge = tuple(header["merge"])
+        self.header_text_col = header["text_col"]
+        self.section_prefix = header["section_prefix"]
+        self.subsection_prefix = header["subsection_prefix"]
+
+        # (тип строки, merge, колонка текста, префикс, колонка итога или None, колонка значения или None)
+        self.footers = tuple(
+            (_FOOTER_TYPES[footer["level"]], tuple(footer["merge"]), footer["text_col"], footer["prefix"],
+             footer["total_col"], footer.get("value_col"))
+            for footer in table["footers"])
+
+        price = table["price_row"]
+        self.price_merge = tuple(price["merge"]) if price.get("merge") else None
+        self.price_text_col = price.get("text_col")
+        self.price_text = price.get("text")
+        self.price_non_empty = tuple(price.get("non_empty", ()))
+        self.price_empty = tuple(price.get("empty", ()))
+        self.price_total_col = price["total_col"]
+        self.price_total_merge = tuple(price["total_merge"]) if price.get("total_merge") else None
+        self.price_value_col = price.get("value_col")
+
+        item = table["item"]
+        self.id_col = item["id_col"]
+        self.item_columns = tuple(item["columns"])
+        inline = item.get("inline_price")
+        self.inline_col = inline["col"] if inline else None
+        self.inline_merge = tuple(inline["merge"]) if inline and inline.get("merge") else None
+        self.zero_skip_col = item.get("zero_skip_col")
+
+        self.skip_zero_totals = bool(table.get("skip_zero_totals"))
+
+        # Колонки, текст которых нужен для определения типа строки
+        text_cols = {self.header_text_col}
+        text_cols.update(footer[2] for footer in self.footers)
+        if self.price_text_col is not None:
+            text_cols.add(self.price_text_col)
+        self.text_cols = tuple(sorted(text_cols))
+
+        # Колонки, ЗНАЧЕНИЯ которых читаются (остальным нужны только координаты по номеру колонки).
+        # Строки листа читаются только до последней из них - ячейки правее не создаются.
+        if self.price_text is None and not self.price_non_empty:
+            raise ValueError(f"{self.name}: строке цены нужен text или non_empty, иначе под нее подойдут пустые строки")
+        value_cols = set(text_cols)
+        value_cols.update(footer[5] for footer in self.footers if footer[5] is not None)
+        value_cols.update(self.price_non_empty + self.price_empty)
+        value_cols.update(col for col in (self.price_value_col, self.id_col, self.inline_col, self.zero_skip_col)
+                          if col is not None)
+        value_cols.update(self.item_columns[3:5]) # Ед. изм. и кол-во - для автоопределения формата
+        self.read_width = max(value_cols) + 1
+
+        # В режиме значений читаются и все выводимые ячейки: колонки позиции, итоги, начала объединений
+        output_cols = set(self.item_columns)
+        output_cols.add(self.header_merge[0])
+        for _row_type, merge, _text_col, _prefix, total_col, _value_col in self.footers:
+            output_cols.add(merge[0] if total_col is None else total_col)
+        output_cols.add(self.price_total_col)
+        output_cols.update(span[0] for span in (self.price_total_merge, self.inline_merge) if span)
+        if self.inline_col is not None:
+            output_cols.add(self.inline_col)
+        self.values_read_width = max(self.read_width, max(output_cols) + 1)
+
+
+def compile_rules(table):
+    """Компилирует таблицу правил формата."""
+    return FormatRules(table)
+
+
+def _cell_value(row_cells, width, col_idx):
+    return row_cells[col_idx].value if col_idx < width else None
+
+def _cell_text(value):
+    return str(value).strip() if not is_likely_empty(value) else ""
+
+def _is_number(value):
+    """Число или строка с числом ('1.5', '1,5'); пустое значение - не число."""
+    if is_likely_empty(value):
+        return False
+    try:
+        float(str(value).replace(',', '.').strip())
+        return True
+    except (ValueError, TypeError):
+        return False
+
+def _is_numeric_id(cell):
+    """Номер позиции: не формула, не пусто и похоже на число ('1', '1.2', '1,5')."""
+    if cell is None or cell.data_type == 'f':
+        return False
+    return _is_number(cell.value)
+
+
+def classify_row(rules, merge_index, row_num, row_cells, width):
+    """
+    Определяет тип строки по правилам формата.
+
+    Returns:
+        tuple: (row_type или None, координата объединения для заголовка/итога или None)
+    """
+    texts = {col: _cell_text(_cell_value(row_cells, width, col)) for col in rules.text_cols}
+
+    # 1. Заголовки раздела и подраздела
+    header_merge_coord = check_merge(merge_index, row_num, *rules.header_merge)
+    if header_merge_coord:
+        header_text = texts[rules.header_text_col]
+        if header_text:
+            if header_text.startswith(rules.section_prefix):
+                return SECTION_HEADER, header_merge_coord
+            if header_text.startswith(rules.subsection_prefix):
+                return SUBSECTION_HEADER, header_merge_coord
+
+    # 2. Итоги ("Итого по ..."), по порядку из таблицы
+    for row_type, merge, text_col, prefix, _total_col, _value_col in rules.footers:
+        footer_merge_coord = check_merge(merge_index, row_num, *merge)
+        if footer_merge_coord and texts[text_col].startswith(prefix):
+            return row_type, footer_merge_coord
+
+    # 3. Строка итоговой цены позиции
+    is_price_row = True
+    if rules.price_merge and not check_merge(merge_index, row_num, *rules.price_merge):
+        is_price_row = False
+    if is_price_row and rules.price_text is not None and texts[rules.price_text_col] != rules.price_text:
+        is_price_row = False
+    if is_price_row and any(is_likely_empty(_cell_value(row_cells, width, col)) for col in rules.price_non_empty):
+        is_price_row = False
+    if is_price_row and not all(is_likely_empty(_cell_value(row_cells, width, col)) for col in rules.price_empty):
+        is_price_row = False
+    if is_price_row:
+        return PRICE_ROW, None
+
+    # 4. Позиция (число в колонке номера)
+    if _is_numeric_id(row_cells[rules.id_col] if rules.id_col < width else None):
+        return ITEM, None
+    return None, None
+
+
+def row_evidence(rules, merge_index, row_num, row_cells, width):
+    """
+    Насколько строка похожа на формат (для автоопределения формата по первым строкам листа).
+
+    Returns:
+        tuple: (layout_points, item_points)
+               layout_points - совпадение раскладки: заголовки/итоги с нужными объединениями,
+                               строка цены, цена в объединении строки позиции;
+               item_points   - позиция с заполненными ед. изм. и числовым кол-вом в колонках формата
+                               (различает форматы с одинаковой раскладкой, например Турбосметчик-1 и -2).
+    """
+    row_type, _merge_coord = classify_row(rules, merge_index, row_num, row_cells, width)
+    if row_type in _HEADER_AND_FOOTER_TYPES:
+        return 3, 0
+    if row_type == PRICE_ROW:
+        # Строка цены без объединения и текста (только пустые/непустые колонки) - слабый признак
+        return (2 if rules.price_merge or rules.price_text is not None else 1), 0
+    if row_type != ITEM:
+        return 0, 0
+
+    layout_points = 0
+    if rules.inline_merge and check_merge(merge_index, row_num, *rules.inline_merge):
+        layout_points = 2
+    unit_col, quantity_col = rules.item_columns[3], rules.item_columns[4]
+    unit = _cell_value(row_cells, width, unit_col)
+    quantity = _cell_value(row_cells, width, quantity_col)
+    item_points = 1 if not is_likely_empty(unit) and _is_number(quantity) else 0
+    return layout_points, item_points
+
+
+class SectionRow(list):
+    """
+    Строка вывода заголовка раздела/подраздела: обычный список значений и kind ("section" или "subsection").
+
+    В .xlsx и CSV пишется как любая строка; форматы с разметкой (JSON Lines, Parquet) отмечают по kind
+    начало раздела. Список, а не отдельный тип записи: пул процессов и кэш результатов передают строки как есть.
+    """
+    __slots__ = ("kind",)
+
+    def __init__(self, values, kind):
+        super().__init__(values)
+        self.kind = kind
+
+
+class ParsedRow:
+    """
+    Позиция или заголовок раздела/подраздела до сборки вывода.
+
+    Ячейки хранятся числами (строка листа, 0-based колонка), строки координат
+    строятся при сборке и только для строк, попавших в вывод.
+      kind             - ITEM, "section" или "subsection" (заголовок);
+      row              - строка листа, в которой найдена позиция/заголовок (порядок вывода);
+      anchor_row/col   - левая верхняя ячейка объединения заголовка (колонка 1 вывода);
+      text             - текст заголовка (колонка 3 вывода);
+      total_row/col    - ячейка итога/цены (колонка 6 вывода) или None;
+      total_value      - значение итога (для фильтра нулевых итогов);
+      closed           - строка окончательна (итог/цена уже найдены или их не будет).
+    Только в режиме значений (значения выводимых ячеек, прочитанные при разборе):
+      item_values      - значения колонок 1-5 позиции;
+      anchor_value     - значение левой верхней ячейки заголовка;
+      total_cell_value - значение ячейки итога/цены.
+    """
+    __slots__ = ("kind", "row", "anchor_row", "anchor_col", "text", "total_row", "total_col", "total_value", "closed",
+                 "item_values", "anchor_value", "total_cell_value")
+
+    def __init__(self, kind, row, anchor=None, text=None):
+        self.kind = kind
+        self.row = row
+        self.anchor_row, self.anchor_col = anchor if anchor else (None, None)
+        self.text = text
+        self.total_row = None
+        self.total_col = None
+        self.total_value = None
+        self.closed = False
+        self.item_values = None
+        self.anchor_value = None
+        self.total_cell_value = None
+
+    def set_total(self, cell, value=None, cell_value=None):
+        """cell - (строка, 0-based колонка) или None; cell_value - значение этой ячейки (режим значений)."""
+        self.total_row, self.total_col = cell if cell else (None, None)
+        self.total_value = value
+        self.total_cell_value = cell_value
+
+
+class OrderedRows:
+    """
+    Вывод в порядке строк листа без сортировки в конце.
+
+    Место под позицию/заголовок резервируется, когда строка найдена (reserve), а окончательной
+    она становится позже (closed = True): позиция - на своей строке цены, заголовок - на своем итоге.
+    flush() переносит в ready окончательные строки с начала очереди - дальше первой
+    незакрытой строки (например, открытого раздела) вывод не продвигается; take() их забирает.
+    """
+    __slots__ = ("_open", "ready")
+
+    def __init__(self):
+        self._open = deque()
+        self.ready = []
+
+    def reserve(self, record):
+        self._open.append(record)
+        return record
+
+    def flush(self):
+        open_rows, ready = self._open, self.ready
+        while open_rows and open_rows[0].closed:
+            ready.append(open_rows.popleft())
+
+    def take(self):
+        """Забирает накопленные окончательные строки."""
+        ready, self.ready = self.ready, []
+        return ready
+
+
+def _close_rows(records):
+    for record in records:
+        record.closed = True
+
+
+def _merge_anchor(merge_coord):
+    """Левая верхняя ячейка объединения ('E5:S6' -> (5, 4)) с 0-based колонкой."""
+    row, col = coordinate_to_tuple(get_start_coord(merge_coord))
+    return row, col - 1
+
+def _render_cell(row, col_idx):
+    return cell_coordinate(row, col_idx) if row is not None else None
+
+def _cell_value_at(cell, row_num, row_cells, anchor_values):
+    """
+    Значение ячейки cell ((строка, 0-based колонка) или None) при разборе строки row_num:
+    ячейка текущей строки - из row_cells, левая верхняя ячейка объединения выше - из anchor_values.
+    """
+    if cell is None:
+        return None
+    row, col = cell
+    if row == row_num:
+        return row_cells[col].value if col < len(row_cells) else None
+    return anchor_values.get(cell)
+
+def _render_rows(rules, width, records, stats, output_mode=OUTPUT_COORDS):
+    """Строки вывода (координаты и/или значения) для окончательных ParsedRow (строки с нулевым итогом отбрасываются)."""
+    item_count = header_count = skipped_count = 0
+    with_coords = output_mode != OUTPUT_VALUES
+    with_values = output_mode != OUTPUT_COORDS
+    output_rows = []
+    for record in records:
+        if rules.skip_zero_totals and is_zero(record.total_value):
+            skipped_count += 1
+            continue
+        coords_row = values_row = None
+        if record.kind == ITEM:
+            item_count += 1
+            if with_coords:
+                item_row = record.row
+                coords_row = [cell_coordinate(item_row, col) if col < width else None for col in rules.item_columns]
+                coords_row.append(_render_cell(record.total_row, record.total_col))
+            if with_values:
+                values_row = record.item_values + [record.total_cell_value]
+        else:
+            header_count += 1
+            if with_coords:
+                coords_row = [cell_coordinate(record.anchor_row, record.anchor_col), None, record.text, None, None,
+                              _render_cell(record.total_row, record.total_col)]
+            if with_values:
+                values_row = [record.anchor_value, None, record.text, None, None, record.total_cell_value]
+        if values_row is None:
+            output_row = coords_row
+        elif coords_row is None:
+            output_row = values_row
+        else:
+            output_row = values_row + coords_row
+        output_rows.append(output_row if record.kind == ITEM else SectionRow(output_row, record.kind))
+    stats.add("items", item_count)
+    stats.add("headers", header_count)
+    stats.add("zero_price_skips", skipped_count)
+    return output_rows
+
+
+class EmptyWorkbookError(ValueError):
+    """В файле нет ни одного листа."""
+
+
+def process_with_rules(rules, input_path, output_mode=OUTPUT_COORDS):
+    """
+    ОБРАБАТЫВАЕТ один Excel файл по таблице правил формата.
+    НЕ СОХРАНЯЕТ ФАЙЛ, а ВОЗВРАЩАЕТ данные для дальнейшей обработки.
+    Собирает в список все пачки iter_with_rules.
+
+    Args:
+        rules (FormatRules): Скомпилированные правила формата.
+        input_path (str | file-like): Путь к входному Excel файлу или открытый бинарный файл.
+        output_mode (str): Режим вывода (OUTPUT_COORDS, OUTPUT_VALUES или OUTPUT_BOTH).
+
+    Returns:
+        tuple: Кортеж (output_headers, all_coords_data) или (None, None) в случае ошибки.
+    """
+    input_name = input_path if isinstance(input_path, str) else input_display_name(input_path) # Для логов
+    headers = output_headers(output_mode) # Неизвестный режим - ошибка вызывающего кода, не файла
+    try:
+        all_coords_data = []
+        for batch in iter_with_rules(rules, input_path, output_mode):
+            all_coords_data.extend(batch)
+        return headers, all_coords_data
+    except EmptyWorkbookError as e:
+        print(f"Ошибка: {e}")
+        return None, None
+    except FileNotFoundError:
+        print(f"[ОШИБКА] Файл не найден: {input_name}")
+        return None, None
+    except Exception as e:
+        print(f"[КРИТИЧЕСКАЯ ОШИБКА] при обработке файла '{input_name}' ({rules.name}): {e}")
+        print("-" * 60); traceback.print_exc(); print("-" * 60)
+        return None, None
+
+
+def stream_with_rules(rules, input_path, output_mode=OUTPUT_COORDS):
+    """
+    Потоковый вариант process_with_rules.
+
+    Returns:
+        tuple: (output_headers, batches) - batches - генератор iter_with_rules. Файл открывается
+               при первом next(), ошибки чтения и разбора выбрасываются из генератора.
+    """
+    return output_headers(output_mode), iter_with_rules(rules, input_path, output_mode)
+
+
+def iter_with_rules(rules, input_path, output_mode=OUTPUT_COORDS):
+    """
+    Разбирает Excel файл по таблице правил, отдавая строки координат пачками по мере готовности.
+
+    Пачка уходит, как только ее строки окончательны (OrderedRows.flush): в памяти остается
+    только незакрытая часть листа - открытый раздел с его позициями. Время, пока потребитель
+    обрабатывает пачку, в этапы процессора не входит.
+
+    В режиме значений (OUTPUT_VALUES/OUTPUT_BOTH) значения выводимых ячеек берутся из тех же
+    прочитанных строк: строки читаются до rules.values_read_width, а значения левых верхних ячеек
+    объединений в несколько строк запоминаются до последней строки объединения.
+
+    Args:
+        rules (FormatRules): Скомпилированные правила формата.
+        input_path (str | file-like): Путь к входному Excel файлу или открытый бинарный файл.
+        output_mode (str): Режим вывода (OUTPUT_COORDS, OUTPUT_VALUES или OUTPUT_BOTH).
+
+    Yields:
+        list: Строки вывода (списки из 6 элементов, в OUTPUT_BOTH - из 12) в порядке строк листа.
+
+    Raises:
+        EmptyWorkbookError: В файле нет листов.
+    """
+    # Позиции и заголовки (ParsedRow) для вывода - в порядке строк листа. Место резервируется,
+    # когда строка найдена; заголовок до первого раздела вывода не попадает и места не получает.
+    output_rows = OrderedRows()
+    active_items_buffer = [] # Позиции, ожидающие строку цены
+    pending_section_header = None
+    pending_subsection_header = None
+    first_section_found = False # Данные учитываются только после первого раздела
+    skipped_items_zero_count = 0
+    with_values = output_mode != OUTPUT_COORDS
+    anchor_values = {} # (строка, колонка) -> значение левой верхней ячейки объединения в несколько строк
+    anchors_by_last_row = {} # Последняя строка объединения -> его ключи в anchor_values (удаляются после нее)
+
+    stats = current_processor_stats() # Времена этапов и счетчики для метрик (metrics.py)
+    input_name = input_path if isinstance(input_path, str) else input_display_name(input_path) # Для логов
+    sheet = None
+    try:
+        sheet = open_first_sheet(input_path)
+        if sheet is None:
+            raise EmptyWorkbookError(f"Нет листов в файле '{input_name}'.")
+        # Индекс объединенных ячеек собран один раз на лист (O(1) поиск в check_merge)
+        merge_index = sheet.merge_index
+        multirow_anchors = merge_index.multirow_anchors
+        stats.lap("load")
+        footer_rules = {footer[0]: footer for footer in rules.footers}
+
+        # Ширина листа: колонки за ее пределами не имеют координат (None в выводе).
+        # Сами строки читаются только до rules.read_width; полностью пустая строка
+        # не подходит ни под одно правило, поэтому отдельная проверка всей строки не нужна.
+        width = sheet.max_column
+        read_width = rules.values_read_width if with_values else rules.read_width
+        for row_num, row_cells in sheet.iter_rows(min_row=2, max_col=read_width):
+            if with_values:
+                # Строки идут подряд: объединения, закончившиеся на предыдущей строке, больше не нужны
+                for key in anchors_by_last_row.pop(row_num - 1, ()):
+                    anchor_values.pop(key, None)
+                for col, last_row in multirow_anchors.get(row_num, ()):
+                    if col < len(row_cells):
+                        anchor_values[(row_num, col)] = row_cells[col].value
+                        anchors_by_last_row.setdefault(last_row, []).append((row_num, col))
+            row_type, merge_coord = classify_row(rules, merge_index, row_num, row_cells, width)
+            if row_type is None:
+                continue
+
+            # Заголовок/итог закрывает позиции без цены: они выводятся как есть (без итога)
+            if row_type in _HEADER_AND_FOOTER_TYPES and active_items_buffer:
+                if first_section_found:
+                    _close_rows(active_items_buffer)
+                active_items_buffer = []
+
+            if row_type == SECTION_HEADER:
+                if first_section_found:
+                    # Незакрытые предыдущие подраздел и раздел выводятся без итога
+                    if pending_subsection_header: pending_subsection_header.closed = True
+                    if pending_section_header: pending_section_header.closed = True
+                text = _cell_text(_cell_value(row_cells, width, rules.header_text_col))
+                anchor = _merge_anchor(merge_coord)
+                pending_section_header = output_rows.reserve(ParsedRow("section", row_num, anchor, text))
+                if with_values:
+                    pending_section_header.anchor_value = _cell_value_at(anchor, row_num, row_cells, anchor_values)
+                pending_subsection_header = None
+                first_section_found = True
+
+            elif row_type == SUBSECTION_HEADER:
+                if first_section_found and pending_subsection_header:
+                    pending_subsection_header.closed = True
+                text = _cell_text(_cell_value(row_cells, width, rules.header_text_col))
+                anchor = _merge_anchor(merge_coord)
+                pending_subsection_header = ParsedRow("subsection", row_num, anchor, text)
+                if with_values:
+                    pending_subsection_header.anchor_value = _cell_value_at(anchor, row_num, row_cells, anchor_values)
+                if first_section_found:
+                    output_rows.reserve(pending_subsection_header)
+
+            elif row_type in (SUBSECTION_FOOTER, SECTION_FOOTER):
+                _footer_type, _merge, _text_col, _prefix, total_col, value_col = footer_rules[row_type]
+                if total_col is None: # Итог лежит в самом объединении
+                    total_cell = _merge_anchor(merge_coord)
+                else:
+                    total_cell = (row_num, total_col) if total_col < width else None
+                total_value = _cell_value(row_cells, width, value_col) if value_col is not None else None
+
+                if row_type == SECTION_FOOTER and first_section_found and pending_subsection_header:
+                    # Подраздел, не закрытый своим итогом перед итогом раздела
+                    pending_subsection_header.closed = True
+                    pending_subsection_header = None
+
+                pending = pending_subsection_header if row_type == SUBSECTION_FOOTER else pending_section_header
+                if pending:
+                    total_cell_value = _cell_value_at(total_cell, row_num, row_cells, anchor_values) if with_values else None
+                    pending.set_total(total_cell, total_value, total_cell_value)
+                    if first_section_found:
+                        pending.closed = True
+                        if row_type == SUBSECTION_FOOTER: pending_subsection_header = None
+                        else: pending_section_header = None
+                elif first_section_found:
+                    level_name = ("подразделу", "подраздела") if row_type == SUBSECTION_FOOTER else ("разделу", "раздела")
+                    print(f"  [WARN] Строка {row_num}: Итого по {level_name[0]} найдено, но не было активного {level_name[1]} для закрытия.")
+
+            elif row_type == PRICE_ROW:
+                # Цена для позиций из буфера
+                price_total_cell = (row_num, rules.price_total_col) if rules.price_total_col < width else None
+                if rules.price_total_merge:
+                    total_merge_coord = check_merge(merge_index, row_num, *rules.price_total_merge)
+                    if total_merge_coord:
+                        price_total_cell = _merge_anchor(total_merge_coord)
+                price_total_value = _cell_value(row_cells, width, rules.price_value_col) if rules.price_value_col is not None else None
+                price_cell_value = _cell_value_at(price_total_cell, row_num, row_cells, anchor_values) if with_values else None
+                for item in active_items_buffer:
+                    item.set_total(price_total_cell, price_total_value, price_cell_value)
+                if first_section_found and active_items_buffer:
+                    _close_rows(active_items_buffer)
+                    active_items_buffer = []
+
+            elif row_type == ITEM:
+                if not first_section_found:
+                    continue # Позиции до первого раздела не выводятся
+                if rules.zero_skip_col is not None and is_zero(_cell_value(row_cells, width, rules.zero_skip_col)):
+                    skipped_items_zero_count += 1
+                    continue
+                # Координаты колонок 1-5 строятся при сборке - только для позиций, попавших в вывод
+                item_data = output_rows.reserve(ParsedRow(ITEM, row_num))
+                if with_values:
+                    item_data.item_values = [row_cells[col].value if col < width else None for col in rules.item_columns]
+
+                inline_price_cell = None
+                # Цена в строке позиции - только у целых номеров
+                if rules.inline_col is not None and is_integer_like(row_cells[rules.id_col].value):
+                    if rules.inline_merge:
+                        inline_merge_coord = check_merge(merge_index, row_num, *rules.inline_merge)
+                        if inline_merge_coord and not is_likely_empty(_cell_value(row_cells, width, rules.inline_col)):
+                            inline_price_cell = _merge_anchor(inline_merge_coord)
+                    elif not is_likely_empty(_cell_value(row_cells, width, rules.inline_col)):
+                        inline_price_cell = (row_num, rules.inline_col)
+
+                if inline_price_cell:
+                    inline_cell_value = _cell_value_at(inline_price_cell, row_num, row_cells, anchor_values) if with_values else None
+                    item_data.set_total(inline_price_cell, cell_value=inline_cell_value)
+                    item_data.closed = True
+                else:
+                    active_items_buffer.append(item_data)
+
+            # Окончательные строки с начала очереди - в вывод (открытый раздел держит все, что после него)
+            output_rows.flush()
+            if output_rows.ready:
+                stats.lap("classify")
+                batch = _render_rows(rules, width, output_rows.take(), stats, output_mode)
+                stats.lap("assemble")
+                yield batch
+                stats.skip() # Время потребителя пачки не считаем
+
+        # --- Обработка оставшихся данных в конце файла ---
+        if first_section_found:
+            _close_rows(active_items_buffer)
+            if pending_subsection_header: pending_subsection_header.closed = True
+            if pending_section_header: pending_section_header.closed = True
+        output_rows.flush()
+
+        stats.lap("classify")
+        # --- Оставшиеся строки координат ---
+        batch = _render_rows(rules, width, output_rows.take(), stats, output_mode)
+        stats.lap("assemble")
+        stats.add("rows_scanned", max(sheet.max_row - 1, 0))
+        stats.add("merge_lookups", merge_index.lookups)
+        stats.add("zero_price_skips", skipped_items_zero_count)
+        if batch:
+            yield batch
+
+    finally:
+        # Гарантированно закрываем книгу, если она была открыта
+        if sheet:
+            try: sheet.close()
+            except Exception as close_e: print(f"  [WARN] Не удалось закрыть Excel файл '{input_name}': {close_e}")
@@ -0,0 +1,192 @@
+# sheet_reader.py
+import re
+import openpyxl
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.utils.cell import range_boundaries, column_index_from_string
+from utils import MergeIndex
+
+# <mergeCell> ищутся в байтах XML после </sheetData>, строки и ячейки (только ради размеров листа) - регулярными выражениями
+_SHEET_DATA_END_RE = re.compile(rb"</(?:\w+:)?sheetData>")
+_MERGE_CELL_RE = re.compile(rb"<(?:\w+:)?mergeCell\b[^>]*?\bref=\"([^\"]+)\"")
+_CELL_REF_RE = re.compile(rb"<(?:\w+:)?c\b[^>]*?\br=\"([A-Z]+)(\d+)\"")
+_CELL_COLUMN_RE = re.compile(rb"<(?:\w+:)?c\b[^>]*?\br=\"([A-Z]+)\d+\"")
+_ROW_REF_RE = re.compile(rb"<(?:\w+:)?row\b[^>]*?\br=\"(\d+)\"")
+_RAW_CHUNK_SIZE = 1024 * 1024
+_RAW_TAIL_SIZE = 256 # Хвост предыдущего куска: тег, разрезанный границей чтения
+
+
+class SheetReader:
+    """
+    Потоковое чтение ПЕРВОГО листа книги Excel.
+
+    Книга открывается в режиме read_only: строки читаются лениво, сверху вниз,
+    объекты ячеек и стилей всего листа в памяти не создаются.
+    В read_only листе нет merged_cells, поэтому объединенные диапазоны
+    собираются отдельным проходом по байтам XML листа (элементы <mergeCell> после
+    </sheetData>, ячейки при этом не разбираются) и сразу складываются в MergeIndex.
+
+    Как и в полном режиме (где такие ячейки становятся MergedCell), все ячейки
+    объединения, кроме левой верхней, отдаются пустыми - даже если в XML есть значение.
+
+    merge_rows - нужны только первые строки листа (например, для автоопределения формата):
+    собираются только объединения, начинающиеся в этих строках.
+    В этом режиме лист читается только до строки merge_rows.
+    """
+
+    def __init__(self, workbook, worksheet, merge_rows=None):
+        self.workbook = workbook
+        self.worksheet = worksheet
+        self.merge_index = MergeIndex()
+        # {строка: [(первый, последний) 0-based индекс колонки]} - не левые верхние ячейки объединений
+        self._merged_spans = {}
+        self.max_row = worksheet.max_row
+        self.max_column = worksheet.max_column
+        self._scan_sheet_xml(merge_rows)
+
+    def _scan_sheet_xml(self, merge_rows=None):
+        """
+        Собирает <mergeCell> и размеры листа по байтам XML листа, без его разбора: <mergeCell> идут после
+        </sheetData>, высота - номер последнего <row>, ширина - по буквам колонок ячеек (регулярными выражениями).
+        <dimension> пишет программа, создавшая файл, и он бывает устаревшим - по нему строки после
+        указанной там последней пропали бы, поэтому он нужен, только если у строк нет номеров.
+
+        merge_rows - только объединения, начинающиеся не ниже строки merge_rows; ширина листа считается
+        по ячейкам первых merge_rows строк (и <dimension>, если он шире), а высота - merge_rows.
+        """
+        dimension_row = self.max_row or 0
+        dimension_column = self.max_column or 0
+        max_row = 0
+        max_column = 0
+        last_row = 0 # Номер последнего <row> (полный режим)
+        columns = set() # Буквы колонок ячеек (полный режим)
+        count_cells = True
+        tail = b""
+        after_sheet_data = False
+        with _open_sheet_xml(self.worksheet) as src:
+            while True:
+                chunk = src.read(_RAW_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = tail + chunk
+                if not after_sheet_data:
+                    match = _SHEET_DATA_END_RE.search(data)
+                    end = match.start() if match else len(data)
+                    if not merge_rows:
+                        # Ячейки хвоста предыдущего куска могут попасть сюда второй раз - для множества это неважно
+                        columns.update(_CELL_COLUMN_RE.findall(data, 0, end))
+                        row_numbers = _ROW_REF_RE.findall(data, 0, end)
+                        if row_numbers:
+                            last_row = max(last_row, int(row_numbers[-1]))
+                    elif count_cells:
+                        for cell_match in _CELL_REF_RE.finditer(data, 0, end):
+                            cell_row = int(cell_match.group(2))
+                            if cell_row > merge_rows:
+                                count_cells = False
+                                break
+                            max_row = max(max_row, cell_row)
+                            max_column = max(max_column, column_index_from_string(cell_match.group(1).decode("ascii")))
+                    if not match:
+                        tail = data[-_RAW_TAIL_SIZE:]
+                        continue
+                    after_sheet_data = True
+                    data = data[match.end():]
+                last_end = 0
+                for match in _MERGE_CELL_RE.finditer(data):
+                    last_end = match.end()
+                    ref = match.group(1).decode("ascii")
+                    min_col, min_row, max_col, max_row_merge = range_boundaries(ref)
+                    if merge_rows and min_row > merge_rows:
+                        continue
+                    self.merge_index.add(min_row, max_row_merge, min_col, max_col, ref)
+                    self._add_merged_spans(min_row, max_row_merge, min_col, max_col)
+                    # Как и в полном режиме, объединенные ячейки входят в размеры листа
+                    max_row = max(max_row, max_row_merge)
+                    max_column = max(max_column, max_col)
+                tail = data[max(last_end, len(data) - _RAW_TAIL_SIZE):]
+        if merge_rows:
+            self.max_row = merge_rows
+            self.max_column = max(max_column, dimension_column)
+            return
+        if columns:
+            max_column = max(max_column, max(column_index_from_string(column.decode("ascii")) for column in columns))
+        else:
+            max_column = max(max_column, dimension_column) # Ячейки без номеров (r) - остается <dimension>
+        self.max_row = max(max_row, last_row or dimension_row)
+        self.max_column = max_column
+
+    def _add_merged_spans(self, min_row, max_row, min_col, max_col):
+        # В первой строке объединения пропускаем левую верхнюю ячейку, в остальных - вся ширина
+        if max_col > min_col:
+            self._merged_spans.setdefault(min_row, []).append((min_col, max_col - 1))
+        for row in range(min_row + 1, max_row + 1):
+            self._merged_spans.setdefault(row, []).append((min_col - 1, max_col - 1))
+
+    def iter_rows(self, min_row=2, max_col=None):
+        """
+        Генератор (row_num, row_cells): кортежи ячеек одинаковой длины (max_column
+        или max_col, если нужны только первые колонки - ячейки правее не создаются).
+        Пустые ячейки приходят как EmptyCell (value=None, без координаты),
+        поэтому координаты нужно строить по (row_num, индекс колонки).
+        """
+        if not self.max_row or not self.max_column or min_row > self.max_row:
+            return
+        width = min(max_col, self.max_column) if max_col else self.max_column
+        rows = self.worksheet.iter_rows(min_row=min_row, max_row=self.max_row, max_col=width)
+        merged_spans = self._merged_spans
+        for row_num, row_cells in enumerate(rows, start=min_row):
+            spans = merged_spans.get(row_num)
+            if spans:
+                row_cells = list(row_cells)
+                for first_idx, last_idx in spans:
+                    if first_idx >= width:
+                        continue
+                    last_idx = min(last_idx, width - 1)
+                    row_cells[first_idx:last_idx + 1] = [EMPTY_CELL] * (last_idx - first_idx + 1)
+                row_cells = tuple(row_cells)
+            yield row_num, row_cells
+
+    def close(self):
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def _open_sheet_xml(worksheet):
+    """
+    Бинарный поток XML листа книги, открытой в read_only.
+
+    Единственное место, где используется закрытый API openpyxl (ReadOnlyWorksheet._get_source):
+    публичного способа прочитать объединения read_only листа нет.
+    """
+    get_source = getattr(worksheet, "_get_source", None)
+    if get_source is None:
+        raise RuntimeError(f"openpyxl {openpyxl.__version__}: у листа read_only нет _get_source, "
+                           "объединенные ячейки прочитать нельзя (проверено с openpyxl 3.1)")
+    return get_source()
+
+
+def open_first_sheet(input_path, merge_rows=None):
+    """
+    Открывает первый лист книги для потокового чтения.
+
+    Args:
+        input_path (str | file-like): Путь к Excel файлу или открытый бинарный файл.
+        merge_rows (int): Собирать только объединения, начинающиеся в первых merge_rows строках
+                          (быстрый режим для чтения начала листа). None - все объединения.
+
+    Returns:
+        SheetReader или None, если в книге нет листов.
+    """
+    workbook = openpyxl.load_workbook(filename=input_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        if not workbook.sheetnames:
+            workbook.close()
+            return None
+        return SheetReader(workbook, workbook[workbook.sheetnames[0]], merge_rows=merge_rows)
+    except Exception:
+        workbook.close()
+        raise
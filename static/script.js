@@ -19,6 +19,42 @@ document.addEventListener('DOMContentLoaded', () => {
     // =====================
 
     let progressInterval = null; // Переменная для хранения ID интервала
+    let progressEvents = null; // EventSource потока прогресса (SSE)
+    let jobWaiter = null; // {resolve, reject} ожидания завершения фоновой задачи
+
+    // Функция ожидания завершения фоновой задачи: /upload сразу возвращает job_id,
+    // итог (ссылка на скачивание или ошибка) приходит потоком событий (eventsUrl),
+    // а если браузер не поддерживает EventSource или поток оборвался - поллингом /progress
+    function waitForJob(sessionId, eventsUrl) {
+        return new Promise((resolve, reject) => {
+            jobWaiter = { resolve, reject };
+            if (eventsUrl && window.EventSource) {
+                stopPolling(); // Дальше статус приходит сам
+                progressEvents = new EventSource(eventsUrl);
+                progressEvents.onmessage = (event) => {
+                    try { handleProgress(JSON.parse(event.data)); }
+                    catch (error) { console.error('Некорректное событие прогресса:', error); }
+                };
+                progressEvents.onerror = () => {
+                    if (!progressEvents) return; // Поток уже закрыт после завершения задачи
+                    console.warn('Поток прогресса недоступен, переходим на поллинг.');
+                    stopEvents();
+                    startPolling(sessionId);
+                };
+                return;
+            }
+            startPolling(sessionId);
+        });
+    }
+
+    function startPolling(sessionId) {
+        if (!progressInterval) {
+            progressInterval = setInterval(() => {
+                pollProgress(sessionId);
+            }, 1500);
+        }
+        pollProgress(sessionId); // Первый запрос сразу, не дожидаясь интервала
+    }
 
     // Функция для генерации простого уникального ID сессии
     function generateClientSessionId() {
@@ -33,35 +69,47 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Если сервер не отвечает или ошибка, прекращаем поллинг
                 console.error('Ошибка запроса прогресса:', response.status);
                 stopPolling();
+                if (jobWaiter) { jobWaiter.reject(new Error(`Ошибка запроса прогресса: ${response.status}`)); jobWaiter = null; }
                 return;
             }
-            const data = await response.json();
-
-            // Обновляем прогресс бар
-            let percentage = 0;
-            if (data.total > 0) {
-                percentage = Math.round((data.processed / data.total) * 100);
-            } else if (data.status && data.status !== "Ошибка" && data.status !== "Готово" && data.status !== "Не найдено") {
-                 // Если total еще 0, но идет работа (например, распаковка), показываем небольшой прогресс
-                 percentage = 10; // Или другое значение
-            }
-            // Проверяем progressBar перед использованием
-            if (progressBar) progressBar.style.width = `${percentage}%`;
-
-            // Обновляем текстовый статус
-            // Проверяем statusMessage перед использованием
-            if (statusMessage && data.status) {
-                statusMessage.textContent = data.status;
-            }
-
-            // Если есть ошибка от сервера или статус "Готово" или "Ошибка", останавливаем поллинг
-            if (data.error || data.status === "Готово" || data.status === "Ошибка") {
-                stopPolling();
-            }
+            handleProgress(await response.json());
 
         } catch (error) {
             console.error('Сетевая ошибка при запросе прогресса:', error);
             stopPolling(); // Останавливаем при сетевых ошибках
+            if (jobWaiter) { jobWaiter.reject(error); jobWaiter = null; }
+        }
+    }
+
+    // Обновление прогресса по статусу задачи (из /progress или из события SSE)
+    function handleProgress(data) {
+        // Обновляем прогресс бар
+        let percentage = 0;
+        if (data.total > 0) {
+            percentage = Math.round((data.processed / data.total) * 100);
+        } else if (data.status && data.status !== "Ошибка" && data.status !== "Готово" && data.status !== "Не найдено") {
+             // Если total еще 0, но идет работа (например, распаковка), показываем небольшой прогресс
+             percentage = 10; // Или другое значение
+        }
+        // Проверяем progressBar перед использованием
+        if (progressBar) progressBar.style.width = `${percentage}%`;
+
+        // Обновляем текстовый статус
+        // Проверяем statusMessage перед использованием
+        if (statusMessage && data.status) {
+            statusMessage.textContent = data.status;
+        }
+
+        // Задача завершена: "Готово" (есть ссылка на скачивание) или ошибка - останавливаем поллинг и поток
+        if (data.status === "Готово" || data.status === "Ошибка" || data.status === "Критическая ошибка") {
+            stopPolling();
+            stopEvents();
+            if (jobWaiter) {
+                const waiter = jobWaiter;
+                jobWaiter = null;
+                if (data.status === "Готово" && data.download_url) waiter.resolve(data);
+                else waiter.reject(new Error(data.error || data.status));
+            }
         }
     }
 
@@ -74,6 +122,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Функция для закрытия потока событий прогресса
+    function stopEvents() {
+        if (progressEvents) {
+            progressEvents.close();
+            progressEvents = null;
+            console.log("Поток прогресса закрыт.");
+        }
+    }
+
     // === Новая функция: Проверка валидности формы и управление UI ===
     function checkFormValidity() {
         // Получаем ВСЕ нужные элементы здесь:
@@ -146,6 +203,7 @@ document.addEventListener('DOMContentLoaded', () => {
         form.addEventListener('submit', async (event) => {
             event.preventDefault(); // Оставляем preventDefault, т.к. отправка асинхронная
             stopPolling();
+            stopEvents();
 
             // --- УДАЛЯЕМ БЛОКИРОВКУ КНОПКИ ЗДЕСЬ --- 
             /*
@@ -193,10 +251,15 @@ document.addEventListener('DOMContentLoaded', () => {
             formData.append('client_session_id', clientSessionId);
 
             let finalSmetaType = currentSmetaTypeSelect.value;
-            if (finalSmetaType === 'Турбосметчик') {
+            // Версия "auto" - отправляем общий тип без версии, версия определяется по файлу на сервере
+            if (finalSmetaType === 'Турбосметчик' && currentTurbosmetchikVersionSelect.value !== 'auto') {
                  finalSmetaType += '-' + currentTurbosmetchikVersionSelect.value;
             }
             formData.append('smeta_type', finalSmetaType);
+            const outputModeSelect = document.getElementById('output_mode');
+            if (outputModeSelect) formData.append('output_mode', outputModeSelect.value);
+            const outputFormatSelect = document.getElementById('output_format');
+            if (outputFormatSelect) formData.append('output_format', outputFormatSelect.value);
             console.log("Отправляемый тип сметы:", finalSmetaType);
 
             // --- Запускаем поллинг прогресса ---
@@ -211,9 +274,14 @@ document.addEventListener('DOMContentLoaded', () => {
                     body: formData,
                 });
 
-                stopPolling();
+                let data = await response.json();
 
-                const data = await response.json();
+                // Задача принята в очередь: ждем ее завершения через /progress
+                if (response.ok && data.success && data.job_id) {
+                    data = await waitForJob(data.job_id, data.events_url);
+                    data.success = true;
+                }
+                stopPolling();
 
                  // Небольшая задержка перед скрытием прогресс-бара, если успешно
                 if (response.ok && data.success) {
@@ -243,6 +311,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
             } catch (error) {
                 stopPolling();
+                stopEvents();
+                jobWaiter = null;
                 console.error('Ошибка при отправке или обработке:', error);
                 if(progressContainer) progressContainer.style.display = 'none';
                 if(errorContainer) {
@@ -0,0 +1,230 @@
+# status_store.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Хранилище статусов задач обработки (то, что отдает /progress).
+#   MemoryStatusStore - словарь в памяти процесса (один процесс веб-приложения);
+#   SQLiteStatusStore - общий файл SQLite: статус виден из любого процесса (несколько воркеров gunicorn).
+# Оба хранилища ограничены по времени жизни записи (TTL с последнего обновления) и по числу записей:
+# при превышении удаляются давно не обновлявшиеся статусы.
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+STATUS_STORE_BACKEND = os.environ.get('STATUS_STORE', 'memory') # memory | sqlite
+STATUS_STORE_PATH = os.environ.get('STATUS_STORE_PATH', os.path.join('cache', 'status.sqlite3'))
+STATUS_TTL_SECONDS = int(os.environ.get('STATUS_TTL_SECONDS', str(24 * 3600))) # 24 часа
+STATUS_MAX_ENTRIES = int(os.environ.get('STATUS_MAX_ENTRIES', '10000'))
+
+# Как часто SQLite хранилище удаляет устаревшие записи (не чаще, чем раз в столько секунд)
+_SQLITE_SWEEP_INTERVAL = 60
+
+
+class JobStatus(dict):
+    """
+    Статус одной задачи: обычный словарь, который пишется в хранилище одним put на логическое обновление.
+
+    Конвейер (pipeline.process_upload) меняет статус через status.update(...) - каждый вызов
+    это одна запись в хранилище (для SQLite - одна транзакция), сколько бы ключей он ни менял.
+    Присваивание status[key] = value меняет только словарь: изменение уйдет в хранилище со следующим
+    update() или save() (так JobMetrics обновляет "timings", не записывая статус на каждом этапе).
+    На задачу должен быть один объект JobStatus: его содержимое пишется в хранилище целиком.
+    """
+
+    def __init__(self, store, job_id, initial=None):
+        super().__init__(initial or {})
+        self.store = store
+        self.job_id = job_id
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.save()
+
+    def save(self):
+        """Пишет статус в хранилище целиком."""
+        self.store.put(self.job_id, self)
+
+    def __reduce__(self):
+        # Копия (pickle/deepcopy) - обычный словарь без привязки к хранилищу
+        return (dict, (dict(self),))
+
+
+class _BaseStatusStore:
+
+    def __init__(self, ttl_seconds=STATUS_TTL_SECONDS, max_entries=STATUS_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Ожидающие изменений статуса (SSE /progress/<id>/events): job_id -> [Condition, число ожидающих]
+        self._waiters_lock = threading.Lock()
+        self._waiters = {}
+
+    def create(self, job_id, initial):
+        """Заводит статус новой задачи (старый статус с тем же id перезаписывается). Возвращает JobStatus."""
+        status = JobStatus(self, job_id, initial)
+        self.put(job_id, status)
+        return status
+
+    def attach(self, job_id):
+        """JobStatus по сохраненному статусу (пустой, если статуса нет). Для задачи, у которой нет своего объекта."""
+        return JobStatus(self, job_id, self.get(job_id))
+
+    def wait_for_update(self, job_id, timeout):
+        """
+        Ждет изменения статуса задачи, но не дольше timeout секунд.
+
+        Будят только изменения, сделанные в этом процессе; изменения из других процессов
+        (общее SQLite хранилище) вызывающий код увидит, перечитав статус после таймаута.
+        """
+        with self._waiters_lock:
+            waiter = self._waiters.get(job_id)
+            if waiter is None:
+                waiter = self._waiters[job_id] = [threading.Condition(self._waiters_lock), 0]
+            waiter[1] += 1
+            try:
+                waiter[0].wait(timeout)
+            finally:
+                waiter[1] -= 1
+                if not waiter[1]:
+                    del self._waiters[job_id]
+
+    def _notify(self, job_id):
+        with self._waiters_lock:
+            waiter = self._waiters.get(job_id)
+            if waiter is not None:
+                waiter[0].notify_all()
+
+
+class MemoryStatusStore(_BaseStatusStore):
+    """Статусы в памяти процесса; порядок записей - по времени последнего обновления."""
+
+    def __init__(self, ttl_seconds=STATUS_TTL_SECONDS, max_entries=STATUS_MAX_ENTRIES):
+        super().__init__(ttl_seconds, max_entries)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # job_id -> (updated_at, status)
+
+    def get(self, job_id):
+        """Копия статуса (dict) или None, если статуса нет или он устарел."""
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                return None
+            updated_at, status = entry
+            if self.ttl_seconds and time.time() - updated_at > self.ttl_seconds:
+                del self._entries[job_id]
+                return None
+            # Копия: задача продолжает менять свой статус, пока /progress отдает его клиенту
+            return dict(status)
+
+    def put(self, job_id, status):
+        with self._lock:
+            self._entries[job_id] = (time.time(), status)
+            self._entries.move_to_end(job_id)
+            self._evict_locked()
+        self._notify(job_id)
+
+    def delete(self, job_id):
+        with self._lock:
+            self._entries.pop(job_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _evict_locked(self):
+        # Записи упорядочены по обновлению: устаревшие и лишние - в начале
+        expire_before = time.time() - self.ttl_seconds if self.ttl_seconds else None
+        while self._entries:
+            job_id, (updated_at, _status) = next(iter(self._entries.items()))
+            too_many = self.max_entries and len(self._entries) > self.max_entries
+            if not too_many and (expire_before is None or updated_at >= expire_before):
+                break
+            del self._entries[job_id]
+
+
+class SQLiteStatusStore(_BaseStatusStore):
+    """
+    Статусы в файле SQLite, общем для всех процессов приложения.
+
+    Статус хранится JSON строкой. Соединение открывается лениво в каждом процессе
+    (после fork соединение родителя не используется). Устаревшие записи не отдаются
+    сразу, а удаляются при записи - не чаще раза в _SQLITE_SWEEP_INTERVAL секунд.
+    """
+
+    def __init__(self, path=STATUS_STORE_PATH, ttl_seconds=STATUS_TTL_SECONDS, max_entries=STATUS_MAX_ENTRIES):
+        super().__init__(ttl_seconds, max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._last_sweep = 0.0
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data, updated_at FROM job_status WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if self.ttl_seconds and time.time() - updated_at > self.ttl_seconds:
+            return None
+        return json.loads(data)
+
+    def put(self, job_id, status):
+        data = json.dumps(status, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO job_status (job_id, data, updated_at) VALUES (?, ?, ?)",
+                                   (job_id, data, now))
+            if now - self._last_sweep >= _SQLITE_SWEEP_INTERVAL:
+                self._last_sweep = now
+                self._sweep_locked(connection, now)
+        self._notify(job_id)
+
+    def delete(self, job_id):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM job_status WHERE job_id = ?", (job_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM job_status").fetchone()[0]
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            # WAL: чтение из других процессов не ждет записи; статус не критичен к потере при сбое питания
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS job_status "
+                                   "(job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+                connection.execute("CREATE INDEX IF NOT EXISTS job_status_updated_at ON job_status (updated_at)")
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _sweep_locked(self, connection, now):
+        with connection:
+            if self.ttl_seconds:
+                connection.execute("DELETE FROM job_status WHERE updated_at < ?", (now - self.ttl_seconds,))
+            if self.max_entries:
+                # Оставляем max_entries самых свежих записей
+                connection.execute("DELETE FROM job_status WHERE job_id IN (SELECT job_id FROM job_status "
+                                   "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+
+def create_status_store(backend=STATUS_STORE_BACKEND):
+    """Хранилище статусов по имени бэкенда (memory / sqlite)."""
+    if backend == 'memory':
+        return MemoryStatusStore()
+    if backend == 'sqlite':
+        return SQLiteStatusStore()
+    raise ValueError(f"Неизвестное хранилище статусов: {backend} (ожидается memory или sqlite).")
@@ -0,0 +1,8 @@
+# conftest.py
+import os
+import sys
+
+# Модули приложения лежат в корне проекта (без пакета) - тесты импортируют их оттуда
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
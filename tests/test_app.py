@@ -0,0 +1,44 @@
+# test_app.py
+import io
+import json
+import openpyxl
+import pytest
+import app as app_module
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'PROGRESS_EVENTS_POLL_SECONDS', 0.01)
+    monkeypatch.setitem(app_module.app.config, 'PROGRESS_EVENTS_MISSING_SECONDS', 0.05)
+    return app_module.app.test_client()
+
+
+def _events(response):
+    return [json.loads(line[len("data: "):]) for line in response.get_data(as_text=True).splitlines()
+            if line.startswith("data: ")]
+
+
+def test_events_stream_closes_for_unknown_job(client):
+    response = client.get("/progress/нет-такой-задачи/events")
+    events = _events(response) # Поток закрылся сам - иначе чтение тела не завершилось бы
+    assert events[-1]["status"] in app_module.FINAL_STATUSES and events[-1]["error"]
+
+
+def test_events_stream_ends_with_final_status(client):
+    status = app_module.processing_status.create("sse-job", {"processed": 0, "total": 1, "status": "В очереди...",
+                                                            "error": None})
+    status.update({"processed": 1, "status": "Готово"})
+    assert _events(client.get("/progress/sse-job/events")) == [dict(status)]
+
+
+def test_upload_rejects_session_id_that_is_not_a_folder_name(client, tmp_path, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'UPLOAD_FOLDER', str(tmp_path / "uploads"))
+    workbook = io.BytesIO()
+    openpyxl.Workbook().save(workbook)
+    workbook.seek(0)
+    response = client.post("/upload", content_type="multipart/form-data", data={
+        "client_session_id": "..", "smeta_type": "Смета ру",
+        "file": (workbook, "smeta.xlsx")})
+    assert response.status_code == 400
+    assert "ID сессии" in response.get_json()["error"]
+    assert not (tmp_path / "uploads").exists()
@@ -0,0 +1,56 @@
+# test_archive_reader.py
+import pickle
+import zipfile
+import pytest
+import dispatcher
+import result_cache
+from archive_reader import list_excel_members, check_upload, ZipMember
+from bench.generator import generate_workbook
+
+
+@pytest.fixture
+def archive(tmp_path):
+    workbook_path = tmp_path / "t1.xlsx"
+    generate_workbook(str(workbook_path), "Турбосметчик-1", rows=200, seed=3)
+    archive_path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(archive_path, "w") as target:
+        target.write(workbook_path, "б/смета 2.xlsx")
+        target.write(workbook_path, "а/смета 1.xlsm")
+        target.writestr("__MACOSX/а/._смета 1.xlsm", b"")
+        target.writestr(".hidden.xlsx", b"")
+        target.writestr("readme.txt", b"")
+        target.writestr("пустая папка/", b"")
+    return str(archive_path), str(workbook_path)
+
+
+def test_lists_only_excel_members_sorted(archive):
+    archive_path, _workbook_path = archive
+    members = list_excel_members(archive_path)
+    assert [member.display_name for member in members] == ["а/смета 1.xlsm", "б/смета 2.xlsx"]
+    assert pickle.loads(pickle.dumps(members[0])).member_name == members[0].member_name # Передается в процесс пула
+
+
+@pytest.mark.parametrize("max_memory_bytes", [None, 1]) # В памяти и во временном файле на диске
+def test_member_opens_without_extracting(archive, tmp_path, max_memory_bytes):
+    archive_path, workbook_path = archive
+    member = list_excel_members(archive_path, spool_dir=str(tmp_path))[0]
+    with member.open(max_memory_bytes) as source, open(workbook_path, "rb") as original:
+        assert source.read() == original.read()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["batch.zip", "t1.xlsx"] # Ничего не распаковано
+
+
+def test_member_is_parsed_like_the_file(archive, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_ENABLED", False)
+    archive_path, workbook_path = archive
+    member = list_excel_members(archive_path)[0]
+    assert dispatcher.run_processor("Турбосметчик-1", member) == dispatcher.run_processor("Турбосметчик-1", workbook_path)
+
+
+def test_check_upload_rejects_archive_without_excel(tmp_path):
+    archive_path = tmp_path / "docs.zip"
+    with zipfile.ZipFile(archive_path, "w") as target:
+        target.writestr("readme.txt", b"")
+    with pytest.raises(ValueError):
+        check_upload(str(archive_path), is_zip=True)
+    with pytest.raises(ValueError):
+        check_upload(str(archive_path), is_zip=False) # Не книга Excel: нет xl/workbook.xml
@@ -0,0 +1,116 @@
+# test_batch.py
+import os
+import zipfile
+import pytest
+import batch
+import pipeline
+import result_cache
+from bench.generator import generate_workbook
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Папка входа: книга в корне, книга в подпапке и архив из двух книг."""
+    source_dir = tmp_path / "in"
+    (source_dir / "sub").mkdir(parents=True)
+    generate_workbook(str(source_dir / "a.xlsx"), "Смета ру", rows=60, seed=1)
+    generate_workbook(str(source_dir / "sub" / "b.xlsx"), "Смета ру", rows=60, seed=2)
+    with zipfile.ZipFile(source_dir / "arch.zip", "w") as archive:
+        archive.write(source_dir / "a.xlsx", "x/c.xlsx")
+        archive.write(source_dir / "sub" / "b.xlsx", "d.xlsm")
+    (source_dir / "~$a.xlsx").write_bytes(b"") # Временный файл Excel - не вход
+    return batch.collect_inputs([str(source_dir)])
+
+
+def _plan(inputs, tmp_path, layout):
+    jobs, errors = batch.plan_jobs(inputs, str(tmp_path / "out"), layout)
+    assert errors == []
+    out = str(tmp_path / "out")
+    return [(os.path.relpath(job["output_path"], out), [source["original_name"] for source in job["sources"]])
+            for job in jobs]
+
+
+def test_collect_inputs_walks_directories(inputs):
+    assert [relative_path for _path, relative_path in inputs] == ["a.xlsx", "arch.zip", os.path.join("sub", "b.xlsx")]
+
+
+def test_layout_file(inputs, tmp_path):
+    assert _plan(inputs, tmp_path, "file") == [
+        ("a_processed.xlsx", ["a.xlsx"]),
+        (os.path.join("arch", "d_processed.xlsx"), ["d.xlsm"]),
+        (os.path.join("arch", "x", "c_processed.xlsx"), ["x/c.xlsx"]),
+        (os.path.join("sub", "b_processed.xlsx"), [os.path.join("sub", "b.xlsx")]),
+    ]
+
+
+def test_layout_archive(inputs, tmp_path):
+    assert _plan(inputs, tmp_path, "archive") == [
+        ("a_processed.xlsx", ["a.xlsx"]),
+        ("arch_processed.xlsx", ["d.xlsm", "x/c.xlsx"]),
+        (os.path.join("sub", "b_processed.xlsx"), [os.path.join("sub", "b.xlsx")]),
+    ]
+
+
+def test_layout_combined(inputs, tmp_path):
+    assert _plan(inputs, tmp_path, "combined") == [
+        (batch.DEFAULT_COMBINED_NAME, ["a.xlsx", "arch.zip/d.xlsm", "arch.zip/x/c.xlsx", os.path.join("sub", "b.xlsx")]),
+    ]
+
+
+def test_same_output_name_gets_a_suffix(tmp_path):
+    first, second = tmp_path / "a.xlsx", tmp_path / "a.xlsm"
+    first.write_bytes(b""); second.write_bytes(b"")
+    jobs, _errors = batch.plan_jobs([(str(first), "a.xlsx"), (str(second), "a.xlsm")], str(tmp_path / "out"))
+    assert [os.path.basename(job["output_path"]) for job in jobs] == ["a_processed.xlsx", "a_processed_2.xlsx"]
+
+
+def test_done_jobs_are_skipped_until_input_changes(inputs, tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_ENABLED", False)
+    jobs, _errors = batch.plan_jobs(inputs, str(tmp_path / "out"), "archive")
+    assert not any(batch.is_done(job) for job in jobs)
+    os.makedirs(tmp_path / "out")
+    records = list(batch.run_batch(jobs, "Смета ру", log_path=str(tmp_path / "out" / batch.BATCH_LOG_NAME)))
+    assert [record["status"] for record in records] == ["done"] * 3
+    assert all(batch.is_done(job) for job in jobs)
+    # Вход изменился после итога - задача снова к обработке (повторный запуск продолжает прерванный)
+    newer = os.path.getmtime(jobs[0]["output_path"]) + 10
+    os.utime(inputs[0][0], (newer, newer))
+    jobs, _errors = batch.plan_jobs(inputs, str(tmp_path / "out"), "archive")
+    assert [batch.is_done(job) for job in jobs] == [False, True, True]
+    with open(tmp_path / "out" / batch.BATCH_LOG_NAME, encoding="utf-8") as log:
+        assert len(log.readlines()) == 3
+
+
+def test_run_job_publishes_only_a_finished_file(inputs, tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_ENABLED", False)
+    job = batch.plan_jobs(inputs[:1], str(tmp_path / "out"))[0][0]
+    build_result = pipeline.build_result
+
+    def checked_build_result(session_id, sources, smeta_type, output_path, *args, **kwargs):
+        assert output_path != job["output_path"] # Пишется во временный файл рядом с итогом
+        assert not os.path.exists(job["output_path"])
+        return build_result(session_id, sources, smeta_type, output_path, *args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "build_result", checked_build_result)
+    record = batch.run_job(job, "Смета ру")
+    assert record["status"] == "done" and record["files_ok"] == 1
+    assert os.listdir(os.path.dirname(job["output_path"])) == [os.path.basename(job["output_path"])]
+
+
+@pytest.mark.parametrize("error", [ValueError("нет данных"), KeyboardInterrupt()])
+def test_run_job_removes_temp_file_on_failure(inputs, tmp_path, monkeypatch, error):
+    job = batch.plan_jobs(inputs[:1], str(tmp_path / "out"))[0][0]
+
+    def failing_build_result(session_id, sources, smeta_type, output_path, *args, **kwargs):
+        with open(output_path, "wb") as f:
+            f.write(b"partial")
+        raise error
+
+    monkeypatch.setattr(pipeline, "build_result", failing_build_result)
+    if isinstance(error, Exception):
+        record = batch.run_job(job, "Смета ру")
+        assert record["status"] == "error" and record["error"] == "нет данных"
+    else:
+        with pytest.raises(KeyboardInterrupt): # Прерванный запуск тоже не оставляет временных файлов
+            batch.run_job(job, "Смета ру")
+    assert os.listdir(os.path.dirname(job["output_path"])) == []
@@ -0,0 +1,46 @@
+# test_detect.py
+import pytest
+import dispatcher
+import openpyxl
+from bench.generator import generate_workbook
+
+
+@pytest.mark.parametrize("smeta_type", ["Смета ру", "Турбосметчик-1", "Турбосметчик-2", "Турбосметчик-3"])
+def test_generated_format_is_detected(tmp_path, smeta_type):
+    path = str(tmp_path / "smeta.xlsx")
+    generate_workbook(path, smeta_type, rows=300, seed=1)
+    assert dispatcher.detect_smeta_type(path) == smeta_type
+
+
+def _turbosmetchik_with_both_quantities(path):
+    # Раскладка Турбосметчика-1/2, числа и в M (кол-во T1), и в N (кол-во T2) - версии не различить
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["№ п/п", "Шифр", "Наименование"])
+    sheet.append(["Раздел 1. Общестроительные работы"])
+    sheet.merge_cells("A2:W2")
+    for item in range(1, 6):
+        row = [None] * 23
+        row[0], row[1], row[3], row[11], row[12], row[13] = item, "ФЕР01-01-001", "Разработка грунта", "м3", 1.5, 2.5
+        sheet.append(row)
+        price = [None] * 23
+        price[3], price[21] = "Всего по позиции", 100.0
+        sheet.append(price)
+        sheet.merge_cells(f"D{sheet.max_row}:R{sheet.max_row}")
+    workbook.save(path)
+
+
+def test_equal_scores_are_ambiguous(tmp_path):
+    path = str(tmp_path / "t12.xlsx")
+    _turbosmetchik_with_both_quantities(path)
+    with pytest.raises(dispatcher.AmbiguousFormatError) as error:
+        dispatcher.detect_smeta_type(path, ["Турбосметчик-1", "Турбосметчик-2", "Турбосметчик-3"])
+    assert error.value.candidates == ["Турбосметчик-1", "Турбосметчик-2"]
+
+
+def test_ambiguous_format_is_reported_in_stats(tmp_path):
+    path = str(tmp_path / "t12.xlsx")
+    _turbosmetchik_with_both_quantities(path)
+    result, stats = dispatcher.run_processor_with_stats("Турбосметчик", path)
+    assert result == (None, None)
+    assert "выберите версию" in stats["error"] and stats["smeta_type"] is None
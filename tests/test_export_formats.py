@@ -0,0 +1,70 @@
+# test_export_formats.py
+import csv
+import json
+import datetime
+import pytest
+import output_writer
+from row_engine import SectionRow
+
+HEADERS = ["№№", "Шифр", "Наименование", "Ед.изм.", "Кол-во", "Стоимость"]
+SECTION = SectionRow(["A2", None, "Раздел 1", None, None, "V9"], "section")
+ITEM = ["A3", "B3", "D3", "L3", "M3", "V4"]
+VALUES_ITEM = [1, "ФЕР01", "Грунт", "м3", 1.5, datetime.date(2024, 5, 1)]
+
+
+def _write(tmp_path, output_format):
+    path = str(tmp_path / ("result" + output_writer.OUTPUT_FORMAT_EXTENSIONS[output_format]))
+    writer = output_writer.create_writer(output_format, path, "result")
+    writer.write_headers(HEADERS)
+    writer.write_separator("a.xlsx")
+    assert writer.write_rows([SECTION, ITEM]) == 2
+    writer.write_separator("b.xlsx")
+    writer.write_rows([VALUES_ITEM])
+    writer.close()
+    return path
+
+
+def test_csv(tmp_path):
+    with open(_write(tmp_path, "csv"), encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [HEADERS, ["a.xlsx", "", "", "", "", ""], ["A2", "", "Раздел 1", "", "", "V9"], ITEM,
+                    ["b.xlsx", "", "", "", "", ""], ["1", "ФЕР01", "Грунт", "м3", "1.5", "2024-05-01"]]
+
+
+def test_json_lines(tmp_path):
+    with open(_write(tmp_path, "jsonl"), encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records == [
+        {"type": "columns", "columns": HEADERS},
+        {"type": "file", "name": "a.xlsx"},
+        {"type": "section", "values": list(SECTION)},
+        {"type": "item", "values": ITEM},
+        {"type": "file", "name": "b.xlsx"},
+        {"type": "item", "values": [1, "ФЕР01", "Грунт", "м3", 1.5, "2024-05-01"]},
+    ]
+
+
+def test_parquet(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    table = pyarrow_parquet.read_table(_write(tmp_path, "parquet"))
+    assert table.column_names == [output_writer.PARQUET_FILE_COLUMN, output_writer.PARQUET_KIND_COLUMN] + HEADERS
+    assert table.to_pylist()[0] == dict(zip(table.column_names, ["a.xlsx", "section"] + list(SECTION)))
+    assert [row[output_writer.PARQUET_FILE_COLUMN] for row in table.to_pylist()] == ["a.xlsx", "a.xlsx", "b.xlsx"]
+    assert list(table.to_pylist()[2].values())[2:] == ["1", "ФЕР01", "Грунт", "м3", "1.5", "2024-05-01"]
+
+
+def test_parquet_writes_row_groups(tmp_path, monkeypatch):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(output_writer, "PARQUET_ROW_GROUP_SIZE", 2)
+    path = str(tmp_path / "result.parquet")
+    writer = output_writer.create_writer("parquet", path, "result")
+    writer.write_headers(HEADERS)
+    writer.write_rows([ITEM] * 5)
+    writer.close()
+    assert pyarrow_parquet.ParquetFile(path).metadata.num_row_groups == 3
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    assert output_writer.output_format_error("xls")
+    with pytest.raises(ValueError):
+        output_writer.create_writer("xls", str(tmp_path / "result.xls"), "result")
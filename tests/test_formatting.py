@@ -0,0 +1,35 @@
+# test_formatting.py
+import os
+import openpyxl
+import formatting
+
+
+def _reference(path, width_a):
+    workbook = openpyxl.Workbook()
+    workbook.active.column_dimensions["A"].width = width_a
+    workbook.active.column_dimensions["C"].width = 40
+    workbook.save(path)
+
+
+def test_reference_widths_are_read_once_until_the_file_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / "reference.xlsx")
+    _reference(path, 12)
+    loads = []
+    load_reference_widths = formatting._load_reference_widths
+    monkeypatch.setattr(formatting, "_load_reference_widths", lambda p: loads.append(p) or load_reference_widths(p))
+
+    widths = formatting.read_reference_widths(path)
+    assert widths[0] == 12 and widths[2] == 40
+    widths[0] = 99 # Вызывающий код получает копию - кэш не портится
+    assert formatting.read_reference_widths(path)[0] == 12
+    assert len(loads) == 1
+
+    _reference(path, 20)
+    newer = os.path.getmtime(path) + 10 # mtime изменился - файл перечитывается
+    os.utime(path, (newer, newer))
+    assert formatting.read_reference_widths(path)[0] == 20
+    assert len(loads) == 2
+
+
+def test_missing_reference_file_gives_no_widths(tmp_path):
+    assert formatting.read_reference_widths(str(tmp_path / "missing.xlsm")) is None
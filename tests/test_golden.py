@@ -0,0 +1,37 @@
+# test_golden.py
+import os
+import json
+import pytest
+import dispatcher
+from bench.generator import generate_workbook
+
+# Эталонный вывод процессоров до перехода на общий движок правил (row_engine): для каждого случая из
+# golden/cases.json книга генерируется заново (bench/generator.py, фиксированное зерно), а ее разбор
+# исходными процессорами (baseline) сохранен в golden/<name>.json
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+with open(os.path.join(GOLDEN_DIR, "cases.json"), encoding="utf-8") as f:
+    CASES = json.load(f)
+
+
+def _golden(case, tmp_path):
+    path = str(tmp_path / f"{case['name']}.xlsx")
+    generate_workbook(path, case["smeta_type"], **case["params"])
+    with open(os.path.join(GOLDEN_DIR, f"{case['name']}.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    return path, expected
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_processor_matches_baseline(tmp_path, case):
+    path, expected = _golden(case, tmp_path)
+    headers, rows = dispatcher.PROCESSORS[case["smeta_type"]](path)
+    assert headers == expected["headers"]
+    assert [list(row) for row in rows] == expected["rows"]
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_stream_matches_baseline(tmp_path, case):
+    path, expected = _golden(case, tmp_path)
+    headers, batches = dispatcher.STREAM_PROCESSORS[case["smeta_type"]](path)
+    assert headers == expected["headers"]
+    assert [list(row) for batch in batches for row in batch] == expected["rows"]
@@ -0,0 +1,104 @@
+# test_jobs.py
+import io
+import time
+import threading
+import openpyxl
+import pytest
+from jobs import JobQueue
+
+FINAL_STATUSES = ("Готово", "Ошибка", "Критическая ошибка")
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_jobs_run_in_submission_order():
+    done = []
+    job_queue = JobQueue(num_workers=1)
+    for i in range(20):
+        job_queue.submit(f"job-{i}", done.append, i)
+    assert _wait_until(lambda: len(done) == 20)
+    assert done == list(range(20))
+
+
+def test_no_more_jobs_run_at_once_than_workers():
+    lock = threading.Lock()
+    running, peak, finished = [0], [0], []
+
+    def job(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        finished.append(i)
+
+    job_queue = JobQueue(num_workers=3)
+    for i in range(12):
+        job_queue.submit(f"job-{i}", job, i)
+    assert job_queue.pending() > 0 # submit не ждет выполнения
+    assert _wait_until(lambda: len(finished) == 12)
+    assert peak[0] == 3
+
+
+def test_failing_job_does_not_stop_the_worker():
+    done = []
+
+    def failing():
+        raise RuntimeError("сбой задачи")
+
+    job_queue = JobQueue(num_workers=1)
+    job_queue.submit("bad", failing)
+    job_queue.submit("good", done.append, "good")
+    assert _wait_until(lambda: done == ["good"])
+
+
+@pytest.fixture
+def client():
+    import app as app_module
+    return app_module, app_module.app.test_client()
+
+
+def _upload(client, session_id):
+    workbook = io.BytesIO()
+    openpyxl.Workbook().save(workbook)
+    workbook.seek(0)
+    response = client.post("/upload", content_type="multipart/form-data", data={
+        "client_session_id": session_id, "smeta_type": "Смета ру", "file": (workbook, "smeta.xlsx")})
+    assert response.status_code == 202
+    assert response.get_json()["job_id"] == session_id # Ответ - до обработки
+    return lambda: client.get(f"/progress/{session_id}").get_json()
+
+
+@pytest.mark.parametrize("failure", [None, ValueError("В файле нет данных")])
+def test_upload_status_moves_from_queued_to_running_to_final(client, monkeypatch, failure):
+    app_module, test_client = client
+    started, release = threading.Event(), threading.Event()
+    seen_on_start = []
+
+    def process_upload(session_id, saved_file_path, original_filename_unsafe, smeta_type, upload_path, status,
+                       *args, **kwargs):
+        seen_on_start.append(status["status"])
+        status.update({"status": "Обработка файлов (всего 1)..."})
+        started.set()
+        assert release.wait(5)
+        if failure:
+            raise failure
+        return {"output_filename": "smeta_processed.xlsx", "message": "Обработка завершена."}
+
+    monkeypatch.setattr(app_module.pipeline, "process_upload", process_upload)
+    progress = _upload(test_client, f"job-status-{failure is None}")
+    assert started.wait(5)
+    assert seen_on_start == ["В очереди..."]
+    assert progress()["status"] == "Обработка файлов (всего 1)..."
+    release.set()
+    assert _wait_until(lambda: progress()["status"] in FINAL_STATUSES)
+    if failure:
+        assert (progress()["status"], progress()["error"]) == ("Ошибка", "В файле нет данных")
+    else:
+        assert progress()["status"] == "Готово" and progress()["download_url"].endswith("smeta_processed.xlsx")
@@ -0,0 +1,24 @@
+# test_metrics.py
+import dispatcher
+from metrics import JobMetrics, MetricsRegistry
+
+
+def _stats(smeta_type, items, cache_hit=False):
+    return {"stages": {"classify": 0.5}, "counters": {"items": items}, "cache_hit": cache_hit,
+            "smeta_type": smeta_type, "error": None}
+
+
+def test_counters_are_labeled_with_detected_type():
+    job_metrics = JobMetrics(smeta_type=dispatcher.AUTO_DETECT_TYPE)
+    job_metrics.add_processor_stats(_stats("Смета ру", 10))
+    job_metrics.add_processor_stats(_stats("Турбосметчик-2", 3, cache_hit=True))
+    job_metrics.add_processor_stats(_stats(None, 0)) # Файл не разобран
+    registry = MetricsRegistry()
+    registry.observe_job(job_metrics, "done")
+    text = registry.render()
+    assert 'smeta_processor_items_total{smeta_type="Смета ру"} 10' in text
+    assert 'smeta_processor_items_total{smeta_type="Турбосметчик-2"} 3' in text
+    assert 'smeta_files_processed_total{smeta_type="Турбосметчик-2",cache="hit"} 1' in text
+    assert 'smeta_files_processed_total{smeta_type="unknown",cache="miss"} 1' in text
+    assert dispatcher.AUTO_DETECT_TYPE not in text
+    assert job_metrics.as_dict()["counters"]["items"] == 13 # Итог задачи (/progress) - по всем файлам
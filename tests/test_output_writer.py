@@ -0,0 +1,20 @@
+# test_output_writer.py
+import os
+import pytest
+from openpyxl.worksheet._writer import ALL_TEMP_FILES
+import output_writer
+
+FORMATS = list(output_writer.available_output_formats())
+
+
+@pytest.mark.parametrize("output_format", FORMATS)
+def test_discard_removes_partial_output(tmp_path, output_format):
+    output_path = str(tmp_path / ("result" + output_writer.OUTPUT_FORMAT_EXTENSIONS[output_format]))
+    known_temp_files = set(ALL_TEMP_FILES)
+    writer = output_writer.create_writer(output_format, output_path, "result", column_widths=[10] * 6)
+    writer.write_headers(list("ABCDEF"))
+    writer.write_rows([["A1"] * 6 for _ in range(10)])
+    temp_files = set(ALL_TEMP_FILES) - known_temp_files # Временный файл листа .xlsx (openpyxl write_only)
+    writer.discard()
+    assert not os.path.exists(output_path)
+    assert not any(os.path.exists(path) for path in temp_files)
@@ -0,0 +1,77 @@
+# test_parallel.py
+import os
+import time
+import uuid
+import zipfile
+import openpyxl
+import pytest
+import dispatcher
+import result_cache
+import app as app_module
+from results_store import ResultsStore
+
+NAMES = ["01.xlsx", "02.xlsx", "03.xlsx", "04.xlsx", "05.xlsx"]
+
+
+def _smeta_ru(path, items):
+    """Смета формата "Смета ру": раздел (объединение A:K), позиции со строкой цены, итог раздела."""
+    workbook = openpyxl.Workbook()
+    workbook.properties.identifier = uuid.uuid4().hex # Свой файл в каждом тесте - кэш результатов не подходит
+    sheet = workbook.active
+    sheet.append(["№ п/п", "Шифр", "Наименование"])
+    sheet.append(["Раздел: 1. Земляные работы"])
+    sheet.merge_cells("A2:K2")
+    for i in range(1, items + 1):
+        sheet.append([i, f"ФЕР01-01-{i:03d}", "Разработка грунта", "м3", i * 1.5])
+        sheet.append([None] * 8 + [i * 100.0, None, i * 10.0])
+    sheet.append(["Итого по разделу: 1"])
+    sheet.merge_cells(f"A{sheet.max_row}:K{sheet.max_row}")
+    workbook.save(path)
+
+
+@pytest.fixture
+def workbooks(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "CACHE_ENABLED", False) # Каждый файл действительно разбирается
+    paths = []
+    for i, name in enumerate(NAMES):
+        # Разный размер: файлы в пуле завершаются не в исходном порядке
+        _smeta_ru(str(tmp_path / name), 300 - i * 50)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def _upload_archive(tmp_path, workbooks, workers, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'PROCESSING_WORKERS', workers)
+    store = ResultsStore(str(tmp_path / f"results_{workers}"))
+    monkeypatch.setattr(app_module, "results_store", store)
+    archive_path = tmp_path / "batch.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for path in reversed(workbooks): # Порядок в архиве не важен - файлы сортируются по имени
+            archive.write(path, os.path.basename(path))
+    with open(archive_path, "rb") as f:
+        client = app_module.app.test_client()
+        response = client.post("/upload", content_type="multipart/form-data", data={
+            "client_session_id": f"parallel-{workers}", "smeta_type": "Смета ру", "file": (f, "batch.zip")})
+    assert response.status_code == 202, response.get_json()
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        status = client.get(f"/progress/parallel-{workers}").get_json()
+        if status["status"] in ("Готово", "Ошибка", "Критическая ошибка"):
+            break
+        time.sleep(0.05)
+    assert status["status"] == "Готово", status
+    result_path = store.path_for(f"parallel-{workers}", status["download_filename"])
+    return [list(row) for row in openpyxl.load_workbook(result_path).active.iter_rows(values_only=True)]
+
+
+def test_process_pool_matches_sequential(workbooks):
+    sequential = list(dispatcher.run_processors("Смета ру", workbooks, max_workers=1))
+    parallel = sorted(dispatcher.run_processors("Смета ру", workbooks, max_workers=2), key=lambda item: item[0])
+    assert [(index, result) for index, result, _stats in parallel] == \
+           [(index, result) for index, result, _stats in sequential]
+
+
+def test_pool_output_is_in_archive_order(tmp_path, workbooks, monkeypatch):
+    rows = _upload_archive(tmp_path, workbooks, 2, monkeypatch)
+    assert [row[0] for row in rows if row[0] in NAMES] == NAMES # Разделители файлов - в исходном порядке
+    assert rows == _upload_archive(tmp_path, workbooks, 1, monkeypatch)
@@ -0,0 +1,108 @@
+# test_pipeline.py
+import csv
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import dispatcher
+import metrics
+import pipeline
+
+HEADERS = ["A", "B", "C", "D", "E", "F"]
+
+
+def _fake_stream(batches_by_file):
+    """Подмена dispatcher.open_processor_stream: пачки строк по имени файла, исключение - сбой посреди разбора."""
+    @contextlib.contextmanager
+    def open_processor_stream(smeta_type, input_path, output_mode=dispatcher.OUTPUT_COORDS):
+        def batches():
+            for batch in batches_by_file[input_path]:
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        yield HEADERS, batches()
+    return open_processor_stream
+
+
+def _build(tmp_path, monkeypatch, batches_by_file):
+    monkeypatch.setattr(dispatcher, "open_processor_stream", _fake_stream(batches_by_file))
+    status = {"processed": 0, "total": len(batches_by_file), "status": "", "error": None}
+    sources = [{"path": name, "original_name": name} for name in batches_by_file]
+    output_path = str(tmp_path / "result.csv")
+    outcome = pipeline.build_result("t", sources, "Смета ру", output_path, "result", status,
+                                    metrics.JobMetrics(status, "Смета ру"), output_format="csv")
+    return outcome, output_path
+
+
+def test_file_failing_mid_parse_leaves_no_rows(tmp_path, monkeypatch):
+    outcome, output_path = _build(tmp_path, monkeypatch, {
+        "good.xlsx": [[["A1"] * 6], [["A2"] * 6]],
+        "broken.xlsx": [[["B1"] * 6], RuntimeError("сбой посреди файла")],
+    })
+    assert outcome["files_ok"] == 1 and outcome["has_errors"]
+    with open(output_path, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[1][0] == "good.xlsx"
+    assert [row[0] for row in rows[2:]] == ["A1", "A2"] # Ни разделителя, ни строк сломанного файла
+
+
+def test_no_parsed_files_removes_output(tmp_path, monkeypatch):
+    with pytest.raises(ValueError):
+        _build(tmp_path, monkeypatch, {"broken.xlsx": [[["B1"] * 6], RuntimeError("сбой")]})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rows_spilled_to_disk_are_written_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "FILE_SPOOL_MAX_BYTES", 64) # Каждая пачка - уже во временном файле
+    batches = [[[f"A{i}-{j}"] * 6 for j in range(50)] for i in range(4)]
+    outcome, output_path = _build(tmp_path, monkeypatch, {"big.xlsx": batches})
+    assert outcome["files_ok"] == 1 and not outcome["has_errors"]
+    with open(output_path, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert [row[0] for row in rows[1:]] == [f"A{i}-{j}" for i in range(4) for j in range(50)]
+
+
+def test_parallel_status_updates_before_earlier_file_finishes(tmp_path, monkeypatch):
+    status = {"processed": 0, "total": 2, "status": "", "error": None}
+    seen_processed = []
+
+    def run_processors(smeta_type, input_paths, max_workers=1, output_mode=dispatcher.OUTPUT_COORDS):
+        # Второй файл готов раньше первого
+        yield 1, (HEADERS, [["B1"] * 6]), {"smeta_type": "Смета ру"}
+        seen_processed.append(status["processed"])
+        yield 0, (HEADERS, [["A1"] * 6]), {"smeta_type": "Смета ру"}
+
+    monkeypatch.setattr(dispatcher, "run_processors", run_processors)
+    sources = [{"path": name, "original_name": name} for name in ("a.xlsx", "b.xlsx")]
+    output_path = str(tmp_path / "result.csv")
+    outcome = pipeline.build_result("t", sources, "Смета ру", output_path, "result", status,
+                                    metrics.JobMetrics(status, "Смета ру"), workers=2, output_format="csv")
+    assert seen_processed == [1] # Статус второго файла - до того, как готов первый
+    assert outcome["files_ok"] == 2 and status["processed"] == 2
+    with open(output_path, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert [row[0] for row in rows[1:]] == ["a.xlsx", "A1", "b.xlsx", "B1"] # В итоге - исходный порядок
+
+
+def test_parallel_files_do_not_run_far_ahead_of_a_slow_file(monkeypatch):
+    release_first = threading.Event()
+    started = []
+
+    def run_processor_with_stats(smeta_type, input_path, output_mode=dispatcher.OUTPUT_COORDS):
+        started.append(input_path)
+        if input_path == 0:
+            assert release_first.wait(5)
+        return (HEADERS, [[input_path] * 6]), {"smeta_type": smeta_type}
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(dispatcher.worker_pool, "get_shared_pool", lambda max_workers: pool)
+    monkeypatch.setattr(dispatcher, "run_processor_with_stats", run_processor_with_stats)
+    results = dispatcher.run_processors("Смета ру", list(range(20)), max_workers=2)
+    window = dispatcher.REORDER_WINDOW_FACTOR * 2
+    order = [next(results)[0] for _ in range(window - 1)] # Все, кроме первого, что помещается в окно
+    assert order == list(range(1, window))
+    assert max(started) == window - 1 # Файлы дальше окна не начаты, пока первый не готов
+    release_first.set()
+    order += [index for index, _result, _stats in results]
+    assert sorted(order) == list(range(20))
+    pool.shutdown()
@@ -0,0 +1,68 @@
+# test_result_cache.py
+import os
+import json
+import zlib
+import datetime
+from result_cache import ResultCache
+from row_engine import SectionRow
+
+HEADERS = ["№№", "Шифр", "Наименование", "Ед.изм.", "Кол-во", "Стоимость"]
+
+
+def _result(marker="1"):
+    rows = [
+        SectionRow(["A2", None, "Раздел 1", None, None, "V9"], "section"),
+        [marker, "ФЕР01-01-001", "Разработка грунта", "м3", 1.5, 120.25],
+        ["2", None, datetime.datetime(2024, 5, 1, 12, 30), datetime.date(2024, 5, 2), datetime.time(8, 15),
+         datetime.timedelta(hours=2)],
+        [True, None, "", 0, -3, None],
+    ]
+    return HEADERS, rows
+
+
+def _entries(cache_dir):
+    return sorted(os.path.join(root, name) for root, _dirs, files in os.walk(cache_dir) for name in files)
+
+
+def test_round_trip_keeps_values_and_section_kind(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("ab" * 32, _result())
+    headers, rows = cache.get("ab" * 32)
+    assert (headers, rows) == _result()
+    assert isinstance(rows[0], SectionRow) and rows[0].kind == "section"
+    assert not isinstance(rows[1], SectionRow)
+
+
+def test_entry_is_plain_json(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("cd" * 32, _result())
+    (path,) = _entries(str(tmp_path))
+    with open(path, "rb") as f:
+        data = json.loads(zlib.decompress(f.read()))
+    assert data["headers"] == HEADERS
+    assert data["rows"][0] == {"kind": "section", "values": ["A2", None, "Раздел 1", None, None, "V9"]}
+
+
+def test_corrupted_entry_is_removed(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("ef" * 32, _result())
+    (path,) = _entries(str(tmp_path))
+    with open(path, "wb") as f:
+        f.write(b"not zlib")
+    assert cache.get("ef" * 32) is None
+    assert _entries(str(tmp_path)) == []
+
+
+def test_eviction_counts_entries_written_by_other_processes(tmp_path):
+    other = ResultCache(str(tmp_path))
+    other.put("01" * 32, _result("other"))
+    (other_path,) = _entries(str(tmp_path))
+    entry_size = os.path.getsize(other_path)
+    old = os.path.getmtime(other_path) - 100
+    os.utime(other_path, (old, old))
+    # Второй "процесс" не знает о записи первого, но при записи видит папку целиком
+    cache = ResultCache(str(tmp_path), max_bytes=entry_size + entry_size // 2)
+    cache.put("02" * 32, _result("own"))
+    assert cache.get("01" * 32) is None # Давно не использованная запись вытеснена
+    assert cache.get("02" * 32) == _result("own")
+
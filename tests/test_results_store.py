@@ -0,0 +1,61 @@
+# test_results_store.py
+import os
+import time
+from results_store import ResultsStore
+
+
+def _publish(store, job_id, filename, size=100, age=0):
+    temp_path = store.new_path(job_id, filename)
+    with open(temp_path, "wb") as f:
+        f.write(b"x" * size)
+    path = store.commit(job_id, filename, temp_path)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        store._index = None # Индекс перечитает mtime с диска
+    return path
+
+
+def test_commit_publishes_into_job_folder(tmp_path):
+    store = ResultsStore(str(tmp_path), max_age_seconds=0, max_bytes=0)
+    path = _publish(store, "job-1", "result.xlsx")
+    assert path == os.path.join(str(tmp_path), "job-1", "result.xlsx")
+    assert store.path_for("job-1", "result.xlsx") == path
+    assert store.path_for("job-2", "result.xlsx") is None # Одинаковое имя в другой задаче - другой файл
+    assert store.path_for("job-1", "../job-1/result.xlsx") is None
+    assert os.listdir(os.path.join(str(tmp_path), ".incoming")) == []
+
+
+def test_sweep_removes_expired_results_and_temp_files(tmp_path):
+    store = ResultsStore(str(tmp_path), max_age_seconds=60, max_bytes=0)
+    _publish(store, "old", "result.xlsx", age=120)
+    fresh = _publish(store, "fresh", "result.xlsx")
+    stale_temp = store.new_path("crashed", "result.xlsx")
+    open(stale_temp, "wb").close()
+    os.utime(stale_temp, (time.time() - 120, time.time() - 120))
+    assert store.sweep() == 1
+    assert not os.path.exists(os.path.join(str(tmp_path), "old")) # Пустая папка задачи удалена
+    assert os.path.exists(fresh) and not os.path.exists(stale_temp)
+
+
+def test_size_quota_removes_oldest_on_commit(tmp_path):
+    store = ResultsStore(str(tmp_path), max_age_seconds=0, max_bytes=250)
+    _publish(store, "a", "result.xlsx", age=30)
+    _publish(store, "b", "result.xlsx", age=20)
+    _publish(store, "c", "result.xlsx")
+    assert store.path_for("a", "result.xlsx") is None
+    assert store.path_for("b", "result.xlsx") and store.path_for("c", "result.xlsx")
+    assert store.stats() == (2, 200)
+
+
+def test_sweeper_thread_runs_sweep(tmp_path):
+    store = ResultsStore(str(tmp_path), max_age_seconds=60, max_bytes=0)
+    _publish(store, "old", "result.xlsx", age=120)
+    store.start_sweeper(interval=0.05)
+    try:
+        deadline = time.time() + 5
+        while store.path_for("old", "result.xlsx") and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        store.stop_sweeper()
+    assert store.path_for("old", "result.xlsx") is None
@@ -0,0 +1,65 @@
+# test_row_engine.py
+import pytest
+import row_engine
+from metrics import ProcessorStats
+from row_engine import ParsedRow, SectionRow, ITEM
+from handlers.smeta_ru.processor import SMETA_RU_RULES
+from handlers.turbosmetchik.processor_1 import TURBOSMETCHIK_1_RULES
+
+
+def test_parsed_row_is_slotted_with_integer_cells():
+    record = ParsedRow(ITEM, 7)
+    with pytest.raises(AttributeError):
+        record.extra = 1 # __slots__: у записи нет __dict__
+    assert (record.anchor_row, record.anchor_col, record.total_row, record.closed) == (None, None, None, False)
+    record.set_total((8, 21), value=150.0)
+    assert (record.total_row, record.total_col, record.total_value) == (8, 21, 150.0)
+    record.set_total(None)
+    assert (record.total_row, record.total_col) == (None, None)
+
+
+def test_coordinates_are_built_only_when_rendered():
+    item = ParsedRow(ITEM, 12)
+    item.set_total((13, 21), value=99.5)
+    header = ParsedRow("section", 10, anchor=(10, 0), text="Раздел 1")
+    header.set_total((40, 21), value=1000)
+    stats = ProcessorStats()
+    rows = row_engine._render_rows(TURBOSMETCHIK_1_RULES, 23, [header, item], stats)
+    assert rows == [["A10", None, "Раздел 1", None, None, "V40"], ["A12", "B12", "D12", "L12", "M12", "V13"]]
+    assert isinstance(rows[0], SectionRow) and rows[0].kind == "section"
+    assert not isinstance(rows[1], SectionRow)
+    assert (stats.counters["items"], stats.counters["headers"]) == (1, 1)
+
+
+def test_zero_totals_are_skipped_when_rendered():
+    item = ParsedRow(ITEM, 5)
+    item.set_total((6, 8), value=0)
+    stats = ProcessorStats()
+    assert row_engine._render_rows(SMETA_RU_RULES, 11, [item], stats) == []
+    assert stats.counters["zero_price_skips"] == 1
+
+
+def test_ordered_rows_wait_for_the_first_open_row():
+    ordered = row_engine.OrderedRows()
+    section = ordered.reserve(ParsedRow("section", 2, anchor=(2, 0), text="Раздел 1"))
+    first = ordered.reserve(ParsedRow(ITEM, 3))
+    second = ordered.reserve(ParsedRow(ITEM, 5))
+    first.closed = second.closed = True
+    ordered.flush()
+    assert ordered.take() == [] # Раздел еще открыт (нет итога) - позиции после него ждут
+    section.closed = True
+    ordered.flush()
+    assert ordered.take() == [section, first, second] # Порядок строк листа, без сортировки
+    assert ordered.take() == []
+
+
+def test_ordered_rows_release_closed_prefix():
+    ordered = row_engine.OrderedRows()
+    first = ordered.reserve(ParsedRow(ITEM, 3))
+    second = ordered.reserve(ParsedRow(ITEM, 5))
+    first.closed = True
+    ordered.flush()
+    assert ordered.take() == [first]
+    second.closed = True
+    ordered.flush()
+    assert ordered.take() == [second]
@@ -0,0 +1,62 @@
+# test_sheet_reader.py
+import re
+import zipfile
+import openpyxl
+import pytest
+from sheet_reader import open_first_sheet
+
+
+def _workbook(path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["№ п/п", "Шифр", "Наименование"])
+    for row in range(2, 40):
+        sheet.append([row, f"ФЕР{row}", "Работы", "м3", row * 1.5, 0, row * 10])
+    sheet["B5"] = "значение под объединением" # Не левая верхняя ячейка - в полном режиме это MergedCell
+    sheet.merge_cells("A5:G5")
+    sheet.merge_cells("D10:E12")
+    sheet.merge_cells("F30:H30") # Объединение шире данных - входит в размеры листа
+    workbook.save(path)
+
+
+def _replace_dimension(path, ref):
+    """Заменяет <dimension> листа: ref None - удаляет его."""
+    dimension = f'<dimension ref="{ref}"/>'.encode("ascii") if ref else b""
+    with zipfile.ZipFile(path) as source:
+        items = [(info, source.read(info.filename)) for info in source.infolist()]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as target:
+        for info, data in items:
+            if info.filename.startswith("xl/worksheets/"):
+                data = re.sub(rb"<dimension [^>]*/>", dimension, data)
+            target.writestr(info, data)
+
+
+def _merge_refs(sheet):
+    return sorted(set(sheet.merge_index._by_key.values()))
+
+
+def _full_mode(path):
+    sheet = openpyxl.load_workbook(path).active
+    merges = sorted(str(merged) for merged in sheet.merged_cells.ranges)
+    values = [[cell.value for cell in row] for row in sheet.iter_rows(min_row=2)]
+    return merges, sheet.max_row, sheet.max_column, values
+
+
+@pytest.mark.parametrize("dimension", ["as saved", None, "A1:C3"], ids=["dimension", "no-dimension", "stale-dimension"])
+def test_matches_full_mode(tmp_path, dimension):
+    path = str(tmp_path / "sheet.xlsx")
+    _workbook(path)
+    if dimension != "as saved":
+        _replace_dimension(path, dimension)
+    merges, max_row, max_column, values = _full_mode(path)
+    with open_first_sheet(path) as sheet:
+        assert _merge_refs(sheet) == merges
+        assert (sheet.max_row, sheet.max_column) == (max_row, max_column)
+        assert [[cell.value for cell in row_cells] for _row_num, row_cells in sheet.iter_rows()] == values
+
+
+def test_merge_rows_reads_only_top_merges(tmp_path):
+    path = str(tmp_path / "sheet.xlsx")
+    _workbook(path)
+    with open_first_sheet(path, merge_rows=10) as sheet:
+        assert _merge_refs(sheet) == ["A5:G5", "D10:E12"]
@@ -0,0 +1,47 @@
+# test_status_store.py
+import time
+import pytest
+import status_store
+from status_store import MemoryStatusStore, SQLiteStatusStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryStatusStore(**kwargs)
+        return SQLiteStatusStore(path=str(tmp_path / "status.sqlite3"), **kwargs)
+    return make
+
+
+def test_update_is_one_write(make_store, monkeypatch):
+    store = make_store()
+    status = store.create("job", {"processed": 0, "status": ""})
+    puts = []
+    original_put = store.put
+    monkeypatch.setattr(store, "put", lambda job_id, data: (puts.append(job_id), original_put(job_id, data)))
+    status["timings"] = {"elapsed": 1.0} # Только в словаре - без записи в хранилище
+    assert puts == []
+    status.update({"processed": 1, "status": "Обработано файлов 1 из 2"})
+    assert puts == ["job"]
+    assert store.get("job") == {"processed": 1, "status": "Обработано файлов 1 из 2", "timings": {"elapsed": 1.0}}
+
+
+def test_expired_status_is_not_returned(make_store, monkeypatch):
+    store = make_store(ttl_seconds=60)
+    store.create("job", {"status": "Готово"})
+    now = time.time()
+    monkeypatch.setattr(status_store.time, "time", lambda: now + 61)
+    assert store.get("job") is None
+
+
+def test_least_recently_updated_is_evicted(make_store, monkeypatch):
+    monkeypatch.setattr(status_store, "_SQLITE_SWEEP_INTERVAL", 0)
+    store = make_store(max_entries=2)
+    first = store.create("a", {"n": 0})
+    store.create("b", {"n": 0})
+    first.update({"n": 1}) # "a" обновлена позже "b"
+    store.create("c", {"n": 0})
+    assert store.get("b") is None
+    assert store.get("a") == {"n": 1} and store.get("c") == {"n": 0}
+    assert len(store) == 2
@@ -0,0 +1,52 @@
+# test_upload_stream.py
+import io
+import os
+import zipfile
+import pytest
+from upload_stream import receive_multipart_upload, UploadTooLargeError, MAX_FIELD_BYTES, UPLOAD_CHUNK_SIZE
+
+BOUNDARY = b"----test-boundary"
+
+
+def _multipart(fields, file_name, file_data):
+    body = b""
+    for name, value in fields.items():
+        body += (b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"" + name.encode() + b"\"\r\n\r\n"
+                 + value.encode() + b"\r\n")
+    body += (b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data; name=\"file\"; filename=\""
+             + file_name.encode() + b"\"\r\nContent-Type: application/zip\r\n\r\n" + file_data + b"\r\n")
+    return body + b"--" + BOUNDARY + b"--\r\n"
+
+
+def _zip_bytes(size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("dir/t1.xlsx", os.urandom(size)) # Несжимаемые данные - архив не меньше size
+    return buf.getvalue()
+
+
+def test_large_file_part_is_received(tmp_path):
+    # Тело в несколько сотен KB - больше MAX_FIELD_BYTES и больше блока чтения
+    data = _zip_bytes(600 * 1024)
+    assert len(data) > max(MAX_FIELD_BYTES, UPLOAD_CHUNK_SIZE)
+    body = _multipart({"client_session_id": "s1", "smeta_type": "Смета ру"}, "batch.zip", data)
+    upload = receive_multipart_upload(io.BytesIO(body), BOUNDARY, str(tmp_path), allowed_extensions={"zip"})
+    assert upload.fields == {"client_session_id": "s1", "smeta_type": "Смета ру"}
+    assert upload.filename == "batch.zip"
+    assert upload.size == len(data)
+    with open(upload.path, "rb") as f:
+        assert f.read() == data
+
+
+def test_oversized_form_field_is_rejected(tmp_path):
+    body = _multipart({"client_session_id": "x" * (MAX_FIELD_BYTES + 1)}, "batch.zip", _zip_bytes(1024))
+    with pytest.raises(UploadTooLargeError):
+        receive_multipart_upload(io.BytesIO(body), BOUNDARY, str(tmp_path), allowed_extensions={"zip"})
+    assert os.listdir(tmp_path) == []
+
+
+def test_file_over_max_bytes_is_rejected(tmp_path):
+    body = _multipart({}, "batch.zip", _zip_bytes(300 * 1024))
+    with pytest.raises(UploadTooLargeError):
+        receive_multipart_upload(io.BytesIO(body), BOUNDARY, str(tmp_path), max_bytes=100 * 1024)
+    assert os.listdir(tmp_path) == [] # Недопринятый файл удален
@@ -0,0 +1,34 @@
+# test_values_mode.py
+import os
+import json
+import openpyxl
+import pytest
+import dispatcher
+from row_engine import OUTPUT_VALUES, OUTPUT_BOTH, output_headers
+from bench.generator import generate_workbook
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+with open(os.path.join(GOLDEN_DIR, "cases.json"), encoding="utf-8") as f:
+    CASES = json.load(f)
+
+TEXT_COLUMN = 2 # Текст заголовка раздела - значение в любом режиме
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_values_are_the_cells_behind_coordinates(tmp_path, case):
+    path = str(tmp_path / f"{case['name']}.xlsx")
+    generate_workbook(path, case["smeta_type"], **case["params"])
+    processor = dispatcher.PROCESSORS[case["smeta_type"]]
+    _headers, coords_rows = processor(path)
+    headers, values_rows = processor(path, OUTPUT_VALUES)
+    assert headers == output_headers(OUTPUT_VALUES)
+    sheet = openpyxl.load_workbook(path, data_only=True).worksheets[0] # Полный режим: MergedCell - без значения
+    expected = [[coord if i == TEXT_COLUMN and getattr(row, "kind", None) else
+                 (sheet[coord].value if coord else None) for i, coord in enumerate(row)] for row in coords_rows]
+    assert [list(row) for row in values_rows] == expected
+    assert [getattr(row, "kind", None) for row in values_rows] == [getattr(row, "kind", None) for row in coords_rows]
+
+    headers, both_rows = processor(path, OUTPUT_BOTH)
+    assert headers == output_headers(OUTPUT_BOTH)
+    assert [list(row) for row in both_rows] == [list(values) + list(coords)
+                                                for values, coords in zip(values_rows, coords_rows)]
@@ -0,0 +1,148 @@
+# upload_stream.py
+import os
+import uuid
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+# Прием загрузки (multipart/form-data) прямо из потока запроса: тело читается блоками,
+# файл пишется на диск по мере приема, без промежуточной копии Werkzeug (request.files).
+# Расширение, сигнатура ZIP и размер проверяются, как только для них хватает данных, а не после приема
+# всего тела. Оглавление ZIP (central directory) лежит в конце файла, поэтому по ходу приема оно не
+# проверяется: это делает archive_reader.check_upload сразу после приема, до постановки задачи в очередь.
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(200 * 1024 * 1024))) # 200 MB
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Обычные поля формы (ID сессии, тип сметы) - короткие строки
+MAX_FIELD_BYTES = 64 * 1024
+
+# xlsx/xlsm - тоже ZIP: любой допустимый файл начинается с локального заголовка ZIP
+_ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+class UploadError(ValueError):
+    """Загрузка отклонена (некорректный запрос или файл). status_code - HTTP код ответа."""
+    status_code = 400
+
+
+class UploadTooLargeError(UploadError):
+    status_code = 413
+
+
+class ReceivedUpload:
+    """Принятая загрузка: поля формы и файл, уже сохраненный на диск (path)."""
+    __slots__ = ("fields", "filename", "path", "size")
+
+    def __init__(self, fields, filename, path, size):
+        self.fields = fields
+        self.filename = filename
+        self.path = path
+        self.size = size
+
+
+def receive_multipart_upload(stream, boundary, temp_dir, file_field='file', allowed_extensions=None,
+                             max_bytes=UPLOAD_MAX_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Читает multipart/form-data из потока и сохраняет файл из поля file_field во временный файл в temp_dir.
+
+    Отказ происходит сразу, как только он становится известен:
+      - расширение файла - по заголовку части, до первого байта файла;
+      - сигнатура ZIP (xlsx/xlsm/zip) - по первым байтам файла;
+      - размер - по мере приема, как только файл превысил max_bytes.
+    Оглавление ZIP (central directory) лежит в конце архива - его проверяет вызывающий код
+    после приема (см. archive_reader.check_upload).
+
+    Args:
+        stream: Поток тела запроса (request.stream).
+        boundary (bytes): Граница частей из Content-Type.
+        temp_dir (str): Папка для временного файла (на том же диске, что и папка загрузок).
+        file_field (str): Имя поля с файлом.
+        allowed_extensions (set): Допустимые расширения (без точки, в нижнем регистре); None - любые.
+        max_bytes (int): Максимальный размер файла.
+        chunk_size (int): Размер блока чтения.
+
+    Returns:
+        ReceivedUpload
+
+    Raises:
+        UploadError: Нет файла, недопустимый тип или содержимое, некорректный запрос.
+        UploadTooLargeError: Файл больше max_bytes.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+    # Без max_form_memory_size: в Werkzeug это предел всего буфера декодера (части файла тоже) -
+    # размер обычных полей ограничивается ниже, по их собственным данным
+    decoder = MultipartDecoder(boundary)
+    fields = {}
+    filename = None
+    temp_path = None
+    output = None
+    size = 0
+    head = b''
+    part = None
+    field_chunks = None
+    field_size = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            decoder.receive_data(chunk or None) # None - конец тела
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part, field_chunks, field_size = event, [], 0
+                elif isinstance(event, File):
+                    part = event
+                    if event.name != file_field or output is not None:
+                        field_chunks = None # Лишние файлы не сохраняем
+                    else:
+                        filename = event.filename or ''
+                        _check_extension(filename, allowed_extensions)
+                        temp_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}.part")
+                        output = open(temp_path, 'wb')
+                        field_chunks = output
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        field_size += len(event.data)
+                        if field_size > MAX_FIELD_BYTES:
+                            raise UploadTooLargeError(f"Поле формы '{part.name}' больше {MAX_FIELD_BYTES // 1024} KB.")
+                        field_chunks.append(event.data)
+                        if not event.more_data:
+                            fields[part.name] = b''.join(field_chunks).decode('utf-8', 'replace')
+                    elif field_chunks is not None: # Данные сохраняемого файла
+                        size += len(event.data)
+                        if size > max_bytes:
+                            raise UploadTooLargeError(f"Файл больше допустимого размера ({max_bytes // (1024 * 1024)} MB).")
+                        if len(head) < len(_ZIP_SIGNATURE):
+                            head += event.data[:len(_ZIP_SIGNATURE)]
+                            if len(head) >= len(_ZIP_SIGNATURE) and not head.startswith(_ZIP_SIGNATURE):
+                                raise UploadError("Файл не является книгой Excel или ZIP архивом.")
+                        output.write(event.data)
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not chunk:
+                break
+        if output is None:
+            raise UploadError("Файл не выбран")
+        if size < len(_ZIP_SIGNATURE):
+            raise UploadError("Файл пустой или не является книгой Excel или ZIP архивом.")
+        output.close()
+        return ReceivedUpload(fields, filename, temp_path, size)
+    except BaseException as e:
+        if output is not None: # Недопринятый файл не оставляем
+            output.close()
+            _remove(temp_path)
+        if isinstance(e, ValueError) and not isinstance(e, UploadError):
+            raise UploadError(f"Некорректный запрос загрузки: {e}") from e # Ошибки разбора multipart
+        raise
+
+
+def _check_extension(filename, allowed_extensions):
+    if not filename:
+        raise UploadError("Файл не выбран")
+    if allowed_extensions is None:
+        return
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+        raise UploadError(f"Недопустимый тип файла: {filename}.")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,35 +1,89 @@
 # utils.py
 import re
+import weakref
+from openpyxl.utils import get_column_letter
 
 def is_likely_empty(value):
     """Проверяет, является ли значение 'пустым' для целей парсинга."""
-    # 0 не считается пустым
-    if value == 0: return False
-    return value is None or str(value).strip() == ""
+    if value is None: return True
+    if isinstance(value, str): return not value.strip()
+    # Числа (0 не считается пустым), даты и прочие значения ячеек - не пустые
+    return False
+
+class MergeIndex:
+    """
+    Индекс объединенных ячеек листа, строится ОДИН раз на лист.
+    Ключ - (строка, start_col_idx, end_col_idx) с 0-based индексами столбцов,
+    значение - координата объединенной ячейки (e.g., 'A5:K5').
+    Поиск по индексу - O(1) вместо перебора всех диапазонов листа.
+    lookups - число поисков (счетчик для метрик).
+    multirow_anchors - {строка: [(0-based колонка, последняя строка объединения)]} левые верхние ячейки
+    объединений в несколько строк (значение такой ячейки нужно и на следующих строках объединения).
+    """
+    __slots__ = ("_by_key", "lookups", "multirow_anchors")
+
+    def __init__(self):
+        self._by_key = {}
+        self.lookups = 0
+        self.multirow_anchors = {}
+
+    def add(self, min_row, max_row, min_col, max_col, coord):
+        """Добавляет диапазон (индексы openpyxl, 1-based) во все строки, которые он покрывает."""
+        start_col_idx = min_col - 1
+        end_col_idx = max_col - 1
+        if max_row > min_row:
+            self.multirow_anchors.setdefault(min_row, []).append((start_col_idx, max_row))
+        for row in range(min_row, max_row + 1):
+            # Как и при линейном поиске, выигрывает первый найденный диапазон
+            self._by_key.setdefault((row, start_col_idx, end_col_idx), coord)
+
+    def lookup(self, row, start_col_idx, end_col_idx):
+        """Возвращает координату объединенной ячейки или None."""
+        self.lookups += 1
+        return self._by_key.get((row, start_col_idx, end_col_idx))
+
+    def __len__(self):
+        return len(self._by_key)
+
+# Кэш индексов для вызовов check_merge с листом вместо индекса (ключ - сам лист)
+_merge_index_cache = weakref.WeakKeyDictionary()
+
+def build_merge_index(worksheet):
+    """Строит MergeIndex по всем объединенным диапазонам листа (worksheet.merged_cells.ranges)."""
+    merge_index = MergeIndex()
+    for merged_range in worksheet.merged_cells.ranges:
+        merge_index.add(merged_range.min_row, merged_range.max_row,
+                        merged_range.min_col, merged_range.max_col, merged_range.coord)
+    return merge_index
 
 def check_merge(worksheet, row, start_col_idx, end_col_idx):
     """
     Проверяет, попадает ли ячейка в указанной строке (row)
     и диапазоне столбцов (start_col_idx - end_col_idx) в объединенную ячейку.
     Возвращает координату объединенной ячейки (e.g., 'A1:K1') или None.
+
+    Первым аргументом принимает готовый MergeIndex (быстрый путь для процессоров)
+    или сам лист - тогда индекс строится при первом вызове и кэшируется для листа.
     """
-    start_col = start_col_idx + 1  # Индексы openpyxl начинаются с 1
-    end_col = end_col_idx + 1
     try:
-        # Проходим по всем диапазонам объединенных ячеек на листе
-        for merged_range in worksheet.merged_cells.ranges:
-            # Проверяем, входит ли наша строка в диапазон строк объединенной ячейки
-            if merged_range.min_row <= row <= merged_range.max_row:
-                # Проверяем, совпадают ли начальный и конечный столбцы
-                if merged_range.min_col == start_col and merged_range.max_col == end_col:
-                    return merged_range.coord  # Возвращаем координаты, например 'A5:K5'
+        merge_index = worksheet
+        if not isinstance(merge_index, MergeIndex):
+            merge_index = _merge_index_cache.get(worksheet)
+            if merge_index is None:
+                merge_index = build_merge_index(worksheet)
+                _merge_index_cache[worksheet] = merge_index
+        return merge_index.lookup(row, start_col_idx, end_col_idx)
     except Exception as e:
         # Логирование предупреждения вместо print для лучшей интеграции
         # import logging
-        # logging.warning(f"Не удалось проверить merge для строки {row}, столбцы {start_col}-{end_col}. Ошибка: {e}")
-        print(f"  [WARN] Не удалось проверить merge для строки {row}, столбцы {start_col}-{end_col}. Ошибка: {e}")
+        # logging.warning(f"Не удалось проверить merge для строки {row}, столбцы {start_col_idx + 1}-{end_col_idx + 1}. Ошибка: {e}")
+        print(f"  [WARN] Не удалось проверить merge для строки {row}, столбцы {start_col_idx + 1}-{end_col_idx + 1}. Ошибка: {e}")
     return None # Если не найдено или произошла ошибка
 
+def cell_coordinate(row, col_idx):
+    """Координата ячейки по номеру строки и 0-based индексу колонки (57, 1 -> 'B57')."""
+    return f"{get_column_letter(col_idx + 1)}{row}"
+
 def get_start_coord(coord_str):
     """Возвращает начальную координату из диапазона ('A1:B2' -> 'A1') или саму координату."""
     if isinstance(coord_str, str) and ':' in coord_str:
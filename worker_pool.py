@@ -0,0 +1,123 @@
+# worker_pool.py
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Пул процессов, который живет, пока живет приложение (или пакетный запуск), вместо нового пула на каждую загрузку.
+# Процессы создаются через fork-сервер: отдельный однопоточный процесс, который один раз импортирует
+# openpyxl и процессоры (PRELOAD_MODULES); рабочие процессы ответвляются от него. fork прямо из
+# веб-приложения опасен: пул создается, когда там уже работают потоки (очередь задач, очистка,
+# SSE, SQLite хранилище статусов), и копия захваченной ими блокировки в процессе пула - это взаимная
+# блокировка. Процесс пула только разбирает файлы (dispatcher.run_processor_with_stats) - референсные
+# ширины колонок ему не нужны, их читает родитель при сборке итогового файла.
+# После max_tasks_per_child задач процесс заменяется новым (ProcessPoolExecutor(max_tasks_per_child)) -
+# так ограничивается рост памяти долгоживущих процессов.
+# Процессы fork-сервера (как и spawn) импортируют главный модуль как __mp_main__ - при запуске
+# "python app.py" фоновые службы приложения в них не запускаются (см. app.IS_POOL_WORKER).
+
+# Настройки по умолчанию (переопределяются переменными окружения)
+WORKER_MAX_TASKS_PER_CHILD = int(os.environ.get('WORKER_MAX_TASKS_PER_CHILD', '200')) # 0 - без замены процессов
+WORKER_START_METHOD = os.environ.get('WORKER_START_METHOD', 'forkserver') # forkserver | spawn | fork
+
+# Модули, которые fork-сервер импортирует один раз (процессоры регистрирует dispatcher)
+PRELOAD_MODULES = ("openpyxl", "dispatcher")
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+class WorkerPool:
+    """
+    Долгоживущий пул процессов поверх ProcessPoolExecutor.
+
+    Исполнитель создается при первой задаче (или в start()). Если процесс пула упал
+    (BrokenProcessPool), следующая задача создает исполнитель заново - задачи, которые
+    были в упавшем пуле, завершаются ошибкой, как и раньше.
+    """
+
+    def __init__(self, max_workers, max_tasks_per_child=WORKER_MAX_TASKS_PER_CHILD, start_method=WORKER_START_METHOD):
+        self.max_workers = max(1, max_workers)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Отправляет задачу в пул. Возвращает Future."""
+        executor = self._get_executor()
+        try:
+            return executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._reset(executor)
+            return self._get_executor().submit(fn, *args, **kwargs)
+
+    def start(self):
+        """Запускает все процессы пула заранее (иначе они создаются по мере задач)."""
+        executor = self._get_executor()
+        futures = [executor.submit(_ping) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def start_in_background(self):
+        """start() в фоновом потоке: запуск приложения не ждет запуска пула."""
+        thread = threading.Thread(target=self._start_logged, name="worker-pool-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def _start_logged(self):
+        try:
+            self.start()
+            print(f"Пул процессов готов: {self.max_workers} процесс(ов), запуск через {self.start_method}")
+        except Exception as e:
+            print(f"[WARN] Не удалось запустить пул процессов: {e}")
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = _pool_context(self.start_method)
+                # max_tasks_per_child несовместим с fork - там процессы живут, пока жив пул
+                max_tasks_per_child = self.max_tasks_per_child if context.get_start_method() != 'fork' else None
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                     max_tasks_per_child=max_tasks_per_child)
+            return self._executor
+
+    def _reset(self, broken_executor):
+        with self._lock:
+            if self._executor is broken_executor:
+                self._executor = None
+        broken_executor.shutdown(wait=False)
+
+
+def get_shared_pool(max_workers):
+    """
+    Общий пул процессов приложения (создается при первом вызове).
+
+    Размер пула задается первым вызовом; вызывающий код, которому нужно меньше процессов,
+    сам ограничивает число своих задач в полете (dispatcher.run_processors).
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = WorkerPool(max_workers)
+        return _shared_pool
+
+
+def _pool_context(start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        start_method = 'spawn' # Например, forkserver на Windows
+    context = multiprocessing.get_context(start_method)
+    if start_method == 'forkserver':
+        context.set_forkserver_preload(list(PRELOAD_MODULES))
+    return context
+
+
+def _ping():
+    return os.getpid()